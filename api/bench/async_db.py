@@ -0,0 +1,119 @@
+"""
+Requests/sec for an async route on a sync Session (old approvals/cancellations path)
+vs the same route on AsyncSession.
+
+    python -m api.bench.async_db --clients 128 --requests 4000
+
+Boots a throwaway uvicorn server on a temp SQLite file (or DATABASE_URL if set
+before import), seeds a subscription, then hammers both variants with N
+concurrent httpx clients. Each request does what decide() does: one SELECT,
+one INSERT into event_logs, one COMMIT. A /ping probe runs alongside to show how
+long other requests wait on a blocked event loop.
+"""
+import argparse, asyncio, os, statistics, tempfile, threading, time
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+
+import httpx
+import uvicorn
+from fastapi import Depends, FastAPI
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from ..db import Base, engine, get_async_db, get_db
+from .. import models  # noqa: F401  (registers tables)
+
+app = FastAPI()
+
+INSERT = text("INSERT INTO event_logs (user_id, type, message, payload) VALUES (1, 'bench', 'x', '{}')")
+
+@app.post("/before")
+async def before(db: Session = Depends(get_db)):
+    row = db.execute(text("SELECT id FROM subscriptions WHERE id = 1")).mappings().first()
+    db.execute(INSERT)
+    db.commit()
+    return {"ok": bool(row)}
+
+@app.post("/after")
+async def after(db: AsyncSession = Depends(get_async_db)):
+    row = (await db.execute(text("SELECT id FROM subscriptions WHERE id = 1"))).mappings().first()
+    await db.execute(INSERT)
+    await db.commit()
+    return {"ok": bool(row)}
+
+@app.get("/ping")
+async def ping():
+    return {"ok": True}
+
+def pct(xs, p):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(len(xs) * p))] if xs else 0.0
+
+async def drive(base: str, path: str, clients: int, total: int):
+    lat, ping_lat = [], []
+    remaining = total
+    done = asyncio.Event()
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=60) as c:
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                t0 = time.perf_counter()
+                r = await c.post(path)
+                r.raise_for_status()
+                lat.append(time.perf_counter() - t0)
+
+        async def prober():
+            while not done.is_set():
+                t0 = time.perf_counter()
+                await c.get("/ping")
+                ping_lat.append(time.perf_counter() - t0)
+                await asyncio.sleep(0.01)
+
+        probe = asyncio.create_task(prober())
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        wall = time.perf_counter() - t0
+        done.set()
+        await probe
+    return {
+        "rps": len(lat) / wall,
+        "p50_ms": statistics.median(lat) * 1000,
+        "p99_ms": pct(lat, 0.99) * 1000,
+        "ping_p99_ms": pct(ping_lat, 0.99) * 1000,
+    }
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clients", type=int, default=128)
+    ap.add_argument("--requests", type=int, default=4000)
+    ap.add_argument("--port", type=int, default=8765)
+    a = ap.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT OR IGNORE INTO subscriptions (id, user_id, merchant) VALUES (1, 1, 'Bench')")
+                     if engine.dialect.name == "sqlite" else
+                     text("INSERT INTO subscriptions (id, user_id, merchant) VALUES (1, 1, 'Bench') ON CONFLICT DO NOTHING"))
+
+    server = uvicorn.Server(uvicorn.Config(app, port=a.port, log_level="warning"))
+    th = threading.Thread(target=server.run, daemon=True)
+    th.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    base = f"http://127.0.0.1:{a.port}"
+    print(f"db={engine.url.render_as_string(hide_password=True)} clients={a.clients} requests={a.requests}")
+    print(f"{'variant':>8} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'ping p99':>9}")
+    for name in ("before", "after"):
+        r = asyncio.run(drive(base, f"/{name}", a.clients, a.requests))
+        print(f"{name:>8} {r['rps']:>9.1f} {r['p50_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['ping_p99_ms']:>9.1f}")
+
+    server.should_exit = True
+    th.join(timeout=5)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Cancellation engine load test against the in-process fake vendor.
+
+    python -m api.bench.cancel_load --subs 2000 --vendors 20 --latency-ms 50
+
+Seeds a temp SQLite database with --subs subscriptions spread over --vendors merchants,
+queues a cancellation for each (the same bulk path /approvals/batch uses), then runs
+the engine until every request is closed. Prints end-to-end throughput, the outcome
+counts, and the peak concurrent calls the fake vendor saw per vendor next to the cap.
+"""
+import argparse, asyncio, os, sys, tempfile, time
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--subs", type=int, default=2000)
+    ap.add_argument("--vendors", type=int, default=20)
+    ap.add_argument("--latency-ms", type=float, default=50)
+    ap.add_argument("--error-rate", type=float, default=0.02)
+    ap.add_argument("--refuse-rate", type=float, default=0.01)
+    ap.add_argument("--confirm-s", type=float, default=1.0)
+    ap.add_argument("--workers", type=int, default=64)
+    ap.add_argument("--vendor-concurrency", type=int, default=4)
+    ap.add_argument("--vendor-rate", type=float, default=50)
+    a = ap.parse_args()
+
+    # the engine and fake vendor read their knobs at import
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench.db")
+    os.environ.update({
+        "FAKE_VENDOR_LATENCY_MS": str(a.latency_ms), "FAKE_VENDOR_ERROR_RATE": str(a.error_rate),
+        "FAKE_VENDOR_REFUSE_RATE": str(a.refuse_rate), "FAKE_VENDOR_CONFIRM_S": str(a.confirm_s),
+        "CANCEL_VENDOR_CONCURRENCY": str(a.vendor_concurrency), "CANCEL_VENDOR_RATE": str(a.vendor_rate),
+        "CANCEL_VERIFY_DELAY_S": str(a.confirm_s / 2), "CANCEL_RETRY_S": "0.2", "CANCEL_POLL_INTERVAL": "0.1",
+        "CANCEL_ENGINE": "0", "CANCEL_ADAPTER": "fake", "RENEWAL_SCHEDULER": "0",
+    })
+    from ..main import app  # noqa: F401 -- creates/upgrades the schema
+    from ..db import SessionLocal, dispose_async_engine, get_async_sessionmaker
+    from ..models import User, Subscription
+    from ..routers.cancellations import start_cancellations
+    from ..utils.cancel_engine import CancelEngine, adapter_for
+    from ..utils.log import event_sink
+
+    # one subscription per vendor per user, like real data (and the unique constraint)
+    users = -(-a.subs // a.vendors)
+    db = SessionLocal()
+    db.add_all(User(id=u, email=f"u{u}@bench.dev", pw_hash="x") for u in range(1, users + 1))
+    db.flush()
+    db.add_all(Subscription(user_id=1 + i // a.vendors, merchant=f"Vendor {i % a.vendors}", amount=9.99,
+                            interval="monthly") for i in range(a.subs))
+    db.commit()
+    by_user = {}
+    for sid, uid, m in db.query(Subscription.id, Subscription.user_id, Subscription.merchant):
+        by_user.setdefault(uid, {})[sid] = m
+    db.close()
+
+    async def run():
+        t0 = time.perf_counter()
+        async with get_async_sessionmaker()() as s:
+            for uid, subs in by_user.items():
+                await start_cancellations(s, uid, subs)
+            await s.commit()
+        queued_s = time.perf_counter() - t0
+        engine = CancelEngine(workers=a.workers)
+        await engine.start()
+        t1 = time.perf_counter()
+        while True:
+            await asyncio.sleep(0.25)
+            st = await engine.stats()
+            sys.stdout.write(f"\r  open: pending {st['pending']:6d}  in_progress {st['in_progress']:6d}  "
+                             f"succeeded {st.get('succeeded', 0):6d}  failed {st.get('failed', 0):5d}")
+            sys.stdout.flush()
+            if st["pending"] == 0 and st["in_progress"] == 0:
+                break
+        run_s = time.perf_counter() - t1
+        await engine.stop()
+        await dispose_async_engine()
+        return queued_s, run_s, st
+
+    queued_s, run_s, st = asyncio.run(run())
+    event_sink.stop()
+    fake = adapter_for("vendor_0")
+    peaks = sorted(fake.peak.values())
+    print()
+    print(f"subs={a.subs} vendors={a.vendors} workers={a.workers} latency={a.latency_ms}ms "
+          f"confirm={a.confirm_s}s errors={a.error_rate} refusals={a.refuse_rate}")
+    print(f"queue {a.subs} requests: {queued_s:.2f}s   drain: {run_s:.2f}s   "
+          f"{a.subs / run_s:.0f} cancellations/s end to end")
+    print(f"outcomes: succeeded {st.get('succeeded', 0)}  failed {st.get('failed', 0)}  "
+          f"retried {st.get('retried', 0)}  checks {st.get('checks', 0)}  vendor calls {fake.calls}")
+    print(f"peak concurrent calls per vendor: max {peaks[-1]} (cap {a.vendor_concurrency})   "
+          f"throttled: {sum(v['throttled_s'] for v in st['vendors'].values()):.1f}s total")
+
+if __name__ == "__main__":
+    main()
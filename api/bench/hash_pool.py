@@ -0,0 +1,71 @@
+"""
+Login hashing throughput at different pool sizes.
+
+    python -m api.bench.hash_pool --sizes 1,2,4,8 --clients 32 --logins 200
+
+Each client thread loops bcrypt verifies through HashPool.run() (the same pool
+/auth/login awaits with run_async). Reports logins/sec, p50/p99 latency (queue wait included) and
+how many requests were shed with 503.
+"""
+import argparse, statistics, threading, time
+from fastapi import HTTPException
+from passlib.context import CryptContext
+from ..utils.security import HashPool
+
+def pct(xs, p):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(len(xs) * p))] if xs else 0.0
+
+def run(size: int, clients: int, logins: int, queue_limit: int, ctx: CryptContext, h: str):
+    pool = HashPool(size=size, queue_limit=queue_limit)
+    lat, shed = [], 0
+    lock = threading.Lock()
+    per_client = max(1, logins // clients)
+
+    def client():
+        nonlocal shed
+        for _ in range(per_client):
+            t0 = time.perf_counter()
+            try:
+                pool.run(ctx.verify, "hunter2", h)
+            except HTTPException:
+                with lock:
+                    shed += 1
+                continue
+            with lock:
+                lat.append(time.perf_counter() - t0)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    t0 = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    wall = time.perf_counter() - t0
+    pool.shutdown()
+    return {
+        "size": size,
+        "ok": len(lat),
+        "shed": shed,
+        "logins_per_s": len(lat) / wall,
+        "p50_ms": statistics.median(lat) * 1000 if lat else 0.0,
+        "p99_ms": pct(lat, 0.99) * 1000,
+    }
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="1,2,4,8")
+    ap.add_argument("--clients", type=int, default=32)
+    ap.add_argument("--logins", type=int, default=200)
+    ap.add_argument("--rounds", type=int, default=12)
+    ap.add_argument("--queue-limit", type=int, default=1000, help="lower it to see load shedding")
+    a = ap.parse_args()
+
+    ctx = CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=a.rounds)
+    h = ctx.hash("hunter2")
+    print(f"bcrypt rounds={a.rounds} clients={a.clients} logins={a.logins} queue_limit={a.queue_limit}")
+    print(f"{'pool':>5} {'ok':>6} {'shed':>6} {'logins/s':>10} {'p50 ms':>9} {'p99 ms':>9}")
+    for size in [int(x) for x in a.sizes.split(",")]:
+        r = run(size, a.clients, a.logins, a.queue_limit, ctx, h)
+        print(f"{r['size']:>5} {r['ok']:>6} {r['shed']:>6} {r['logins_per_s']:>10.1f} {r['p50_ms']:>9.1f} {r['p99_ms']:>9.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Offline load test of the Plaid flows through the shared PlaidClient.
+
+    uvicorn api.dev.fake_plaid:app --port 8001 &
+    python -m api.bench.plaid_load --base http://localhost:8001 --users 200 --concurrency 50
+
+Each simulated user runs link_token -> sandbox public token -> exchange ->
+one /transactions/get page. Prints flows/sec and per-endpoint latency/retries.
+"""
+import argparse, asyncio, time
+from datetime import date, timedelta
+from ..utils.plaid_client import PlaidClient, plaid_stats
+
+async def flow(c: PlaidClient, uid: int):
+    await c.post("/link/token/create", {
+        "user": {"client_user_id": str(uid)}, "client_name": "load",
+        "products": ["transactions"], "country_codes": ["US"], "language": "en",
+    })
+    pt = (await c.post("/sandbox/public_token/create", {"institution_id": "ins_1", "initial_products": ["transactions"]}))["public_token"]
+    at = (await c.post("/item/public_token/exchange", {"public_token": pt}))["access_token"]
+    today = date.today()
+    await c.post("/transactions/get", {
+        "access_token": at,
+        "start_date": (today - timedelta(days=90)).isoformat(),
+        "end_date": today.isoformat(),
+        "options": {"count": 500, "offset": 0},
+    })
+
+async def run(a):
+    c = PlaidClient(base=a.base, client_id="fake", secret="fake",
+                    max_connections=a.concurrency, concurrency=a.concurrency)
+    sem = asyncio.Semaphore(a.concurrency)
+    failures = 0
+
+    async def one(uid):
+        nonlocal failures
+        async with sem:
+            try:
+                await flow(c, uid)
+            except Exception:
+                failures += 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(a.users)))
+    wall = time.perf_counter() - t0
+    await c.aclose()
+    print(f"users={a.users} concurrency={a.concurrency} wall={wall:.2f}s flows/s={(a.users - failures) / wall:.1f} failures={failures}")
+    print(f"{'endpoint':<32} {'count':>6} {'errors':>6} {'retries':>7} {'avg ms':>8} {'max ms':>8}")
+    for path, s in plaid_stats().items():
+        print(f"{path:<32} {s['count']:>6} {s['errors']:>6} {s['retries']:>7} {s['avg_ms']:>8.1f} {s['max_ms']:>8.1f}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--base", default="http://localhost:8001")
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=50)
+    asyncio.run(run(ap.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Per-row cost of the list endpoints' read path, old vs new.
+
+    python -m api.bench.serialization --sizes 10 100 10000
+
+Seeds a temp SQLite database with one user holding max(--sizes) subscriptions and as
+many events, then times building the response body for the first N rows both ways:
+  old: ORM objects -> SubscriptionOut validation -> jsonable_encoder -> json.dumps
+       (what response_model did), and hand-built event dicts through the same encoder
+  new: column-projected Core rows -> orjson bytes (what the routers do now)
+Prints the best-of-runs time per request and per row for each size.
+"""
+import argparse, json, os, tempfile, time
+from datetime import datetime, timedelta
+
+def best(fn, min_s: float) -> float:
+    """Best time of repeated calls, running for at least min_s."""
+    fn()  # warm up (statement cache, adapters)
+    times, spent = [], 0.0
+    while spent < min_s or len(times) < 5:
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+        spent += times[-1]
+    return min(times)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 10000])
+    ap.add_argument("--min-s", type=float, default=1.0, help="time spent per measurement")
+    a = ap.parse_args()
+
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench.db")
+    os.environ.update({"CANCEL_ENGINE": "0", "RENEWAL_SCHEDULER": "0"})
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import ORJSONResponse
+    from pydantic import TypeAdapter
+    from sqlalchemy import insert, select
+    from ..main import app  # noqa: F401 -- creates/upgrades the schema
+    from ..db import SessionLocal, json_bytes
+    from ..models import EventLog, Subscription, User
+    from ..schemas import SubscriptionOut
+    from ..utils.log import event_sink
+    from ..utils.subs import user_subs
+
+    n_max = max(a.sizes)
+    now = datetime.utcnow()
+    db = SessionLocal()
+    db.add(User(id=1, email="bench@bench.dev", pw_hash="x"))
+    db.flush()
+    db.execute(insert(Subscription), [
+        {"user_id": 1, "merchant": f"Merchant {i}", "plan": "Standard" if i % 3 else None, "amount": 4.99 + i % 50,
+         "interval": "monthly", "next_renewal_at": now + timedelta(hours=i)} for i in range(n_max)
+    ])
+    db.execute(insert(EventLog), [
+        {"user_id": 1, "type": "approval.approve", "message": f"approve sub {i}", "payload": {"subscription_id": i},
+         "created_at": now - timedelta(seconds=i)} for i in range(n_max)
+    ])
+    db.commit()
+    db.close()
+
+    subs_out = TypeAdapter(list[SubscriptionOut])
+    E = EventLog
+    events_q = select(E.id, E.type, E.message, E.created_at).where(E.user_id == 1).order_by(E.id.desc())
+
+    def subs_old(n):
+        with SessionLocal() as s:
+            objs = s.query(Subscription).filter_by(user_id=1).order_by(Subscription.id).limit(n).all()
+            return json.dumps(jsonable_encoder(subs_out.dump_python(subs_out.validate_python(objs)))).encode()
+
+    def subs_new(n):
+        with SessionLocal() as s:
+            return json_bytes([dict(r) for r in s.execute(user_subs(1).limit(n)).mappings()])
+
+    def events_old(n):
+        with SessionLocal() as s:
+            rows = s.execute(events_q.limit(n)).all()
+            out = [{"id": r.id, "type": r.type, "message": r.message, "created_at": r.created_at.isoformat()} for r in rows]
+            return json.dumps(jsonable_encoder(out)).encode()
+
+    def events_new(n):
+        with SessionLocal() as s:
+            return ORJSONResponse([dict(r) for r in s.execute(events_q.limit(n)).mappings()]).body
+
+    # same bytes either way (modulo whitespace)
+    for old, new in ((subs_old, subs_new), (events_old, events_new)):
+        assert json.loads(old(min(a.sizes))) == json.loads(new(min(a.sizes))), old.__name__
+
+    print(f"{'path':<8} {'rows':>6}  {'old ms':>9} {'new ms':>9}  {'old us/row':>10} {'new us/row':>10}  speedup")
+    for name, old, new in (("subs", subs_old, subs_new), ("events", events_old, events_new)):
+        for n in a.sizes:
+            t_old, t_new = best(lambda: old(n), a.min_s), best(lambda: new(n), a.min_s)
+            print(f"{name:<8} {n:>6}  {t_old * 1e3:9.2f} {t_new * 1e3:9.2f}  "
+                  f"{t_old / n * 1e6:10.2f} {t_new / n * 1e6:10.2f}  {t_old / t_new:6.1f}x")
+    event_sink.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Live event stream load test: how many idle SSE clients one worker holds, and how long
+an event takes to reach all of them.
+
+    python -m api.bench.sse_load --clients 2000 --events 50
+
+Boots the real app under uvicorn in a thread on a temp SQLite file, opens N
+/events/stream connections for one user, then writes events through the event sink
+(log_event) and times write -> received at every client. The sink's batching
+(EVENT_FLUSH_MS) is part of the measured latency, as it is in production.
+"""
+import argparse, asyncio, json, os, resource, statistics, tempfile, threading, time
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+
+import httpx
+import uvicorn
+
+from ..main import app
+from ..db import SessionLocal
+from ..utils.log import log_event
+from ..utils.pubsub import broker
+
+def pct(xs, p):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(len(xs) * p))] if xs else 0.0
+
+async def run(base: str, token: str, clients: int, events: int, gap: float):
+    lat = []
+    got = [0] * clients
+    ready = asyncio.Event()
+    connected = 0
+    limits = httpx.Limits(max_connections=clients + 10, max_keepalive_connections=0)
+    timeout = httpx.Timeout(60, read=None)
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=timeout) as c:
+        async def listen(i: int):
+            nonlocal connected
+            async with c.stream("GET", f"/events/stream?token={token}") as r:
+                r.raise_for_status()
+                connected += 1
+                if connected == clients:
+                    ready.set()
+                async for line in r.aiter_lines():
+                    if line.startswith("data: "):
+                        ev = json.loads(line[6:])
+                        lat.append(time.perf_counter() - float(ev["message"]))
+                        got[i] += 1
+                        if got[i] == events:
+                            return
+
+        t0 = time.perf_counter()
+        tasks = [asyncio.create_task(listen(i)) for i in range(clients)]
+        await asyncio.wait_for(ready.wait(), 300)
+        connect_s = time.perf_counter() - t0
+        # server-side view; the stream registers before its first byte goes out
+        while broker.clients < clients:
+            await asyncio.sleep(0.05)
+
+        db = SessionLocal()
+        for _ in range(events):
+            log_event(db, 1, "bench.tick", repr(time.perf_counter()))
+            await asyncio.sleep(gap)
+        db.close()
+        await asyncio.wait_for(asyncio.gather(*tasks), 120)
+    return connect_s, lat, sum(got)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clients", type=int, default=1000)
+    ap.add_argument("--events", type=int, default=20)
+    ap.add_argument("--gap", type=float, default=0.05, help="seconds between events")
+    ap.add_argument("--port", type=int, default=8766)
+    a = ap.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    need = a.clients * 2 + 256  # client + server socket per stream, in one process
+    if soft < need:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(need, hard), hard))
+
+    server = uvicorn.Server(uvicorn.Config(app, port=a.port, log_level="warning", backlog=4096))
+    th = threading.Thread(target=server.run, daemon=True)
+    th.start()
+    while not server.started:
+        time.sleep(0.05)
+    base = f"http://127.0.0.1:{a.port}"
+
+    token = httpx.post(f"{base}/auth/signup", json={"email": "sse@bench.dev", "password": "pw"}).json()["access_token"]
+    rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    connect_s, lat, n = asyncio.run(run(base, token, a.clients, a.events, a.gap))
+    rss1 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print(f"clients={a.clients} events={a.events} deliveries={n}/{a.clients * a.events}")
+    print(f"connect all: {connect_s:.2f}s   peak rss growth: {(rss1 - rss0) / 1024:.1f} MiB "
+          f"(~{(rss1 - rss0) / max(a.clients, 1):.1f} KiB/client, client side included)")
+    print(f"fan-out latency ms: p50 {statistics.median(lat) * 1000:.1f}  p99 {pct(lat, 0.99) * 1000:.1f}  "
+          f"max {max(lat) * 1000:.1f}")
+    print(f"broker: {broker.stats()}")
+
+    server.should_exit = True
+    th.join(timeout=5)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Cold-start cost of `import api.main`, broken down by module, with a regression check.
+
+    python -m api.bench.startup                       # report
+    python -m api.bench.startup --check               # compare with HEAD; exit 1 on a regression
+    python -m api.bench.startup --check --against origin/main
+    python -m api.bench.startup --save base.json      # keep a measurement ...
+    python -m api.bench.startup --check --baseline base.json   # ... and compare with it later
+
+Migrates a temp SQLite database once, then boots --runs fresh interpreters under
+`python -X importtime` against it (the warm-instance case: schema already up to date).
+Reports the median total import time, the SQL statements run at import (migrations
+should be one SELECT), and the modules with the most self time -- our own modules by
+name, third-party ones summed per package.
+
+--check measures the baseline on the spot from a git revision (--against, exported
+with `git archive` into a temp dir), so both sides come from the same machine and run;
+no timings are committed. It flags: total import time more than --tolerance over the baseline, any module
+or package that grew by more than --tolerance and --min-ms, new statements at boot, and
+any of LAZY imported at boot at all.
+"""
+import argparse, io, json, os, re, statistics, subprocess, sys, tarfile, tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+LAZY = ("numpy", "httpx", "passlib")  # only loaded by the code paths that need them
+
+CHILD = """
+import json, time
+t0 = time.perf_counter()
+from sqlalchemy import event
+import api.db
+queries = []
+event.listen(api.db.engine, "before_cursor_execute", lambda c, cur, stmt, *a: queries.append(stmt))
+import api.main
+print(json.dumps({"total_ms": (time.perf_counter() - t0) * 1e3, "queries": queries}))
+"""
+
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+def group(name: str) -> str:
+    return name if name.startswith("api.") or name == "api" else name.split(".")[0]
+
+def boot(env: dict, root: Path) -> dict:
+    p = subprocess.run([sys.executable, "-X", "importtime", "-c", CHILD], env=env, cwd=root,
+                       capture_output=True, text=True, check=True)
+    out = json.loads(p.stdout.strip().splitlines()[-1])
+    groups = {}
+    for line in p.stderr.splitlines():
+        m = LINE.match(line)
+        if m:
+            g = group(m[4])
+            groups[g] = groups.get(g, 0) + int(m[1]) / 1e3
+    out["groups"] = groups
+    return out
+
+def measure(runs: int, root: Path = ROOT) -> dict:
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{tempfile.mkdtemp()}/startup.db",
+           "PYTHONPATH": str(root), "CANCEL_ENGINE": "0", "RENEWAL_SCHEDULER": "0"}
+    boot(env, root)  # first boot creates the schema; also warms the .pyc cache
+    results = [boot(env, root) for _ in range(runs)]
+    names = set().union(*(r["groups"] for r in results))
+    return {
+        "total_ms": statistics.median(r["total_ms"] for r in results),
+        "boot_queries": results[-1]["queries"],
+        "groups": {g: statistics.median(r["groups"].get(g, 0.0) for r in results) for g in sorted(names)},
+    }
+
+def checkout(rev: str) -> Path:
+    """The api package as of `rev`, in a temp dir."""
+    out = Path(tempfile.mkdtemp(prefix="startup-base-"))
+    tar = subprocess.run(["git", "archive", rev, "api"], cwd=ROOT, capture_output=True, check=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(tar)) as t:
+        t.extractall(out)
+    return out
+
+def regressions(cur: dict, base: dict, tol: float, min_ms: float) -> list:
+    out = []
+    if cur["total_ms"] > base["total_ms"] * (1 + tol):
+        out.append(f"total import {base['total_ms']:.0f} -> {cur['total_ms']:.0f} ms")
+    for g, ms in cur["groups"].items():
+        was = base["groups"].get(g, 0.0)
+        if ms - was > min_ms and ms > was * (1 + tol):
+            out.append(f"{g}: {was:.1f} -> {ms:.1f} ms")
+    if len(cur["boot_queries"]) > len(base["boot_queries"]):
+        out.append(f"boot SQL {len(base['boot_queries'])} -> {len(cur['boot_queries'])} statements")
+    out += [f"{g} is imported at boot" for g in LAZY if g in cur["groups"]]
+    return out
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=7)
+    ap.add_argument("--top", type=int, default=20)
+    ap.add_argument("--check", action="store_true", help="compare with a baseline; exit 1 on a regression")
+    ap.add_argument("--against", default="HEAD", help="git revision measured as the baseline (default HEAD)")
+    ap.add_argument("--baseline", type=Path, help="compare with a --save'd measurement instead of --against")
+    ap.add_argument("--save", type=Path, metavar="PATH", help="write this measurement as JSON")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="allowed relative growth")
+    ap.add_argument("--min-ms", type=float, default=5.0, help="ignore modules growing less than this")
+    a = ap.parse_args()
+
+    base = None
+    if a.baseline:
+        base = json.loads(a.baseline.read_text())
+    elif a.check:
+        print(f"measuring baseline at {a.against} ...")
+        base = measure(a.runs, checkout(a.against))
+    cur = measure(a.runs)
+    print(f"import api.main: {cur['total_ms']:.0f} ms median of {a.runs}   "
+          f"boot SQL: {len(cur['boot_queries'])} statement(s) {cur['boot_queries']}")
+    print(f"{'module / package':<40} {'self ms':>8} {'baseline':>9}")
+    for g, ms in sorted(cur["groups"].items(), key=lambda kv: -kv[1])[:a.top]:
+        was = f"{base['groups'].get(g, 0.0):9.1f}" if base else ""
+        print(f"{g:<40} {ms:8.1f} {was}")
+
+    if a.save:
+        a.save.write_text(json.dumps({**cur, "groups": {g: round(ms, 2) for g, ms in cur["groups"].items()},
+                                      "total_ms": round(cur["total_ms"], 1)}, indent=1) + "\n")
+        print(f"saved {a.save}")
+    if base is not None:
+        found = regressions(cur, base, a.tolerance, a.min_ms)
+        for r in found:
+            print(f"REGRESSION {r}")
+        if found:
+            sys.exit(1)
+        print("no regressions")
+
+if __name__ == "__main__":
+    main()
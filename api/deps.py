@@ -1,20 +1,23 @@
 from fastapi import Depends, HTTPException
 from fastapi.security import HTTPBearer
-from jose import jwt, JWTError
-import os
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from .db import get_db, get_async_db
+from .utils.auth import CurrentUser, resolve_identity, resolve_identity_async
 
 security = HTTPBearer()
-JWT_SECRET = os.getenv("JWT_SECRET", "dev_secret")
-JWT_ALG = os.getenv("JWT_ALG", "HS256")
 
-class UserIdentity:
-    def __init__(self, email: str):
-        self.email = email
+# kept for routers that type against it; same object utils.auth hands out
+UserIdentity = CurrentUser
 
-def get_current_user(creds = Depends(security)) -> UserIdentity:
-    token = creds.credentials
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
-        return UserIdentity(payload.get("sub"))
-    except JWTError:
+def get_current_user(creds = Depends(security), db: Session = Depends(get_db)) -> UserIdentity:
+    ident = resolve_identity(creds.credentials, db)
+    if ident is None:
         raise HTTPException(status_code=401, detail="Invalid token")
+    return ident
+
+async def get_current_user_async(creds = Depends(security), db: AsyncSession = Depends(get_async_db)) -> UserIdentity:
+    ident = await resolve_identity_async(creds.credentials, db)
+    if ident is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return ident
@@ -0,0 +1,151 @@
+"""
+Local stand-in for the parts of Plaid we call, for offline dev and load tests.
+
+    uvicorn api.dev.fake_plaid:app --port 8001
+    PLAID_BASE_URL=http://localhost:8001 PLAID_CLIENT_ID=fake PLAID_SECRET=fake uvicorn api.main:app
+
+Transactions are generated deterministically from the access token: a handful of
+recurring merchants (weekly/monthly/quarterly/yearly) plus one-off noise, so scans
+find real-looking subscriptions. Knobs (env):
+  FAKE_PLAID_LATENCY_MS   added latency per call (default 0)
+  FAKE_PLAID_ERROR_RATE   fraction of calls answered with 500/429 (default 0)
+  FAKE_PLAID_EPOCH        first day of history for every item (default 2024-01-01)
+  FAKE_PLAID_NOISE_PER_DAY one-off transactions per day (default 3)
+"""
+import asyncio, functools, hashlib, os, random, uuid
+from datetime import date, timedelta
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse
+
+LATENCY_MS = float(os.getenv("FAKE_PLAID_LATENCY_MS", "0"))
+ERROR_RATE = float(os.getenv("FAKE_PLAID_ERROR_RATE", "0"))
+EPOCH = date.fromisoformat(os.getenv("FAKE_PLAID_EPOCH", "2024-01-01"))
+NOISE_PER_DAY = int(os.getenv("FAKE_PLAID_NOISE_PER_DAY", "3"))
+
+RECURRING = [
+    # name, amount, period days
+    ("NETFLIX.COM", 15.49, 30),
+    ("Spotify USA", 10.99, 30),
+    ("LA FITNESS*MEMBER", 34.99, 30),
+    ("APPLE.COM/BILL SERVICES", 2.99, 30),
+    ("Google *YouTube Premium", 13.99, 30),
+    ("Microsoft*365 Annual", 99.99, 365),
+    ("Amazon Prime Annual", 139.00, 365),
+    ("HelloFresh", 59.94, 7),
+    ("Adobe Quarterly", 59.97, 91),
+]
+NOISE = ["Starbucks", "Shell Oil", "Whole Foods", "Uber", "Chipotle", "Target", "CVS Pharmacy", "Lyft"]
+
+app = FastAPI(title="Fake Plaid")
+
+async def _chaos():
+    if LATENCY_MS:
+        await asyncio.sleep(LATENCY_MS / 1000)
+    if ERROR_RATE and random.random() < ERROR_RATE:
+        if random.random() < 0.5:
+            raise HTTPException(429, "RATE_LIMIT_EXCEEDED", headers={"Retry-After": "1"})
+        raise HTTPException(500, "INTERNAL_SERVER_ERROR")
+
+def _check_keys(body: dict):
+    if not (body.get("client_id") and body.get("secret")):
+        raise HTTPException(400, "INVALID_API_KEYS")
+
+def _seed(access_token: str) -> int:
+    return int(hashlib.sha1(access_token.encode()).hexdigest()[:8], 16)
+
+@functools.lru_cache(maxsize=256)
+def _history(access_token: str, today: date) -> list[dict]:
+    """
+    Every transaction for an item, oldest first. History is anchored at EPOCH and each
+    day's draws are seeded by (item, day), so it only ever grows at the end -- ids and
+    order are stable across days, which is what /transactions/sync cursors rely on.
+    Callers must not mutate it.
+    """
+    seed = _seed(access_token)
+    rng = random.Random(seed)
+    out = []
+    for name, amount, period in RECURRING:
+        if rng.random() < 0.3:
+            continue  # not every item has every subscription
+        d = EPOCH + timedelta(days=rng.randrange(period))
+        while d <= today:
+            out.append((d, name, round(amount * (1 + rng.uniform(-0.02, 0.02)), 2)))
+            d += timedelta(days=period + rng.choice((-1, 0, 0, 1)))
+    d = EPOCH
+    while d <= today:
+        day_rng = random.Random(seed ^ d.toordinal())
+        for _ in range(NOISE_PER_DAY):
+            out.append((d, day_rng.choice(NOISE), round(day_rng.uniform(3, 120), 2)))
+        d += timedelta(days=1)
+    out.sort(key=lambda x: (x[0], x[1], x[2]))
+    return [
+        {
+            "transaction_id": "txn-" + hashlib.sha1(f"{access_token}|{d}|{name}|{amt}|{i}".encode()).hexdigest()[:20],
+            "account_id": "acct-1",
+            "date": d.isoformat(),
+            "name": name,
+            "merchant_name": name,
+            "amount": amt,
+            "iso_currency_code": "USD",
+            "pending": False,
+        }
+        for i, (d, name, amt) in enumerate(out)
+    ]
+
+@app.post("/link/token/create")
+async def link_token_create(body: dict):
+    await _chaos(); _check_keys(body)
+    return {"link_token": f"link-sandbox-{uuid.uuid4()}", "expiration": None, "request_id": uuid.uuid4().hex}
+
+@app.post("/sandbox/public_token/create")
+async def sandbox_public_token_create(body: dict):
+    await _chaos(); _check_keys(body)
+    return {"public_token": f"public-sandbox-{uuid.uuid4()}", "request_id": uuid.uuid4().hex}
+
+@app.post("/item/public_token/exchange")
+async def public_token_exchange(body: dict):
+    await _chaos(); _check_keys(body)
+    pt = body.get("public_token") or ""
+    if not pt:
+        return JSONResponse({"error_code": "INVALID_PUBLIC_TOKEN"}, status_code=400)
+    digest = hashlib.sha1(pt.encode()).hexdigest()[:16]
+    return {"access_token": f"access-sandbox-{digest}", "item_id": f"item-{digest}", "request_id": uuid.uuid4().hex}
+
+@app.post("/transactions/get")
+async def transactions_get(body: dict):
+    await _chaos(); _check_keys(body)
+    start = date.fromisoformat(body["start_date"])
+    end = date.fromisoformat(body["end_date"])
+    opts = body.get("options") or {}
+    count = min(int(opts.get("count", 100)), 500)
+    offset = int(opts.get("offset", 0))
+    lo, hi = start.isoformat(), end.isoformat()
+    txns = [t for t in reversed(_history(body["access_token"], date.today())) if lo <= t["date"] <= hi]
+    return {
+        "accounts": [{"account_id": "acct-1"}],
+        "transactions": txns[offset:offset + count],
+        "total_transactions": len(txns),
+        "request_id": uuid.uuid4().hex,
+    }
+
+@app.post("/transactions/sync")
+async def transactions_sync(body: dict):
+    """Cursor is just the number of transactions already delivered (history only appends)."""
+    await _chaos(); _check_keys(body)
+    hist = _history(body["access_token"], date.today())
+    cursor = body.get("cursor") or ""
+    try:
+        pos = int(cursor.split(":", 1)[1]) if cursor else 0
+    except (IndexError, ValueError):
+        return JSONResponse({"error_code": "INVALID_CURSOR"}, status_code=400)
+    count = min(int(body.get("count", 100)), 500)
+    added = hist[pos:pos + count]
+    nxt = pos + len(added)
+    return {
+        "added": added,
+        "modified": [],
+        "removed": [],
+        "next_cursor": f"c:{nxt}",
+        "has_more": nxt < len(hist),
+        "request_id": uuid.uuid4().hex,
+    }
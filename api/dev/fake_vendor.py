@@ -0,0 +1,61 @@
+"""
+In-process stand-in vendor for the cancellation engine, for offline dev and load tests.
+
+    CANCEL_ADAPTER=fake uvicorn api.main:app
+
+Never the default: it "cancels" without contacting anyone, so only turn it on for
+local dev and benches (api/bench/cancel_load.py sets it).
+
+Every vendor accepts the request after some latency and confirms it a little later.
+Knobs (env):
+  FAKE_VENDOR_LATENCY_MS   added latency per submit/verify call (default 50)
+  FAKE_VENDOR_ERROR_RATE   fraction of submits that fail with a retryable error (default 0)
+  FAKE_VENDOR_REFUSE_RATE  fraction of cancellations refused at verification (default 0)
+  FAKE_VENDOR_CONFIRM_S    seconds after submit before verify says it's done (default 0)
+It also tracks the peak number of concurrent calls per vendor, so load tests can check
+the engine's per-vendor limits held.
+"""
+import asyncio, os, random, time, uuid
+from collections import defaultdict
+from ..utils.cancel_engine import CONFIRMED, REFUSED, WAITING, Adapter, AdapterError, adapter
+
+LATENCY_MS = float(os.getenv("FAKE_VENDOR_LATENCY_MS", "50"))
+ERROR_RATE = float(os.getenv("FAKE_VENDOR_ERROR_RATE", "0"))
+REFUSE_RATE = float(os.getenv("FAKE_VENDOR_REFUSE_RATE", "0"))
+CONFIRM_S = float(os.getenv("FAKE_VENDOR_CONFIRM_S", "0"))
+
+@adapter("fake")
+class FakeVendor(Adapter):
+    def __init__(self):
+        self.sent = {}  # vendor_ref -> (sent at, refuse?)
+        self.active = defaultdict(int)
+        self.peak = defaultdict(int)
+        self.calls = 0
+
+    async def _call(self, vendor: str):
+        self.calls += 1
+        self.active[vendor] += 1
+        self.peak[vendor] = max(self.peak[vendor], self.active[vendor])
+        try:
+            if LATENCY_MS:
+                await asyncio.sleep(LATENCY_MS / 1000 * random.uniform(0.5, 1.5))
+        finally:
+            self.active[vendor] -= 1
+
+    async def submit(self, req: dict):
+        await self._call(req["vendor"])
+        if random.random() < ERROR_RATE:
+            raise AdapterError("fake vendor: 503 try again later")
+        ref = f"fake-{uuid.uuid4().hex[:12]}"
+        self.sent[ref] = (time.monotonic(), random.random() < REFUSE_RATE)
+        return ref
+
+    async def verify(self, req: dict) -> str:
+        await self._call(req["vendor"])
+        sent = self.sent.get(req["vendor_ref"])
+        if sent is None:
+            return CONFIRMED  # sent before a restart; the fake vendor just agrees
+        at, refuse = sent
+        if time.monotonic() - at < CONFIRM_S:
+            return WAITING
+        return REFUSED if refuse else CONFIRMED
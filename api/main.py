@@ -1,15 +1,28 @@
 # api/main.py
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
+from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
 from pathlib import Path
-from dotenv import load_dotenv
-from sqlalchemy import text
-import os
+import asyncio, os
 
-# Load local .env in dev; on Render you'll use env vars
-load_dotenv(dotenv_path=Path(__file__).resolve().parent / ".env")
+# Load local .env in dev; on Render you'll use env vars (and skip importing dotenv)
+_env = Path(__file__).resolve().parent / ".env"
+if _env.exists():
+    from dotenv import load_dotenv
+    load_dotenv(dotenv_path=_env)
 
-from .db import Base, engine
+from .db import pool_stats, dispose_async_engine
+from .migrations import MIGRATE_ON_BOOT, migrate
+from .utils.plaid_client import close_plaid
+from .utils.merchants import merchant_cache_stats
+from .utils.jobs import job_queue
+from .utils.log import event_sink
+from .utils.renewals import RENEWAL_SCHEDULER, renewal_scheduler
+from .utils.cancel_engine import CANCEL_ENGINE, cancel_engine
+from .utils.idempotency import idempotency_stats
+from .utils.metrics import CONTENT_TYPE, MetricsMiddleware, render as render_metrics, require_metrics_access
+from .utils.pubsub import broker
+from .utils.versions import response_cache
 from .routers import (
     auth,
     institutions,
@@ -18,50 +31,15 @@ from .routers import (
     cancellations,
     plaid,
     events,
+    jobs,
 )
 
 app = FastAPI(title="Approval v2 API")
 
-# Create tables
-Base.metadata.create_all(bind=engine)
-
-# ---------- one-time schema upgrades (idempotent) ----------
-def _upgrade_schema():
-    with engine.connect() as conn:
-        if engine.dialect.name == "postgresql":
-            conn.exec_driver_sql(
-                "ALTER TABLE subscriptions "
-                "ADD COLUMN IF NOT EXISTS cancel_status TEXT DEFAULT 'active';"
-            )
-            conn.exec_driver_sql(
-                "ALTER TABLE subscriptions "
-                "ADD COLUMN IF NOT EXISTS canceled_at TIMESTAMPTZ;"
-            )
-        elif engine.dialect.name == "sqlite":
-            # add cancel_status
-            try:
-                conn.exec_driver_sql(
-                    "ALTER TABLE subscriptions ADD COLUMN cancel_status TEXT DEFAULT 'active'"
-                )
-            except Exception:
-                pass
-            # add canceled_at
-            try:
-                conn.exec_driver_sql(
-                    "ALTER TABLE subscriptions ADD COLUMN canceled_at DATETIME"
-                )
-            except Exception:
-                pass
-            # legacy: add snoozed_until column if you used it locally
-            try:
-                conn.exec_driver_sql(
-                    "ALTER TABLE subscriptions ADD COLUMN snoozed_until DATETIME"
-                )
-            except Exception:
-                pass
-
-_upgrade_schema()
-# -----------------------------------------------------------
+# Schema: versioned migrations (one SELECT when already up to date). With
+# MIGRATE_ON_BOOT=0 run `python -m api.migrations` as a release step instead.
+if MIGRATE_ON_BOOT:
+    migrate()
 
 # api/main.py (near the top imports)
 import os
@@ -78,9 +56,12 @@ app.add_middleware(
     allow_origins=ALLOWED_ORIGINS,
     allow_credentials=False,                 # we use Bearer tokens, not cookies
     allow_methods=["GET", "POST", "OPTIONS"],
-    allow_headers=["Authorization", "Content-Type", "Accept"],
+    allow_headers=["Authorization", "Content-Type", "Accept", "Last-Event-ID", "Idempotency-Key"],
+    expose_headers=["Idempotent-Replayed"],
     max_age=86400,
 )
+# outermost, so its latency covers CORS too; see utils/metrics.py
+app.add_middleware(MetricsMiddleware)
 
 
 # Routers
@@ -91,6 +72,25 @@ app.include_router(approvals.router)
 app.include_router(cancellations.router)
 app.include_router(plaid.router)
 app.include_router(events.router)
+app.include_router(jobs.router)
+
+@app.on_event("startup")
+async def _start_workers():
+    event_sink.start()
+    await job_queue.start()
+    if RENEWAL_SCHEDULER:
+        await renewal_scheduler.start()
+    if CANCEL_ENGINE:
+        await cancel_engine.start()
+
+@app.on_event("shutdown")
+async def _close_clients():
+    await renewal_scheduler.stop()
+    await cancel_engine.stop()
+    await job_queue.stop()
+    await asyncio.to_thread(event_sink.stop)  # write buffered events before the pool goes away
+    await close_plaid()
+    await dispose_async_engine()
 
 @app.get("/")
 def root():
@@ -99,3 +99,41 @@ def root():
 @app.get("/healthz")
 def healthz():
     return {"ok": True}
+
+# internal stats below: METRICS_TOKEN or localhost only (utils/metrics.py)
+
+@app.get("/healthz/pool", dependencies=[Depends(require_metrics_access)])
+def healthz_pool():
+    return pool_stats()
+
+@app.get("/healthz/merchants", dependencies=[Depends(require_metrics_access)])
+def healthz_merchants():
+    return merchant_cache_stats()
+
+@app.get("/healthz/jobs", dependencies=[Depends(require_metrics_access)])
+async def healthz_jobs():
+    return await job_queue.stats()
+
+@app.get("/healthz/renewals", dependencies=[Depends(require_metrics_access)])
+def healthz_renewals():
+    return renewal_scheduler.stats()
+
+@app.get("/healthz/cancellations", dependencies=[Depends(require_metrics_access)])
+async def healthz_cancellations():
+    return await cancel_engine.stats()
+
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(require_metrics_access)])
+async def metrics():
+    """Prometheus text: per-route latency/status/SQL, jobs, Plaid calls, and the stats above as gauges."""
+    gauges = {
+        "db_pool": pool_stats(),
+        "merchant_cache": merchant_cache_stats(),
+        "jobs": await job_queue.stats(),
+        "event_sink": event_sink.stats(),
+        "broker": broker.stats(),
+        "renewals": renewal_scheduler.stats(),
+        "cancellations": await cancel_engine.stats(),
+        "idempotency": idempotency_stats(),
+        "subs_cache": response_cache.stats(),
+    }
+    return Response(render_metrics(gauges), media_type=CONTENT_TYPE)
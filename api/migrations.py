@@ -0,0 +1,229 @@
+"""
+Versioned schema migrations.
+
+    DATABASE_URL=... python -m api.migrations    # apply pending migrations, print the version
+
+Each migration is a function registered with @migration(version, name); applied ones
+are recorded in schema_version. At boot main.py calls migrate(), which costs one query
+(SELECT MAX(version)) when the database is up to date. A new database, or one from
+before schema_version existed, runs every migration once; they all check what's
+already there, and the first one is create_all.
+
+Adding a schema change: append a migration with the next version number. New tables go
+in models.py and get created in their migration with `Model.__table__.create(conn,
+checkfirst=True)` -- create_all no longer runs on existing databases.
+
+Each pending migration runs in its own transaction, under an advisory lock on Postgres,
+and re-checks schema_version first, so instances booting together apply it once.
+"""
+import logging, os
+from typing import Callable, List, Tuple
+from sqlalchemy import inspect, insert, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
+from .db import Base, engine as default_engine
+from .models import SchemaVersion
+
+log = logging.getLogger("api.migrations")
+
+MIGRATE_ON_BOOT = os.getenv("MIGRATE_ON_BOOT", "1") != "0"
+LOCK_KEY = 0x61707032  # pg_advisory_xact_lock key, any constant shared by all instances
+
+Migration = Tuple[int, str, Callable[[Connection], None]]
+MIGRATIONS: List[Migration] = []
+
+def migration(version: int, name: str):
+    def deco(fn):
+        assert not MIGRATIONS or version == MIGRATIONS[-1][0] + 1, "migration versions must be consecutive"
+        MIGRATIONS.append((version, name, fn))
+        return fn
+    return deco
+
+def _pg(conn: Connection) -> bool:
+    return conn.dialect.name == "postgresql"
+
+def _ts(conn: Connection) -> str:
+    return "TIMESTAMP" if _pg(conn) else "DATETIME"
+
+def _add_columns(conn: Connection, table: str, cols):
+    have = {c["name"] for c in inspect(conn).get_columns(table)}
+    for name, ddl in cols:
+        if name not in have:
+            conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}")
+
+# ---------- migrations (append only) ----------
+
+@migration(1, "tables")
+def _tables(conn):
+    # databases from before versioning relied on create_all at every boot
+    Base.metadata.create_all(conn)
+
+@migration(2, "cancel_status_and_sync_cursor")
+def _cancel_status(conn):
+    _add_columns(conn, "subscriptions", [
+        ("cancel_status", "TEXT DEFAULT 'active'"),
+        ("canceled_at", "TIMESTAMPTZ" if _pg(conn) else "DATETIME"),
+    ])
+    if not _pg(conn):
+        _add_columns(conn, "subscriptions", [("snoozed_until", "DATETIME")])  # legacy local column
+    _add_columns(conn, "institution_connections", [("sync_cursor", "TEXT"), ("last_synced_at", _ts(conn))])
+
+@migration(3, "unique_user_merchant")
+def _unique_user_merchant(conn):
+    # one subscription per (user, merchant): fold old duplicates into the oldest row
+    # (repointing approvals, cancellations and events at it), then add the unique index
+    insp = inspect(conn)
+    uniques = [u["column_names"] for u in insp.get_unique_constraints("subscriptions")]
+    uniques += [i["column_names"] for i in insp.get_indexes("subscriptions") if i.get("unique")]
+    if ["user_id", "merchant"] in uniques:
+        return
+    keep = (
+        "(SELECT MIN(k.id) FROM subscriptions k JOIN subscriptions d "
+        "ON k.user_id = d.user_id AND k.merchant = d.merchant WHERE d.id = {sid})"
+    )
+    dups = "(SELECT id FROM subscriptions WHERE id NOT IN (SELECT MIN(id) FROM subscriptions GROUP BY user_id, merchant))"
+    for t in ("approvals", "cancellation_requests"):
+        conn.exec_driver_sql(
+            f"UPDATE {t} SET subscription_id = {keep.format(sid=f'{t}.subscription_id')} WHERE subscription_id IN {dups}"
+        )
+
+    # events carry the id in their payload (and, once migration 5 ran, in a column too);
+    # payloads have always been JSON, text on older databases
+    cols = {c["name"]: c["type"] for c in insp.get_columns("event_logs")}
+    if "subscription_id" in cols:
+        conn.exec_driver_sql(
+            f"UPDATE event_logs SET subscription_id = {keep.format(sid='event_logs.subscription_id')} "
+            f"WHERE subscription_id IN {dups}"
+        )
+    if _pg(conn):
+        from sqlalchemy.dialects.postgresql import JSONB
+        doc = "payload" if isinstance(cols["payload"], JSONB) else "NULLIF(payload, '')::jsonb"
+        sid = f"(CASE WHEN {doc}->>'subscription_id' ~ '^[0-9]+$' THEN ({doc}->>'subscription_id')::int END)"
+        new = f"jsonb_set({doc}, '{{subscription_id}}', to_jsonb({keep.format(sid=sid)}))"
+        conn.exec_driver_sql(
+            f"UPDATE event_logs SET payload = {new if doc == 'payload' else new + '::text'} WHERE {sid} IN {dups}"
+        )
+    else:
+        sid = "(CASE WHEN json_valid(payload) THEN json_extract(payload, '$.subscription_id') END)"
+        conn.exec_driver_sql(
+            f"UPDATE event_logs SET payload = json_set(payload, '$.subscription_id', {keep.format(sid=sid)}) "
+            f"WHERE {sid} IN {dups}"
+        )
+    conn.exec_driver_sql(f"DELETE FROM subscriptions WHERE id IN {dups}")
+    conn.exec_driver_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_subscriptions_user_merchant ON subscriptions (user_id, merchant)"
+    )
+
+@migration(4, "event_keyset_indexes")
+def _event_indexes(conn):
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_event_logs_user_id_id ON event_logs (user_id, id)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_event_logs_user_type_id ON event_logs (user_id, type, id)")
+
+@migration(5, "event_payload_json")
+def _event_payload(conn):
+    # structured payloads: JSONB on Postgres (SQLite's JSON is text anyway), plus
+    # subscription_id copied out of the payload for the timeline index
+    from sqlalchemy.dialects.postgresql import JSONB
+    cols = {c["name"]: c["type"] for c in inspect(conn).get_columns("event_logs")}
+    if _pg(conn) and not isinstance(cols["payload"], JSONB):
+        conn.exec_driver_sql(
+            "ALTER TABLE event_logs ALTER COLUMN payload TYPE JSONB USING NULLIF(payload, '')::jsonb"
+        )
+    if "subscription_id" not in cols:
+        conn.exec_driver_sql("ALTER TABLE event_logs ADD COLUMN subscription_id INTEGER")
+        if _pg(conn):
+            conn.exec_driver_sql(
+                "UPDATE event_logs SET subscription_id = (payload->>'subscription_id')::int "
+                "WHERE payload->>'subscription_id' ~ '^[0-9]+$'"
+            )
+        else:
+            conn.exec_driver_sql(
+                "UPDATE event_logs SET subscription_id = json_extract(payload, '$.subscription_id') "
+                "WHERE json_valid(payload) AND json_type(payload, '$.subscription_id') = 'integer'"
+            )
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_event_logs_sub_id ON event_logs (subscription_id, id)")
+
+@migration(6, "user_data_version")
+def _data_version(conn):
+    # per-user version behind the ETags on /subscriptions
+    _add_columns(conn, "users", [("data_version", "INTEGER NOT NULL DEFAULT 0")])
+
+@migration(7, "renewal_scheduler")
+def _renewals(conn):
+    # which renewal was last announced, plus the due-soon indexes
+    _add_columns(conn, "subscriptions", [("renewal_notified_at", _ts(conn))])
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_subscriptions_user_status_renewal ON subscriptions (user_id, status, next_renewal_at)"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_subscriptions_status_renewal ON subscriptions (status, next_renewal_at)"
+    )
+
+@migration(8, "cancellation_engine")
+def _cancel_engine(conn):
+    # bookkeeping columns (the table was created empty and never written before)
+    _add_columns(conn, "cancellation_requests", [
+        ("user_id", "INTEGER"), ("vendor", "TEXT"), ("attempts", "INTEGER NOT NULL DEFAULT 0"),
+        ("checks", "INTEGER NOT NULL DEFAULT 0"), ("next_check_at", _ts(conn)), ("error", "TEXT"),
+    ])
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_cancellation_requests_user_id ON cancellation_requests (user_id)")
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_cancellation_requests_status_check ON cancellation_requests (status, next_check_at)"
+    )
+
+@migration(9, "job_active_dedup_index")
+def _job_dedup(conn):
+    # submit used to check-then-insert, so racing submits could queue the same job twice;
+    # fail all but one active copy per key, then let a partial unique index keep it that way
+    conn.exec_driver_sql(
+        "UPDATE jobs SET status = 'failed', error = 'duplicate', finished_at = CURRENT_TIMESTAMP "
+        "WHERE status IN ('queued', 'running') AND id NOT IN ("
+        "SELECT MIN(id) FROM jobs WHERE status IN ('queued', 'running') GROUP BY dedup_key)"
+    )
+    conn.exec_driver_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_jobs_active_dedup ON jobs (dedup_key) "
+        "WHERE status IN ('queued', 'running')"
+    )
+
+# ---------- runner ----------
+
+def _lock(conn: Connection):
+    if _pg(conn):
+        conn.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": LOCK_KEY})
+
+def current_version(eng: Engine) -> int | None:
+    """Highest applied version; None when schema_version doesn't exist yet."""
+    with eng.connect() as conn:
+        try:
+            return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+        except DBAPIError:
+            return None
+
+def migrate(eng: Engine = default_engine) -> int:
+    """Bring the schema up to the latest version; returns it."""
+    latest = MIGRATIONS[-1][0]
+    have = current_version(eng)
+    if have == latest:
+        return latest
+
+    if have is None:
+        with eng.begin() as conn:
+            _lock(conn)
+            SchemaVersion.__table__.create(conn, checkfirst=True)
+        have = 0
+
+    for version, name, fn in MIGRATIONS:
+        if version <= have:
+            continue
+        with eng.begin() as conn:
+            _lock(conn)
+            if conn.execute(text("SELECT 1 FROM schema_version WHERE version = :v"), {"v": version}).first():
+                continue  # another instance applied it while we waited
+            fn(conn)
+            conn.execute(insert(SchemaVersion).values(version=version, name=name))
+        log.info("applied migration %d %s", version, name)
+    return latest
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    print(f"schema version {migrate()}")
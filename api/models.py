@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Float, Enum
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Float, Enum, Text, UniqueConstraint, Index, JSON, text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .db import Base
@@ -22,6 +23,7 @@ class User(Base):
     email = Column(String, unique=True, index=True, nullable=False)
     pw_hash = Column(String, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    data_version = Column(Integer, nullable=False, default=0, server_default="0")  # see utils/versions.py
     subscriptions = relationship("Subscription", back_populates="user")
 
 class InstitutionConnection(Base):
@@ -31,9 +33,50 @@ class InstitutionConnection(Base):
     provider = Column(String)  # e.g., plaid
     status = Column(String, default="linked")
     access_token_ref = Column(String)  # store a reference only
+    sync_cursor = Column(String, nullable=True)       # Plaid /transactions/sync cursor
+    last_synced_at = Column(DateTime, nullable=True)
+
+class RecurrenceState(Base):
+    """Per-connection, per-merchant group state carried between incremental scans."""
+    __tablename__ = "recurrence_states"
+    __table_args__ = (UniqueConstraint("connection_id", "group_key", name="uq_recurrence_states_conn_group"),)
+    id = Column(Integer, primary_key=True)
+    connection_id = Column(Integer, ForeignKey("institution_connections.id"), index=True, nullable=False)
+    group_key = Column(String, nullable=False)
+    merchant = Column(String, nullable=False)
+    points = Column(Text, nullable=False, default="[]")  # JSON [[date, amount, transaction_id], ...] newest N
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class Job(Base):
+    """Background job (JOB_BACKEND=db); see utils/jobs.py."""
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_status_created", "status", "created_at"),
+        # at most one queued/running job per dedup key; submit relies on it
+        Index("uq_jobs_active_dedup", "dedup_key", unique=True,
+              sqlite_where=text("status IN ('queued', 'running')"),
+              postgresql_where=text("status IN ('queued', 'running')")),
+    )
+    id = Column(String, primary_key=True)
+    kind = Column(String, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    dedup_key = Column(String, index=True)
+    params = Column(Text, nullable=False, default="{}")   # JSON
+    status = Column(String, nullable=False, default="queued")  # queued | running | done | failed
+    result = Column(Text, nullable=True)                  # JSON
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
 
 class Subscription(Base):
     __tablename__ = "subscriptions"
+    # one row per merchant per user; scans upsert against it
+    __table_args__ = (
+        UniqueConstraint("user_id", "merchant", name="uq_subscriptions_user_merchant"),
+        Index("ix_subscriptions_user_status_renewal", "user_id", "status", "next_renewal_at"),  # /subscriptions/upcoming
+        Index("ix_subscriptions_status_renewal", "status", "next_renewal_at"),  # renewal scheduler, all users
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), index=True)
     merchant = Column(String, index=True)
@@ -42,6 +85,7 @@ class Subscription(Base):
     interval = Column(String)  # monthly, yearly
     next_renewal_at = Column(DateTime, nullable=True)
     status = Column(Enum(SubStatus), default=SubStatus.active)
+    renewal_notified_at = Column(DateTime, nullable=True)  # next_renewal_at we last sent approval.requested for
     user = relationship("User", back_populates="subscriptions")
 
 class Approval(Base):
@@ -53,24 +97,62 @@ class Approval(Base):
     decided_at = Column(DateTime, default=datetime.utcnow)
 
 class CancellationRequest(Base):
+    """One attempt to cancel a subscription with its vendor; see utils/cancel_engine.py."""
     __tablename__ = "cancellation_requests"
+    # the engine's work queues: pending (due retries) and in_progress (due checks)
+    __table_args__ = (Index("ix_cancellation_requests_status_check", "status", "next_check_at"),)
     id = Column(Integer, primary_key=True)
     subscription_id = Column(Integer, index=True)
+    user_id = Column(Integer, index=True)
+    vendor = Column(String, nullable=True)  # cleaned merchant; limits and adapter routing key
     method = Column(String)  # auto|assisted
     status = Column(Enum(CancelStatus), default=CancelStatus.pending)
     vendor_ref = Column(String, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")  # submits tried
+    checks = Column(Integer, nullable=False, default=0, server_default="0")    # verifications tried
+    next_check_at = Column(DateTime, nullable=True)
+    error = Column(Text, nullable=True)
     started_at = Column(DateTime, default=datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)
 
+class IdempotencyKey(Base):
+    """Stored response for an Idempotency-Key; see utils/idempotency.py."""
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (UniqueConstraint("user_id", "key", name="uq_idempotency_keys_user_key"),)
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    key = Column(String, nullable=False)
+    route = Column(String, nullable=False)
+    fingerprint = Column(String, nullable=False)        # sha256 of route + body
+    status_code = Column(Integer, nullable=True)        # NULL while the first request is running
+    response = Column(Text, nullable=True)              # JSON
+    created_at = Column(DateTime, default=datetime.utcnow)
+    locked_until = Column(DateTime, nullable=False)     # a running claim older than this was abandoned
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+class SchemaVersion(Base):
+    """One row per migration applied; see migrations.py."""
+    __tablename__ = "schema_version"
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String, nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
 from sqlalchemy import Text
 from datetime import datetime
 
 class EventLog(Base):
     __tablename__ = "event_logs"
+    # feed pages walk these newest-first: WHERE user_id [AND type] AND id < :before ORDER BY id DESC
+    __table_args__ = (
+        Index("ix_event_logs_user_id_id", "user_id", "id"),
+        Index("ix_event_logs_user_type_id", "user_id", "type", "id"),
+        Index("ix_event_logs_sub_id", "subscription_id", "id"),  # /subscriptions/{id}/timeline
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, index=True)
     type = Column(String, index=True)          # e.g., approval.decide, cancel.start, cancel.done, scan.real
     message = Column(String)                    # short human text
-    payload = Column(Text, nullable=True)       # optional JSON string
+    payload = Column(JSON().with_variant(JSONB(), "postgresql"), nullable=True)  # optional dict
+    subscription_id = Column(Integer, nullable=True)  # copied out of payload on write
     created_at = Column(DateTime, default=datetime.utcnow)
 
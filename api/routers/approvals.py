@@ -1,81 +1,34 @@
 # api/routers/approvals.py
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import text
-
-from ..db import SessionLocal
-from ..utils.auth import get_current_user
-from ..utils.log import log_event
+import os
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import insert, select
+
+from ..db import get_async_db
+from ..models import Approval, Subscription
+from ..utils.auth import get_current_user_async
+from ..utils.idempotency import idempotent
+from ..utils.log import event_row, log_event, log_events
+from ..utils.versions import bump_async
 
 router = APIRouter(prefix="/approvals", tags=["approvals"])
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+APPROVALS_BATCH_MAX = int(os.getenv("APPROVALS_BATCH_MAX", "200"))
 
 @router.post("")
-async def decide(payload: dict, user=Depends(get_current_user), db: Session = Depends(get_db)):
-    """
-    Accepts: { "subscription_id": number, "decision": "approve" | "deny" }
-    Records the decision and logs an event.
-    (If you have an approvals table, you can upsert into it; for MVP we just log.)
-    """
-    sub_id = payload.get("subscription_id")
-    decision = (payload.get("decision") or "").lower().strip()
-
-    if not sub_id:
-        raise HTTPException(400, "subscription_id is required")
-    if decision not in {"approve", "deny"}:
-        raise HTTPException(400, "decision must be 'approve' or 'deny'")
-
-    # ensure subscription exists
-    row = db.execute(text("SELECT id FROM subscriptions WHERE id = :id"), {"id": sub_id}).mappings().first()
-    if not row:
-        raise HTTPException(404, "subscription not found")
-
-    # (optional) if you have an approvals table, upsert here
-    # try:
-    #     db.execute(text("""
-    #         INSERT INTO approvals (subscription_id, user_id, decision)
-    #         VALUES (:sid, :uid, :dec)
-    #         ON CONFLICT (subscription_id) DO UPDATE SET decision = :dec
-    #     """), {"sid": sub_id, "uid": user.id, "dec": decision})
-    # except Exception:
-    #     pass
-
-    # log event
-    log_event(db, user.id, f"approval.{decision}", f"{decision} sub {sub_id}", {"subscription_id": sub_id})
-    db.commit()
-
-    return {"subscription_id": sub_id, "decision": decision}
-
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import text
-
-from ..db import SessionLocal
-from ..utils.auth import get_current_user
-from ..utils.log import log_event
-
-router = APIRouter(prefix="/approvals", tags=["approvals"])
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-@router.post("")
-async def decide(payload: dict, user=Depends(get_current_user), db: Session = Depends(get_db)):
+async def decide(payload: dict, idempotency_key: Optional[str] = Header(None),
+                 user=Depends(get_current_user_async), db: AsyncSession = Depends(get_async_db)):
     """
     Body: { subscription_id, decision: 'approve' | 'deny' }
     - Records decision
     - If 'deny', automatically starts cancellation (same as POST /cancellations/start)
+    - With an Idempotency-Key header, a retry replays the first response
     """
+    return await idempotent(idempotency_key, user.id, "POST /approvals", payload,
+                            lambda: _decide(payload, user, db))
+
+async def _decide(payload: dict, user, db: AsyncSession) -> dict:
     sub_id = payload.get("subscription_id")
     decision = (payload.get("decision") or "").lower().strip()
 
@@ -84,32 +37,116 @@ async def decide(payload: dict, user=Depends(get_current_user), db: Session = De
     if decision not in {"approve", "deny"}:
         raise HTTPException(400, "decision must be 'approve' or 'deny'")
 
-    row = db.execute(text("SELECT id FROM subscriptions WHERE id = :id"), {"id": sub_id}).mappings().first()
-    if not row:
+    # same rows as the batch path: the caller's subscription, an Approval, the event
+    owned = (await db.execute(
+        select(Subscription.id).where(Subscription.id == sub_id, Subscription.user_id == user.id)
+    )).first()
+    if not owned:
         raise HTTPException(404, "subscription not found")
 
-    # log decision
+    await db.execute(insert(Approval).values(user_id=user.id, subscription_id=sub_id, decision=decision))
     log_event(db, user.id, f"approval.{decision}", f"{decision} sub {sub_id}", {"subscription_id": sub_id})
-    db.commit()
+    await bump_async(db, user.id)
+    await db.commit()
 
     started = False
+    request_id = None
     start_error = None
     if decision == "deny":
         # lazy import to avoid circular imports
         try:
-            from .cancellations import start_cancellation as _start_cancel
-            # reuse the same handler (keeps state = in_progress)
-            await _start_cancel({"subscription_id": sub_id}, user=user, db=db)
+            from .cancellations import start_one
+            # same path as POST /cancellations/start (keeps state = in_progress)
+            request_id = (await start_one({"subscription_id": sub_id}, user, db))["request_id"]
             started = True
         except Exception as e:
-            start_error = str(e)
+            # drop whatever start_one had flushed, then record the failure on its own
+            await db.rollback()
+            start_error = str(e.detail) if isinstance(e, HTTPException) else str(e)
             log_event(db, user.id, "cancel.autostart_failed", start_error, {"subscription_id": sub_id})
-            db.commit()
+            await db.commit()  # only has work if the sink was full
 
     return {
         "subscription_id": sub_id,
         "decision": decision,
         "cancel_started": started,
+        "cancel_request_id": request_id,
         "error": start_error,
     }
 
+
+
+@router.post("/batch")
+async def decide_batch(payload: dict, idempotency_key: Optional[str] = Header(None),
+                       user=Depends(get_current_user_async), db: AsyncSession = Depends(get_async_db)):
+    """
+    Body: { decisions: [{ subscription_id, decision: 'approve' | 'deny' }, ...] }
+    - Checks every id (and that it's the caller's) in one query
+    - Records all decisions, events and cancellation starts (for denies) in one transaction
+    - Returns one result per item, in order; a bad item is reported there instead of
+      failing the whole batch
+    - With an Idempotency-Key header, a retry replays the first response
+    """
+    return await idempotent(idempotency_key, user.id, "POST /approvals/batch", payload,
+                            lambda: _decide_batch(payload, user, db))
+
+async def _decide_batch(payload: dict, user, db: AsyncSession) -> dict:
+    items = payload.get("decisions")
+    if not isinstance(items, list) or not items:
+        raise HTTPException(400, "decisions must be a non-empty list")
+    if len(items) > APPROVALS_BATCH_MAX:
+        raise HTTPException(400, f"at most {APPROVALS_BATCH_MAX} decisions per batch")
+
+    results, todo, seen = [], {}, set()
+    for it in items:
+        it = it if isinstance(it, dict) else {}
+        sub_id = it.get("subscription_id")
+        decision = str(it.get("decision") or "").lower().strip()
+        res = {"subscription_id": sub_id, "decision": decision, "ok": False, "cancel_started": False,
+               "cancel_request_id": None, "error": None}
+        results.append(res)
+        if not isinstance(sub_id, int):
+            res["error"] = "subscription_id is required"
+        elif decision not in {"approve", "deny"}:
+            res["error"] = "decision must be 'approve' or 'deny'"
+        elif sub_id in seen:
+            res["error"] = "duplicate subscription_id"
+        else:
+            seen.add(sub_id)
+            todo[sub_id] = res
+
+    owned = {}
+    if todo:
+        owned = dict((await db.execute(
+            select(Subscription.id, Subscription.merchant)
+            .where(Subscription.id.in_(list(todo)), Subscription.user_id == user.id)
+        )).all())
+    for sub_id, res in list(todo.items()):
+        if sub_id not in owned:
+            res["error"] = "subscription not found"
+            del todo[sub_id]
+    if not todo:
+        return {"results": results}
+
+    await db.execute(insert(Approval), [
+        {"user_id": user.id, "subscription_id": sub_id, "decision": res["decision"]} for sub_id, res in todo.items()
+    ])
+    log_events(db, [
+        event_row(user.id, f"approval.{res['decision']}", f"{res['decision']} sub {sub_id}", {"subscription_id": sub_id})
+        for sub_id, res in todo.items()
+    ])
+    for res in todo.values():
+        res["ok"] = True
+
+    from .cancellations import start_cancellations
+    from ..utils.cancel_engine import cancel_engine
+    denied = {sub_id: owned[sub_id] for sub_id, res in todo.items() if res["decision"] == "deny"}
+    for sub_id, req_id in (await start_cancellations(db, user.id, denied)).items():
+        todo[sub_id]["cancel_started"] = True
+        todo[sub_id]["cancel_request_id"] = req_id
+    if not denied:
+        await bump_async(db, user.id)
+    await db.commit()
+    if denied:
+        cancel_engine.poke()
+    return {"results": results}
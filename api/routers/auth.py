@@ -1,25 +1,35 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from ..db import get_db, Base, engine
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..db import get_async_db
 from ..models import User
 from ..schemas import UserCreate, Token
-from ..utils.security import hash_password, verify_password, create_token
+from ..utils.security import hash_password, verify_and_update_password, create_token
 
-Base.metadata.create_all(bind=engine)
 router = APIRouter(prefix="/auth", tags=["auth"])
 
+# async so bcrypt (in utils.security's hash pool) is awaited, not waited on from a
+# threadpool thread
+
 @router.post("/signup", response_model=Token)
-def signup(payload: UserCreate, db: Session = Depends(get_db)):
-    if db.query(User).filter_by(email=payload.email).first():
+async def signup(payload: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    if (await db.execute(select(User.id).filter_by(email=payload.email))).first():
         raise HTTPException(400, "Email already registered")
-    u = User(email=payload.email, pw_hash=hash_password(payload.password))
-    db.add(u); db.commit()
-    token = create_token(u.email)
+    u = User(email=payload.email, pw_hash=await hash_password(payload.password))
+    db.add(u); await db.commit()
+    token = create_token(payload.email)
     return {"access_token": token}
 
 @router.post("/login", response_model=Token)
-def login(payload: UserCreate, db: Session = Depends(get_db)):
-    u = db.query(User).filter_by(email=payload.email).first()
-    if not u or not verify_password(payload.password, u.pw_hash):
+async def login(payload: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    u = (await db.execute(select(User).filter_by(email=payload.email))).scalars().first()
+    if not u:
+        raise HTTPException(401, "Invalid credentials")
+    ok, new_hash = await verify_and_update_password(payload.password, u.pw_hash)
+    if not ok:
         raise HTTPException(401, "Invalid credentials")
-    return {"access_token": create_token(u.email)}
+    if new_hash:
+        # bcrypt cost changed since this hash was made; upgrade it in place
+        u.pw_hash = new_hash
+        await db.commit()
+    return {"access_token": create_token(payload.email)}
@@ -1,73 +1,85 @@
 # api/routers/cancellations.py
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Dict, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import bindparam, select, text
 
-from ..db import SessionLocal
-from ..utils.auth import get_current_user
-from ..utils.log import log_event
+from ..db import get_db, get_async_db
+from ..models import CancellationRequest
+from ..utils.auth import get_current_user, get_current_user_async
+from ..utils.cancel_engine import cancel_engine, enqueue
+from ..utils.idempotency import idempotent
+from ..utils.log import add_events, event_row
+from ..utils.versions import bump_async
 
 router = APIRouter(prefix="/cancellations", tags=["cancellations"])
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 @router.post("/start")
-async def start_cancellation(payload: dict, user=Depends(get_current_user), db: Session = Depends(get_db)):
+async def start_cancellation(payload: dict, idempotency_key: Optional[str] = Header(None),
+                             user=Depends(get_current_user_async), db: AsyncSession = Depends(get_async_db)):
     """
-    Step 1 behavior:
-    - Immediately set cancel_status='in_progress'
-    - Fire the adapter (stubbed success here; plug in email adapter later)
-    - Keep 'in_progress' (verification job flips it to 'canceled' later)
-    - If adapter fails, set 'failed'
+    - Queues a CancellationRequest and sets cancel_status='in_progress' (one commit)
+    - The cancellation engine (utils/cancel_engine.py) sends it to the vendor's adapter
+      and its verifier flips the subscription to 'canceled' (or 'failed' /
+      'attention_needed') once the vendor answers; follow along on the event stream or
+      GET /cancellations/status/{id}
+    - Starting one that's already under way returns the open request
+    - With an Idempotency-Key header, a retry replays the first response
     """
+    return await idempotent(idempotency_key, user.id, "POST /cancellations/start", payload,
+                            lambda: start_one(payload, user, db))
+
+async def start_one(payload: dict, user, db: AsyncSession) -> dict:
+    """POST /start minus the Idempotency-Key handling (a deny in /approvals runs this too)."""
     sub_id = payload.get("subscription_id")
     if not sub_id:
         raise HTTPException(400, "subscription_id is required")
 
-    # ensure subscription exists (and belongs to user if you enforce that)
-    sub = db.execute(text("SELECT id FROM subscriptions WHERE id=:id"), {"id": sub_id}).mappings().first()
+    sub = (await db.execute(
+        text("SELECT id, merchant FROM subscriptions WHERE id=:id AND user_id=:uid"), {"id": sub_id, "uid": user.id}
+    )).mappings().first()
     if not sub:
         raise HTTPException(404, "subscription not found")
 
-    # put the subscription into in_progress immediately
-    db.execute(text(
-        "UPDATE subscriptions SET cancel_status='in_progress' WHERE id=:id"
-    ), {"id": sub_id})
-    db.commit()
-
-    log_event(db, user.id, "cancel.start", f"Starting cancellation for sub {sub_id}", {"subscription_id": sub_id})
-
-    # ----- call your real adapter here (email/portal). For step 1, stub success. -----
-    try:
-        # result = await run_email_adapter(db, user, <full subscription row>)
-        result = {"ok": True}  # stub: success
+    req_ids = await start_cancellations(db, user.id, {sub["id"]: sub["merchant"]})
+    await db.commit()
+    cancel_engine.poke()
+    return {"subscription_id": sub["id"], "status": "in_progress", "request_id": req_ids[sub["id"]]}
 
-        if result.get("ok"):
-            log_event(db, user.id, "cancel.queued", "Adapter sent; awaiting verification",
-                      {"subscription_id": sub_id})
-            # stay in 'in_progress' for verification step
-            return {"subscription_id": sub_id, "status": "in_progress"}
-        else:
-            raise RuntimeError(result.get("error") or "adapter failed")
-
-    except Exception as e:
-        db.execute(text(
-            "UPDATE subscriptions SET cancel_status='failed' WHERE id=:id"
-        ), {"id": sub_id})
-        db.commit()
-        log_event(db, user.id, "cancel.failed", str(e), {"subscription_id": sub_id})
-        raise HTTPException(500, f"Cancellation failed: {e}")
+async def start_cancellations(db: AsyncSession, user_id: int, subs: Dict[int, str]) -> Dict[int, int]:
+    """
+    Bulk form of POST /start for {subscription_id: merchant} the caller has already checked:
+    queues the requests, marks them all in_progress in one UPDATE and adds the events.
+    Returns {subscription_id: request id}. Caller commits, then calls cancel_engine.poke().
+    """
+    if not subs:
+        return {}
+    req_ids = await enqueue(db, user_id, subs)
+    await db.execute(
+        text("UPDATE subscriptions SET cancel_status='in_progress' WHERE id IN :ids").bindparams(
+            bindparam("ids", expanding=True)),
+        {"ids": list(subs)},
+    )
+    await add_events(db, [
+        event_row(user_id, "cancel.start", f"Starting cancellation for sub {sid}",
+                  {"subscription_id": sid, "request_id": req_ids[sid]})
+        for sid in subs
+    ])
+    await bump_async(db, user_id)
+    return req_ids
 
 @router.get("/status/{subscription_id}")
 def get_cancellation_status(subscription_id: int, user=Depends(get_current_user), db: Session = Depends(get_db)):
     row = db.execute(text(
-        "SELECT id, cancel_status, canceled_at FROM subscriptions WHERE id=:id"
-    ), {"id": subscription_id}).mappings().first()
+        "SELECT id, cancel_status, canceled_at FROM subscriptions WHERE id=:id AND user_id=:uid"
+    ), {"id": subscription_id, "uid": user.id}).mappings().first()
     if not row:
         raise HTTPException(404, "not found")
-    return {"subscription_id": row["id"], "cancel_status": row["cancel_status"], "canceled_at": row["canceled_at"]}
+    CR = CancellationRequest
+    req = db.execute(
+        select(CR.id, CR.status, CR.vendor, CR.attempts, CR.checks, CR.error, CR.started_at, CR.completed_at)
+        .where(CR.subscription_id == subscription_id).order_by(CR.id.desc()).limit(1)
+    ).mappings().first()
+    return {"subscription_id": row["id"], "cancel_status": row["cancel_status"], "canceled_at": row["canceled_at"],
+            "request": dict(req) if req else None}
@@ -1,20 +1,147 @@
-from fastapi import APIRouter, Depends
+import os
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from ..db import get_db, Base, engine
+from ..db import get_db
 from ..deps import get_current_user
-from ..models import EventLog, User
+from ..models import EventLog
+from ..utils.archive import read_archived
 
-
-
-Base.metadata.create_all(bind=engine)
+EVENTS_MAX_PAGE = int(os.getenv("EVENTS_MAX_PAGE", "200"))
 
 router = APIRouter(prefix="/events", tags=["events"])
 
 @router.get("/")
-def list_events(limit: int = 50, db: Session = Depends(get_db), me = Depends(get_current_user)):
-    user = db.query(User).filter_by(email=me.email).first()
-    rows = (db.query(EventLog)
-            .filter_by(user_id=user.id)
-            .order_by(EventLog.id.desc())
-            .limit(limit).all())
+def list_events(
+    limit: int = Query(50, ge=1),
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    type: Optional[str] = None,
+    archived: bool = False,
+    db: Session = Depends(get_db),
+    me = Depends(get_current_user),
+):
+    """
+    Newest first. Page back with ?before_id=<last id you have>; poll for new ones with
+    ?after_id=<first id you have>. limit is capped at EVENTS_MAX_PAGE.
+    Each page is one range scan on (user_id[, type], id), however deep it is.
+    ?archived=true pages through events moved out by retention instead (same cursors).
+    A user's ids are handed out in commit order (utils/log.py), so an after_id poll never skips one.
+    """
+    if before_id is not None and after_id is not None:
+        raise HTTPException(400, "use before_id or after_id, not both")
+    limit = min(limit, EVENTS_MAX_PAGE)
+    if archived:
+        return ORJSONResponse(read_archived(me.id, limit, before_id=before_id, after_id=after_id, type_=type))
+    q = select(EventLog.id, EventLog.type, EventLog.message, EventLog.created_at).where(EventLog.user_id == me.id)
+    if type:
+        q = q.where(EventLog.type == type)
+    if after_id is not None:
+        # oldest-first from the cursor so a big gap doesn't skip events; flipped below
+        q = q.where(EventLog.id > after_id).order_by(EventLog.id.asc())
+    else:
+        if before_id is not None:
+            q = q.where(EventLog.id < before_id)
+        q = q.order_by(EventLog.id.desc())
+    rows = [dict(r) for r in db.execute(q.limit(limit)).mappings()]
+    if after_id is not None:
+        rows.reverse()
+    return ORJSONResponse(rows)  # plain rows, encoded as-is (no jsonable_encoder pass)
+
+# --- live stream (SSE) ---
+import asyncio
+from fastapi import Header, Request
+from fastapi.responses import StreamingResponse
+from ..db import get_async_sessionmaker, json_dumps
+from ..utils.auth import resolve_identity_async
+from ..utils.pubsub import broker
+
+SSE_HEARTBEAT_S = float(os.getenv("SSE_HEARTBEAT_S", "15"))
+SSE_MAX_CLIENTS = int(os.getenv("SSE_MAX_CLIENTS", "10000"))
+SSE_REPLAY_MAX = int(os.getenv("SSE_REPLAY_MAX", "500"))         # events per replay query
+SSE_REPLAY_LIMIT = int(os.getenv("SSE_REPLAY_LIMIT", "10000"))   # past this many missed, send a gap instead
+
+def _sse(ev: dict) -> str:
+    return f"id: {ev['id']}\ndata: {json_dumps(ev)}\n\n"
+
+async def _replay_page(user_id: int, after: int) -> list:
+    async with get_async_sessionmaker()() as db:
+        rows = (await db.execute(
+            select(EventLog.id, EventLog.type, EventLog.message, EventLog.created_at)
+            .where(EventLog.user_id == user_id, EventLog.id > after)
+            .order_by(EventLog.id.asc()).limit(SSE_REPLAY_MAX)
+        )).all()
     return [{"id": r.id, "type": r.type, "message": r.message, "created_at": r.created_at.isoformat()} for r in rows]
+
+@router.get("/stream")
+async def stream_events(
+    request: Request,
+    token: Optional[str] = None,
+    last_event_id: Optional[int] = None,
+    last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID"),
+    authorization: Optional[str] = Header(None),
+):
+    """
+    Server-sent events: each new event for the user as `id: <id>` + `data: <json>`.
+    EventSource can't set headers, so the token may come as ?token=. On reconnect the
+    browser sends Last-Event-ID (or pass ?last_event_id=) and missed events are replayed
+    from the DB first, SSE_REPLAY_MAX per query, until caught up. More than
+    SSE_REPLAY_LIMIT missed: the stream sends `event: gap` (data {"after_id": <last id
+    sent>}) and closes, and the client should refetch GET /events instead. Nothing
+    touches the DB while the stream is idle.
+    """
+    tok = token
+    if not tok and authorization and authorization.lower().startswith("bearer "):
+        tok = authorization[7:]
+    if not tok:
+        raise HTTPException(401, "Not authenticated")
+    if broker.clients >= SSE_MAX_CLIENTS:
+        raise HTTPException(503, "Too many live connections", headers={"Retry-After": "5"})
+    resume = last_event_id
+    if last_event_id_header and last_event_id_header.isdigit():
+        resume = int(last_event_id_header)
+
+    # short-lived sessions (auth here, one per replay page): idle streams don't pin pool connections
+    async with get_async_sessionmaker()() as db:
+        me = await resolve_identity_async(tok, db)
+        if me is None:
+            raise HTTPException(401, "Invalid token")
+
+    async def gen():
+        # subscribed here, not in the handler: if the response is never iterated (client
+        # gone first) there's nothing to leak, and the finally always pairs with it
+        sub = broker.subscribe(me.id)  # before the replay queries, so nothing falls in between
+        try:
+            yield "retry: 3000\n\n"
+            last = resume  # highest id sent; ids follow commit order, so live ones at or below it were replayed
+            if resume is not None:
+                replayed = 0
+                while True:
+                    page = await _replay_page(me.id, last)
+                    for ev in page:
+                        yield _sse(ev)
+                    if page:
+                        last = page[-1]["id"]
+                        replayed += len(page)
+                    if len(page) < SSE_REPLAY_MAX:
+                        break
+                    if replayed >= SSE_REPLAY_LIMIT:
+                        yield f"event: gap\ndata: {json_dumps({'after_id': last})}\n\n"
+                        return
+            while True:
+                try:
+                    ev = await asyncio.wait_for(sub.get(), SSE_HEARTBEAT_S)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"  # keeps proxies from closing idle streams
+                    continue
+                if ev is None:
+                    return  # fell too far behind; the client reconnects and replays
+                if last is None or ev["id"] > last:
+                    yield _sse(ev)
+        finally:
+            broker.unsubscribe(sub)
+
+    return StreamingResponse(gen(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
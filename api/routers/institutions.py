@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
 from ..db import get_db
-from ..models import InstitutionConnection, User
+from ..models import InstitutionConnection
 from ..deps import get_current_user
 
 router = APIRouter(prefix="/institutions", tags=["institutions"])
@@ -9,8 +9,7 @@ router = APIRouter(prefix="/institutions", tags=["institutions"])
 @router.post("/link")
 def link_account(provider: str = "plaid", db: Session = Depends(get_db), me = Depends(get_current_user)):
     # Stub: create a fake link to simulate success
-    user = db.query(User).filter_by(email=me.email).first()
-    conn = InstitutionConnection(user_id=user.id,
+    conn = InstitutionConnection(user_id=me.id,
                                  provider=provider,
                                  status="linked",
                                  access_token_ref="fake_ref")
@@ -0,0 +1,13 @@
+from fastapi import APIRouter, Depends, HTTPException
+from ..deps import get_current_user_async
+from ..schemas import JobOut
+from ..utils.jobs import job_queue
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+@router.get("/{job_id}", response_model=JobOut)
+async def get_job(job_id: str, me = Depends(get_current_user_async)):
+    job = await job_queue.get(job_id)
+    if not job or job["user_id"] != me.id:
+        raise HTTPException(404, "Job not found")
+    return job
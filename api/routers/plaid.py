@@ -1,40 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
-import os, requests
+import os
 
-from ..db import get_db
-from ..deps import get_current_user
-from ..models import InstitutionConnection, User
+from ..db import get_async_db
+from ..deps import get_current_user_async
+from ..models import InstitutionConnection
+from ..utils.plaid_client import plaid_req
 
 router = APIRouter(prefix="/plaid", tags=["plaid"])
 
-PLAID_ENV = os.getenv("PLAID_ENV", "sandbox")
-BASES = {
-    "sandbox": "https://sandbox.plaid.com",
-    "development": "https://development.plaid.com",
-    "production": "https://production.plaid.com",
-}
-BASE = BASES[PLAID_ENV]
-CID = os.getenv("PLAID_CLIENT_ID")
-SEC = os.getenv("PLAID_SECRET")
 PRODUCTS = os.getenv("PLAID_PRODUCTS", "transactions").split(",")
 COUNTRY_CODES = os.getenv("PLAID_COUNTRY_CODES", "US").split(",")
 
-def plaid_req(path: str, payload: dict):
-    if not (CID and SEC):
-        raise HTTPException(500, "Plaid keys not set in .env")
-    body = {"client_id": CID, "secret": SEC, **payload}
-    r = requests.post(f"{BASE}{path}", json=body, timeout=20)
-    if not r.ok:
-        raise HTTPException(r.status_code, r.text)
-    return r.json()
-
 @router.post("/link_token")
-def create_link_token(db: Session = Depends(get_db), me = Depends(get_current_user)):
-    user = db.query(User).filter_by(email=me.email).first()
-    data = plaid_req("/link/token/create", {
-        "user": {"client_user_id": str(user.id)},
+async def create_link_token(me = Depends(get_current_user_async)):
+    data = await plaid_req("/link/token/create", {
+        "user": {"client_user_id": str(me.id)},
         "client_name": "Approval v2",
         "products": PRODUCTS,
         "country_codes": COUNTRY_CODES,
@@ -46,15 +28,14 @@ class PublicTokenIn(BaseModel):
     public_token: str
 
 @router.post("/exchange")
-def exchange_public_token(payload: PublicTokenIn, db: Session = Depends(get_db), me = Depends(get_current_user)):
-    data = plaid_req("/item/public_token/exchange", {
+async def exchange_public_token(payload: PublicTokenIn, db: AsyncSession = Depends(get_async_db), me = Depends(get_current_user_async)):
+    # a public token exchanges once; a blind retry after Plaid took it would only get an error back
+    data = await plaid_req("/item/public_token/exchange", {
         "public_token": payload.public_token
-    })
+    }, retry=False)
     access_token = data["access_token"]
-    user = db.query(User).filter_by(email=me.email).first()
     conn = InstitutionConnection(
-        user_id=user.id, provider="plaid", status="linked", access_token_ref=access_token
+        user_id=me.id, provider="plaid", status="linked", access_token_ref=access_token
     )
-    db.add(conn); db.commit()
+    db.add(conn); await db.commit()
     return {"status": "linked"}
-
@@ -1,10 +1,20 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from datetime import datetime
-from ..db import get_db
-from ..models import Subscription, User, SubStatus
+from ..db import get_db, json_bytes
+from ..models import Subscription, SubStatus
 from ..schemas import SubscriptionOut
 from ..deps import get_current_user
+from ..utils.renewals import renewal_scheduler
+from ..utils.subs import SUB_COLUMNS, upsert_subscriptions, user_subs
+from ..utils.versions import cached_json, current_version
+
+# Read paths select just SubscriptionOut's columns and encode the rows straight to JSON
+# (orjson handles datetimes and the status enum); response_model stays for the docs only.
+def _rows_json(db: Session, q) -> bytes:
+    return json_bytes([dict(r) for r in db.execute(q).mappings()])
 
 router = APIRouter(prefix="/subscriptions", tags=["subscriptions"])
 
@@ -16,158 +26,95 @@ FAKE_SET = [
 
 @router.post("/scan", response_model=list[SubscriptionOut])
 def scan(db: Session = Depends(get_db), me = Depends(get_current_user)):
-    user = db.query(User).filter_by(email=me.email).first()
-    out = []
-    for it in FAKE_SET:
-        s = Subscription(user_id=user.id,
-                         merchant=it["merchant"],
-                         plan=it.get("plan"),
-                         amount=it["amount"],
-                         interval=it["interval"],
-                         next_renewal_at=datetime.utcnow(),
-                         status=SubStatus.active)
-        db.add(s); db.flush()
-        out.append(s)
+    now = datetime.utcnow()
+    rows = [
+        {"merchant": it["merchant"], "plan": it.get("plan"), "amount": it["amount"],
+         "interval": it["interval"], "next_renewal_at": now}
+        for it in FAKE_SET
+    ]
+    subs = upsert_subscriptions(db, me.id, rows)
     db.commit()
-    return out
+    renewal_scheduler.poke(r["next_renewal_at"] for r in rows)
+    return ORJSONResponse([subs[it["merchant"]] for it in FAKE_SET])
 
 @router.get("/", response_model=list[SubscriptionOut])
-def list_subs(db: Session = Depends(get_db), me = Depends(get_current_user)):
-    user = db.query(User).filter_by(email=me.email).first()
-    subs = db.query(Subscription).filter_by(user_id=user.id).all()
-    return subs
+def list_subs(request: Request, db: Session = Depends(get_db), me = Depends(get_current_user)):
+    """ETag'd on the user's data version; If-None-Match gets a 304 without loading subscriptions."""
+    version = current_version(db, me.id)  # read before the rows, so the tag is never newer than the data
+    def build():
+        return _rows_json(db, user_subs(me.id))
+    return cached_json(request, me.id, "list", version, build)
 
 # --- REAL SCAN (Plaid) ---
-import os, requests, math
-from datetime import timedelta, date
-from collections import defaultdict
-from ..models import InstitutionConnection
-
-PLAID_ENV = os.getenv("PLAID_ENV", "sandbox")
-BASES = {
-    "sandbox": "https://sandbox.plaid.com",
-    "development": "https://development.plaid.com",
-    "production": "https://production.plaid.com",
-}
-BASE = BASES[PLAID_ENV]
-CID = os.getenv("PLAID_CLIENT_ID")
-SEC = os.getenv("PLAID_SECRET")
-
-def plaid_req(path: str, payload: dict):
-    if not (CID and SEC):
-        raise HTTPException(500, "Plaid keys not set")
-    body = {"client_id": CID, "secret": SEC, **payload}
-    r = requests.post(f"{BASE}{path}", json=body, timeout=20)
-    if not r.ok:
-        raise HTTPException(r.status_code, r.text)
-    return r.json()
-
-def normalize_name(s: str) -> str:
-    s = (s or "").lower()
-    junk = [" inc", " llc", ".com", " subscription", " member", "*", "-", "_"]
-    for j in junk: s = s.replace(j, " ")
-    s = " ".join(s.split())
-    # Simple canonical map
-    if "netflix" in s: return "Netflix"
-    if "spotify" in s: return "Spotify"
-    if "la fitness" in s or "lafitness" in s: return "LA Fitness"
-    if "apple" in s and "services" in s: return "Apple Services"
-    if "microsoft" in s: return "Microsoft"
-    if "google" in s or "youtube" in s: return "Google/YouTube"
-    return s.title()
-
-def looks_monthly(dates):
-    if len(dates) < 2: return False
-    dates = sorted(dates)
-    gaps = [(dates[i] - dates[i-1]).days for i in range(1, len(dates))]
-    # any gap roughly monthly?
-    return any(20 <= g <= 40 for g in gaps)
-
-@router.post("/scan_real", response_model=list[SubscriptionOut])
-def scan_real(db: Session = Depends(get_db), me = Depends(get_current_user)):
-    user = db.query(User).filter_by(email=me.email).first()
-    conn = (
-        db.query(InstitutionConnection)
-        .filter_by(user_id=user.id, provider="plaid")
-        .order_by(InstitutionConnection.id.desc())
-        .first()
-    )
-    if not conn:
+from typing import Optional
+from fastapi import HTTPException, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..db import get_async_db
+from ..deps import get_current_user_async
+from ..schemas import JobOut
+from ..utils.jobs import job_queue
+from ..utils.scan import SCAN_MAX_DAYS, latest_connection
+
+@router.post("/scan_real", response_model=JobOut, status_code=202)
+async def scan_real(
+    response: Response,
+    days: Optional[int] = Query(None, ge=1, le=SCAN_MAX_DAYS),
+    db: AsyncSession = Depends(get_async_db),
+    me = Depends(get_current_user_async),
+):
+    """
+    Queues a scan and returns the job right away; poll GET /jobs/{id} for the result
+    (the user's subscriptions). A scan already queued/running for the user is reused.
+    Default: incremental scan from the connection's stored sync cursor.
+    ?days=N: one-off full rescan of the last N days (doesn't touch the cursor).
+    """
+    if not await latest_connection(db, me.id):
         raise HTTPException(400, "No Plaid connection for user")
-
-    today = date.today()
-    start = (today - timedelta(days=90)).isoformat()
-    end = today.isoformat()
-
-    data = plaid_req("/transactions/get", {
-        "access_token": conn.access_token_ref,
-        "start_date": start,
-        "end_date": end,
-        "options": {"count": 500, "offset": 0}
-    })
-    txns = data.get("transactions", [])
-
-    # group by normalized merchant + rounded amount
-    groups = defaultdict(lambda: {"dates": [], "amounts": []})
-    for t in txns:
-        nm = normalize_name(t.get("merchant_name") or t.get("name") or "")
-        amt = abs(float(t.get("amount", 0)))
-        dt = datetime.fromisoformat(t.get("date"))
-        key = (nm, round(amt, 2))
-        groups[key]["dates"].append(dt)
-        groups[key]["amounts"].append(amt)
-
-    created_or_updated = []
-    for (merchant, amt_key), info in groups.items():
-        if len(info["dates"]) < 2: 
-            continue
-        if not looks_monthly(info["dates"]):
-            continue
-        amount = round(sum(info["amounts"]) / len(info["amounts"]), 2)
-        next_renew = max(info["dates"]) + timedelta(days=30)
-
-        existing = db.query(Subscription).filter_by(user_id=user.id, merchant=merchant).first()
-        if not existing:
-            s = Subscription(
-                user_id=user.id,
-                merchant=merchant,
-                plan=None,
-                amount=amount,
-                interval="monthly",
-                next_renewal_at=next_renew,
-                status=SubStatus.active
-            )
-            db.add(s); db.flush()
-            created_or_updated.append(s)
-        else:
-            existing.amount = amount
-            existing.interval = "monthly"
-            existing.next_renewal_at = next_renew
-            existing.status = SubStatus.active
-            created_or_updated.append(existing)
-
-    db.commit()
-    # return user’s current subs
-    return db.query(Subscription).filter_by(user_id=user.id).all()
+    job = await job_queue.submit("scan", me.id, {"days": days} if days is not None else {})
+    response.headers["Location"] = f"/jobs/{job['id']}"
+    return job
 
 
 # --- UPCOMING RENEWALS ---
 from datetime import timedelta  # top of file already imports datetime
 
 @router.get("/upcoming", response_model=list[SubscriptionOut])
-def upcoming(days: int = 7, db: Session = Depends(get_db), me = Depends(get_current_user)):
-    user = db.query(User).filter_by(email=me.email).first()
-    cutoff = datetime.utcnow() + timedelta(days=days)
-    subs = (
-        db.query(Subscription)
-        .filter(
-            Subscription.user_id == user.id,
-            Subscription.status.in_([SubStatus.active, SubStatus.canceling]),
-            Subscription.next_renewal_at.isnot(None),
-            Subscription.next_renewal_at <= cutoff,
-        )
-        .order_by(Subscription.next_renewal_at.asc())
-        .all()
+def upcoming(request: Request, days: int = 7, db: Session = Depends(get_db), me = Depends(get_current_user)):
+    # the window moves with the clock, not just with writes: cut off on whole minutes
+    # and put that minute in the ETag
+    cutoff = (datetime.utcnow() + timedelta(days=days)).replace(second=0, microsecond=0)
+    version = current_version(db, me.id)
+    def build():
+        return _rows_json(db, (
+            select(*SUB_COLUMNS)
+            .where(
+                Subscription.user_id == me.id,
+                Subscription.status.in_([SubStatus.active, SubStatus.canceling]),
+                Subscription.next_renewal_at.isnot(None),
+                Subscription.next_renewal_at <= cutoff,
+            )
+            .order_by(Subscription.next_renewal_at.asc())
+        ))
+    return cached_json(request, me.id, f"upcoming:{cutoff.isoformat()}", version, build)
+
+
+
+# --- TIMELINE ---
+from ..models import EventLog
+from .events import EVENTS_MAX_PAGE
+
+@router.get("/{sub_id}/timeline")
+def timeline(sub_id: int, limit: int = Query(50, ge=1), before_id: Optional[int] = None,
+             db: Session = Depends(get_db), me = Depends(get_current_user)):
+    """Every event about one subscription, newest first (page back with ?before_id=)."""
+    owned = db.query(Subscription.id).filter_by(id=sub_id, user_id=me.id).first()
+    if not owned:
+        raise HTTPException(404, "subscription not found")
+    q = (
+        select(EventLog.id, EventLog.type, EventLog.message, EventLog.payload, EventLog.created_at)
+        .where(EventLog.subscription_id == sub_id, EventLog.user_id == me.id)
     )
-    return subs
-
+    if before_id is not None:
+        q = q.where(EventLog.id < before_id)
+    rows = db.execute(q.order_by(EventLog.id.desc()).limit(min(limit, EVENTS_MAX_PAGE))).mappings()
+    return ORJSONResponse([dict(r) for r in rows])
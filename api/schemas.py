@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional
+from typing import Any, Optional
 from datetime import datetime
 from .models import SubStatus, CancelStatus
 
@@ -32,3 +32,13 @@ class CancellationOut(BaseModel):
     status: CancelStatus
     class Config:
         from_attributes = True
+
+class JobOut(BaseModel):
+    id: str
+    kind: str
+    status: str  # queued | running | done | failed
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
@@ -0,0 +1,57 @@
+"""
+Move old event_logs rows into the cold archive (see api/utils/archive.py).
+
+    python -m api.scripts.archive_events                  # older than EVENT_RETENTION_DAYS
+    python -m api.scripts.archive_events --days 30 --vacuum
+    python -m api.scripts.archive_events --dry-run        # just count
+
+Safe to run from cron while the API is up: each batch is its own short transaction.
+Prints rows moved per second and how much of the table was reclaimed. Without
+--vacuum, SQLite keeps the freed pages inside the file (reused by new rows) and Postgres
+leaves them to autovacuum.
+"""
+import argparse, json
+from pathlib import Path
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path=Path(__file__).resolve().parent.parent / ".env")
+
+from ..db import engine
+from ..utils.archive import (EVENT_ARCHIVE_BATCH, EVENT_ARCHIVE_DIR, EVENT_RETENTION_DAYS,
+                             archive_events, database_file_bytes, table_bytes, vacuum)
+
+def _mb(n):
+    return round(n / 1048576, 2) if n is not None else None
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--days", type=int, default=EVENT_RETENTION_DAYS, help="archive rows older than this")
+    p.add_argument("--batch", type=int, default=EVENT_ARCHIVE_BATCH)
+    p.add_argument("--dir", default=EVENT_ARCHIVE_DIR)
+    p.add_argument("--dry-run", action="store_true")
+    p.add_argument("--vacuum", action="store_true", help="VACUUM afterwards to hand space back")
+    a = p.parse_args()
+
+    before, file_before = table_bytes(engine), database_file_bytes(engine)
+
+    def progress(s):
+        rate = s["rows"] / s["elapsed_s"] if s["elapsed_s"] else 0.0
+        print(f"  {s['rows']} rows, {s['files']} files, {_mb(s['bytes'])} MB written, {rate:.0f} rows/s", flush=True)
+
+    stats = archive_events(engine, a.days, a.batch, a.dir, dry_run=a.dry_run, progress=progress)
+    after = table_bytes(engine)
+    if a.vacuum and not a.dry_run:
+        vacuum(engine)
+    stats.update({
+        "table_mb_before": _mb(before),
+        "table_mb_after": _mb(after),
+        "table_mb_reclaimed": _mb(before - after) if before is not None and after is not None else None,
+        "archive_mb_written": _mb(stats["bytes"]),
+    })
+    if file_before is not None:
+        stats["db_file_mb_before"] = _mb(file_before)
+        stats["db_file_mb_after"] = _mb(database_file_bytes(engine))
+    print(json.dumps(stats, indent=2))
+
+if __name__ == "__main__":
+    main()
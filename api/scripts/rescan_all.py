@@ -0,0 +1,190 @@
+"""
+Rescan every linked Plaid connection, so renewal dates stay fresh for users who never
+open the app.
+
+    python -m api.scripts.rescan_all --concurrency 16 --rate 40
+    python -m api.scripts.rescan_all --stale-hours 24        # skip recently synced ones
+    python -m api.scripts.rescan_all --retry-failed          # only what failed last run
+
+Connections are streamed from the DB in id order (keyset pages of --batch), scanned by
+--concurrency workers sharing one Plaid client capped at --rate requests/sec. A failing
+connection is recorded and skipped; it doesn't stop the run. Progress is checkpointed
+to --checkpoint as a low watermark (every id at or below it is finished), so a crashed
+run picks up where it left off -- connections past the watermark may be rescanned, which
+is harmless. Pass --fresh to ignore an unfinished checkpoint.
+"""
+import argparse, asyncio, json, os, time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path=Path(__file__).resolve().parent.parent / ".env")
+
+from fastapi import HTTPException
+from sqlalchemy import or_, select
+from ..db import dispose_async_engine, get_async_sessionmaker
+from ..models import InstitutionConnection
+from ..utils.plaid_client import PLAID_MAX_CONCURRENCY, PlaidClient, plaid_stats, use_plaid
+from ..utils.ratelimit import TokenBucket
+from ..utils.scan import run_scan, run_sync
+
+class Checkpoint:
+    def __init__(self, path: str):
+        self.path = path
+        self.state = {"watermark": 0, "done": 0, "failed": {}, "finished": False}
+
+    def load(self) -> bool:
+        try:
+            with open(self.path) as f:
+                self.state.update(json.load(f))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.path)  # atomic, so a crash never leaves half a file
+
+async def stream_connections(after_id: int, batch: int, stale_before: Optional[datetime]) -> AsyncIterator[int]:
+    """Connection ids > after_id, ascending, one keyset page at a time."""
+    last = after_id
+    while True:
+        q = select(InstitutionConnection.id).where(
+            InstitutionConnection.provider == "plaid", InstitutionConnection.id > last
+        )
+        if stale_before is not None:
+            q = q.where(or_(InstitutionConnection.last_synced_at.is_(None),
+                            InstitutionConnection.last_synced_at < stale_before))
+        async with get_async_sessionmaker()() as db:
+            ids = (await db.execute(q.order_by(InstitutionConnection.id).limit(batch))).scalars().all()
+        if not ids:
+            return
+        for i in ids:
+            yield i
+        last = ids[-1]
+
+async def rescan_one(conn_id: int, days: Optional[int]):
+    async with get_async_sessionmaker()() as db:
+        conn = await db.get(InstitutionConnection, conn_id)
+        if conn is None:
+            return  # unlinked since we listed it
+        if days:
+            await run_scan(db, conn, days)
+        else:
+            await run_sync(db, conn)
+
+async def _aiter(items):
+    for i in items:
+        yield i
+
+async def run(a) -> dict:
+    cp = Checkpoint(a.checkpoint)
+    if a.fresh or not cp.load() or (cp.state["finished"] and not a.retry_failed):
+        cp.state = {"watermark": 0, "done": 0, "failed": {}, "finished": False}
+    retry = sorted(int(i) for i in cp.state["failed"]) if a.retry_failed else None
+    if retry is not None:
+        cp.state["failed"] = {}
+    stale_before = datetime.utcnow() - timedelta(hours=a.stale_hours) if a.stale_hours else None
+
+    limiter = TokenBucket(a.rate) if a.rate > 0 else None
+    client = PlaidClient(concurrency=max(a.concurrency, PLAID_MAX_CONCURRENCY), rate_limiter=limiter)
+    use_plaid(client)
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=a.concurrency * 2)
+    inflight: set = set()
+    dispatched = cp.state["watermark"]
+    done = failed = 0
+    errors: Dict[int, str] = {}
+    t0 = time.perf_counter()
+    saved_at = reported_at = t0
+
+    def progress(final: bool = False):
+        nonlocal saved_at, reported_at
+        now = time.perf_counter()
+        if retry is None:
+            cp.state["watermark"] = min(inflight) - 1 if inflight else dispatched
+        if final or now - saved_at >= 1.0:
+            cp.save()
+            saved_at = now
+        if final or now - reported_at >= a.report_every:
+            reported_at = now
+            mins = max(now - t0, 1e-9) / 60
+            throttled = f", throttled {limiter.waited:.1f}s" if limiter else ""
+            print(f"[{now - t0:7.1f}s] {done} ok, {failed} failed, {(done + failed) / mins:.1f} conn/min, "
+                  f"watermark {cp.state['watermark']}{throttled}", flush=True)
+
+    exhausted = True
+
+    async def produce():
+        nonlocal dispatched, exhausted
+        ids = _aiter(retry) if retry is not None else stream_connections(cp.state["watermark"], a.batch, stale_before)
+        n = 0
+        async for cid in ids:
+            if a.limit and n >= a.limit:
+                exhausted = False  # --limit: leave the checkpoint resumable
+                break
+            inflight.add(cid)
+            dispatched = cid
+            await queue.put(cid)
+            n += 1
+        for _ in range(a.concurrency):
+            await queue.put(None)
+
+    async def work():
+        nonlocal done, failed
+        while True:
+            cid = await queue.get()
+            if cid is None:
+                return
+            try:
+                await rescan_one(cid, a.days)
+                done += 1
+            except Exception as e:  # isolate: record and move on
+                failed += 1
+                errors[cid] = str(e.detail) if isinstance(e, HTTPException) else f"{type(e).__name__}: {e}"
+                cp.state["failed"][str(cid)] = errors[cid][:500]
+            finally:
+                inflight.discard(cid)
+                cp.state["done"] += 1
+                progress()
+
+    try:
+        await asyncio.gather(produce(), *(work() for _ in range(a.concurrency)))
+        cp.state["finished"] = exhausted
+    finally:
+        progress(final=True)
+        await client.aclose()
+        await dispose_async_engine()
+
+    elapsed = time.perf_counter() - t0
+    return {
+        "ok": done,
+        "failed": failed,
+        "elapsed_s": round(elapsed, 2),
+        "conn_per_min": round((done + failed) / max(elapsed, 1e-9) * 60, 1),
+        "throttled_s": round(limiter.waited, 2) if limiter else 0.0,
+        "failures": dict(list(errors.items())[:20]),
+        "plaid": plaid_stats(),
+    }
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--concurrency", type=int, default=8, help="connections scanned at once")
+    p.add_argument("--rate", type=float, default=float(os.getenv("PLAID_RATE_LIMIT", "0")) or 20.0,
+                   help="Plaid requests/sec for the whole run (0 = no cap)")
+    p.add_argument("--batch", type=int, default=500, help="connection ids fetched per keyset page")
+    p.add_argument("--days", type=int, default=None, help="full /transactions/get rescan of N days instead of an incremental sync")
+    p.add_argument("--stale-hours", type=float, default=0, help="only connections not synced in this many hours")
+    p.add_argument("--limit", type=int, default=0, help="stop after N connections (0 = all)")
+    p.add_argument("--checkpoint", default=".rescan_checkpoint.json")
+    p.add_argument("--fresh", action="store_true", help="ignore an unfinished checkpoint")
+    p.add_argument("--retry-failed", action="store_true", help="rescan only the connections that failed last run")
+    p.add_argument("--report-every", type=float, default=10.0, help="seconds between progress lines")
+    a = p.parse_args()
+    print(json.dumps(asyncio.run(run(a)), indent=2))
+
+if __name__ == "__main__":
+    main()
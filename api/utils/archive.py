@@ -0,0 +1,167 @@
+"""
+Event-log retention.
+
+Rows older than EVENT_RETENTION_DAYS are moved out of event_logs, in id order and in
+batches, into gzip'd NDJSON files partitioned by day:
+
+    EVENT_ARCHIVE_DIR/2024-05-01/events-<first id>-<last id>.ndjson.gz
+
+Each file is fully written (and fsync'd) before its rows are deleted, so a crash can at
+worst archive a batch twice; readers drop duplicate ids. Archived events stay readable
+through GET /events/?archived=true, which scans the files newest-first -- slow next to
+the table, but it's the cold path.
+"""
+import gzip, os, re, time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from sqlalchemy import delete, select, text
+from sqlalchemy.engine import Engine
+from ..db import json_dumps, json_loads
+from ..models import EventLog
+
+EVENT_RETENTION_DAYS = int(os.getenv("EVENT_RETENTION_DAYS", "90"))
+EVENT_ARCHIVE_DIR = os.getenv("EVENT_ARCHIVE_DIR", "./event_archive")  # next to ./app.db by default
+EVENT_ARCHIVE_BATCH = int(os.getenv("EVENT_ARCHIVE_BATCH", "5000"))
+
+_NAME = re.compile(r"events-(\d+)-(\d+)\.ndjson\.gz$")
+_COLS = (EventLog.id, EventLog.user_id, EventLog.type, EventLog.message, EventLog.payload,
+         EventLog.subscription_id, EventLog.created_at)
+
+def _doc(r) -> dict:
+    return {"id": r.id, "user_id": r.user_id, "type": r.type, "message": r.message,
+            "payload": r.payload, "subscription_id": r.subscription_id,
+            "created_at": r.created_at.isoformat() if r.created_at else None}
+
+def _write(root: Path, day: str, docs: List[dict]) -> int:
+    d = root / day
+    d.mkdir(parents=True, exist_ok=True)
+    path = d / f"events-{docs[0]['id']}-{docs[-1]['id']}.ndjson.gz"
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as gz:
+            for doc in docs:
+                gz.write(json_dumps(doc).encode() + b"\n")
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp, path)
+    return path.stat().st_size
+
+def archive_events(engine: Engine, older_than_days: int = EVENT_RETENTION_DAYS,
+                   batch: int = EVENT_ARCHIVE_BATCH, root: str = EVENT_ARCHIVE_DIR,
+                   dry_run: bool = False, progress: Optional[Callable[[dict], None]] = None) -> dict:
+    """
+    Move rows created before now - older_than_days into archive files.
+    Walks the primary key (ids grow with time), so no created_at index is needed: the
+    run stops at the first row that is still inside the retention window.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    out = Path(root)
+    stats = {"rows": 0, "files": 0, "bytes": 0, "batches": 0, "cutoff": cutoff.isoformat()}
+    last_id = 0
+    t0 = time.perf_counter()
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(*_COLS).where(EventLog.id > last_id).order_by(EventLog.id).limit(batch)
+            ).all()
+            old = []
+            for r in rows:
+                if r.created_at is not None and r.created_at >= cutoff:
+                    break
+                old.append(r)
+            if not old:
+                break
+            if not dry_run:
+                by_day: Dict[str, List[dict]] = {}
+                for r in old:
+                    by_day.setdefault((r.created_at or cutoff).date().isoformat(), []).append(_doc(r))
+                for day, docs in by_day.items():
+                    stats["bytes"] += _write(out, day, docs)
+                    stats["files"] += 1
+                conn.execute(delete(EventLog).where(EventLog.id.in_([r.id for r in old])))
+            stats["rows"] += len(old)
+            stats["batches"] += 1
+            last_id = old[-1].id
+        if progress:
+            progress({**stats, "elapsed_s": time.perf_counter() - t0})
+        if len(old) < len(rows) or len(rows) < batch:
+            break  # reached the retention window (or the end of the table)
+    stats["elapsed_s"] = round(time.perf_counter() - t0, 3)
+    stats["rows_per_s"] = round(stats["rows"] / stats["elapsed_s"], 1) if stats["elapsed_s"] else 0.0
+    return stats
+
+def table_bytes(engine: Engine) -> Optional[int]:
+    """On-disk size of event_logs + its indexes (whole file, minus free pages, on SQLite)."""
+    with engine.connect() as conn:
+        if engine.dialect.name == "postgresql":
+            return conn.execute(text("SELECT pg_total_relation_size('event_logs')")).scalar()
+        if engine.dialect.name == "sqlite":
+            try:
+                return conn.exec_driver_sql(
+                    "SELECT SUM(pgsize) FROM dbstat WHERE name = 'event_logs' OR name IN "
+                    "(SELECT name FROM sqlite_master WHERE tbl_name = 'event_logs' AND type = 'index')"
+                ).scalar()
+            except Exception:  # dbstat not compiled in
+                page = conn.exec_driver_sql("PRAGMA page_size").scalar()
+                used = conn.exec_driver_sql("PRAGMA page_count").scalar() - conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+                return page * used
+    return None
+
+def database_file_bytes(engine: Engine) -> Optional[int]:
+    if engine.dialect.name == "sqlite" and engine.url.database not in (None, "", ":memory:"):
+        return os.path.getsize(engine.url.database)
+    return None
+
+def vacuum(engine: Engine):
+    """Give the freed pages back to the OS (SQLite) / mark them reusable + refresh stats (Postgres)."""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if engine.dialect.name == "postgresql":
+            conn.exec_driver_sql("VACUUM (ANALYZE) event_logs")
+        elif engine.dialect.name == "sqlite":
+            conn.exec_driver_sql("VACUUM")
+
+# --- reading ---
+
+def archive_files(root: str = EVENT_ARCHIVE_DIR) -> List[Tuple[int, int, Path]]:
+    """(first id, last id, path) for every archive file, ascending."""
+    out = []
+    for p in Path(root).glob("*/events-*.ndjson.gz"):
+        m = _NAME.search(p.name)
+        if m:
+            out.append((int(m.group(1)), int(m.group(2)), p))
+    return sorted(out)
+
+def _read(path: Path) -> Iterator[dict]:
+    with gzip.open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                yield json_loads(line)
+
+def read_archived(user_id: int, limit: int, before_id: Optional[int] = None, after_id: Optional[int] = None,
+                  type_: Optional[str] = None, root: str = EVENT_ARCHIVE_DIR) -> List[dict]:
+    """Same paging contract as the live feed (newest first; before_id / after_id cursors)."""
+    files = archive_files(root)
+    if after_id is not None:
+        files = [f for f in files if f[1] > after_id]
+    else:
+        files = [f for f in reversed(files) if before_id is None or f[0] < before_id]
+    newest_first = after_id is None
+    found: Dict[int, dict] = {}
+    for lo, hi, path in files:
+        if len(found) >= limit:
+            # stop once no remaining file can hold an id that would make the page
+            kth = sorted(found, reverse=newest_first)[limit - 1]
+            if (hi < kth) if newest_first else (lo > kth):
+                break
+        for doc in _read(path):
+            if doc["user_id"] != user_id or (type_ and doc["type"] != type_):
+                continue
+            if (before_id is not None and doc["id"] >= before_id) or (after_id is not None and doc["id"] <= after_id):
+                continue
+            found[doc["id"]] = doc  # keyed by id: a batch archived twice shows up once
+    ids = sorted(found, reverse=newest_first)[:limit]
+    if after_id is not None:
+        ids.reverse()
+    return [{"id": i, "type": found[i]["type"], "message": found[i]["message"],
+             "created_at": found[i]["created_at"]} for i in ids]
@@ -3,19 +3,18 @@ from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from sqlalchemy import text
 from sqlalchemy.orm import Session
-import os
-from ..db import SessionLocal
+from sqlalchemy.ext.asyncio import AsyncSession
+import os, time
+from ..db import get_db, get_async_db
+from .cache import TTLCache
+from .security import JWT_SECRET, JWT_ALG
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
-JWT_SECRET = os.getenv("JWT_SECRET", "dev-secret")
-JWT_ALGO = os.getenv("JWT_ALGO", "HS256")
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# token -> CurrentUser; entries never outlive the token's own `exp`
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "300"))
+identity_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
 
 def _cred_exc():
     return HTTPException(
@@ -25,28 +24,69 @@ def _cred_exc():
     )
 
 class CurrentUser:
-    def __init__(self, uid: int, email: str | None = None):
+    def __init__(self, uid: int, email: str | None = None, claims: dict | None = None):
         self.id = uid
         self.email = email
+        self.claims = claims or {}
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGO])
-    except JWTError:
-        raise _cred_exc()
+def _lookup_user(db: Session, payload: dict):
     sub = payload.get("sub")
     uid = payload.get("user_id")
     email = payload.get("email")
-    row = None
     if isinstance(uid, int):
-        row = db.execute(text("SELECT id, email FROM users WHERE id=:id"), {"id": uid}).mappings().first()
-    elif sub is not None:
+        return db.execute(text("SELECT id, email FROM users WHERE id=:id"), {"id": uid}).mappings().first()
+    if sub is not None:
         if isinstance(sub, int) or (isinstance(sub, str) and sub.isdigit()):
-            row = db.execute(text("SELECT id, email FROM users WHERE id=:id"), {"id": int(sub)}).mappings().first()
-        else:
-            row = db.execute(text("SELECT id, email FROM users WHERE email=:email"), {"email": sub}).mappings().first()
-    elif email:
-        row = db.execute(text("SELECT id, email FROM users WHERE email=:email"), {"email": email}).mappings().first()
-    if not row:
+            return db.execute(text("SELECT id, email FROM users WHERE id=:id"), {"id": int(sub)}).mappings().first()
+        return db.execute(text("SELECT id, email FROM users WHERE email=:email"), {"email": sub}).mappings().first()
+    if email:
+        return db.execute(text("SELECT id, email FROM users WHERE email=:email"), {"email": email}).mappings().first()
+    return None
+
+def _decode(token: str) -> dict | None:
+    try:
+        return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
+    except JWTError:
+        return None
+
+def _remember(token: str, payload: dict, row) -> CurrentUser:
+    ident = CurrentUser(uid=row["id"], email=row.get("email"), claims=payload)
+    exp = payload.get("exp")
+    identity_cache.set(token, ident, ttl=(exp - time.time()) if exp else None)
+    return ident
+
+def resolve_identity(token: str, db: Session) -> CurrentUser | None:
+    """
+    Verify a bearer token and resolve it to a user, memoized per token.
+    Returns None for bad/expired tokens or unknown users (callers raise their own 401).
+    """
+    ident = identity_cache.get(token)
+    if ident is not None:
+        return ident
+    payload = _decode(token)
+    if payload is None:
+        return None
+    row = _lookup_user(db, payload)
+    return _remember(token, payload, row) if row else None
+
+async def resolve_identity_async(token: str, db: AsyncSession) -> CurrentUser | None:
+    ident = identity_cache.get(token)
+    if ident is not None:
+        return ident
+    payload = _decode(token)
+    if payload is None:
+        return None
+    row = await db.run_sync(_lookup_user, payload)
+    return _remember(token, payload, row) if row else None
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    ident = resolve_identity(token, db)
+    if ident is None:
+        raise _cred_exc()
+    return ident
+
+async def get_current_user_async(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    ident = await resolve_identity_async(token, db)
+    if ident is None:
         raise _cred_exc()
-    return CurrentUser(uid=row["id"], email=row.get("email"))
+    return ident
@@ -0,0 +1,506 @@
+"""
+Cancellation engine.
+
+POST /cancellations/start (and denies via /approvals) queue a CancellationRequest row
+and return; this engine does the vendor work in the background:
+
+    pending      queued, or waiting out a retry until next_check_at
+    in_progress  claimed by a worker and sent to the vendor; the verifier rechecks it
+                 every so often (next_check_at) until the vendor confirms or refuses
+    succeeded    confirmed: the subscription becomes canceled (+ canceled_at)
+    failed       refused, out of attempts, or never confirmed within CANCEL_VERIFY_MAX_S
+                 (the subscription's cancel_status says failed / attention_needed)
+
+Adapters are pluggable: subclass Adapter and register it with @adapter("name",
+vendors=[...]). Vendors without a specific adapter go to CANCEL_ADAPTER if it's set
+(CANCEL_ADAPTER=fake is the in-process stand-in in api/dev/fake_vendor.py, for dev and
+load tests only). With no adapter for a vendor nothing is sent: the request stays
+pending, the subscription shows attention_needed, and it's looked at again every
+CANCEL_NO_ADAPTER_RETRY_S in case one has been configured since. Each vendor (the merchant,
+cleaned) gets its own concurrency cap and token bucket, shared by submits and checks,
+so one slow or strict vendor can't hold up the rest of the pool.
+
+Rows are claimed with conditional UPDATEs and leased through next_check_at, so several
+API processes can run engines on one database and a crash mid-call is retried.
+"""
+import asyncio, logging, os, re
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set
+from sqlalchemy import bindparam, func, insert, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..db import get_async_sessionmaker
+from ..models import CancellationRequest, CancelStatus
+from .log import add_events, event_row, log_event
+from .merchants import clean
+from .ratelimit import TokenBucket
+from .versions import bump_async
+
+CANCEL_ENGINE = os.getenv("CANCEL_ENGINE", "1") == "1"
+CANCEL_ADAPTER = os.getenv("CANCEL_ADAPTER", "")                            # default adapter; unset = none
+CANCEL_WORKERS = int(os.getenv("CANCEL_WORKERS", "16"))                     # vendor calls in flight, per process
+CANCEL_VENDOR_CONCURRENCY = int(os.getenv("CANCEL_VENDOR_CONCURRENCY", "4"))
+CANCEL_VENDOR_RATE = float(os.getenv("CANCEL_VENDOR_RATE", "5"))           # calls/sec per vendor
+CANCEL_SUBMIT_TIMEOUT = float(os.getenv("CANCEL_SUBMIT_TIMEOUT", "30"))
+CANCEL_MAX_ATTEMPTS = int(os.getenv("CANCEL_MAX_ATTEMPTS", "3"))
+CANCEL_RETRY_S = float(os.getenv("CANCEL_RETRY_S", "30"))                   # doubled per attempt
+CANCEL_VERIFY_DELAY_S = float(os.getenv("CANCEL_VERIFY_DELAY_S", "60"))     # first check; doubles up to an hour
+CANCEL_VERIFY_MAX_S = float(os.getenv("CANCEL_VERIFY_MAX_S", str(3 * 86400)))
+CANCEL_VERIFY_BATCH = int(os.getenv("CANCEL_VERIFY_BATCH", "200"))
+CANCEL_POLL_INTERVAL = float(os.getenv("CANCEL_POLL_INTERVAL", "1"))
+CANCEL_NO_ADAPTER_RETRY_S = float(os.getenv("CANCEL_NO_ADAPTER_RETRY_S", "3600"))
+NO_ADAPTER = "no cancellation adapter for this vendor"
+
+PENDING, IN_PROGRESS, SUCCEEDED, FAILED = (CancelStatus.pending, CancelStatus.in_progress,
+                                           CancelStatus.succeeded, CancelStatus.failed)
+OPEN = (PENDING, IN_PROGRESS)
+# verify() answers
+CONFIRMED, WAITING, REFUSED = "confirmed", "waiting", "refused"
+
+log = logging.getLogger("api.cancel")
+
+class AdapterError(Exception):
+    """Raised by adapters; retry=False means trying again won't help."""
+    def __init__(self, message: str, retry: bool = True):
+        super().__init__(message)
+        self.retry = retry
+
+class Adapter:
+    """
+    One way of canceling with a vendor (email, portal, API...). Requests are dicts with
+    id, subscription_id, user_id, vendor, vendor_ref, attempts, checks, started_at.
+    """
+    name = ""
+    concurrency = CANCEL_VENDOR_CONCURRENCY
+    rate = CANCEL_VENDOR_RATE
+
+    async def submit(self, req: dict) -> Optional[str]:
+        """Ask the vendor to cancel; returns the vendor's reference (if any)."""
+        raise NotImplementedError
+
+    async def verify(self, req: dict) -> str:
+        """CONFIRMED, WAITING or REFUSED."""
+        raise NotImplementedError
+
+    async def verify_many(self, reqs: List[dict], limits: "VendorLimits") -> List[str]:
+        """Override for vendors with a bulk status API; default checks one at a time."""
+        async def one(r):
+            async with limits:
+                return await self.verify(r)
+        return await asyncio.gather(*(one(r) for r in reqs), return_exceptions=True)
+
+_adapters: Dict[str, Adapter] = {}
+_routes: Dict[str, str] = {}  # vendor -> adapter name
+
+def adapter(name: str, vendors: Iterable[str] = ()):
+    """Class decorator: register an Adapter (optionally as the one for specific vendors)."""
+    def deco(cls):
+        inst = cls()
+        inst.name = name
+        _adapters[name] = inst
+        for v in vendors:
+            _routes[vendor_key(v)] = name
+        return cls
+    return deco
+
+_PLAN_SUFFIX = re.compile(r" \(\d+\)$")
+
+def vendor_key(merchant: str) -> str:
+    # "Apple Services (2)" is a second plan with the same vendor (recurrence.detect_groups)
+    return clean(_PLAN_SUFFIX.sub("", merchant or "")) or "unknown"
+
+def adapter_for(vendor: str) -> Optional[Adapter]:
+    """The vendor's adapter, else CANCEL_ADAPTER's; None when neither is set."""
+    name = _routes.get(vendor, CANCEL_ADAPTER)
+    if not name:
+        return None
+    if name not in _adapters and name == "fake":
+        from ..dev import fake_vendor  # noqa: F401 -- registers itself
+    try:
+        return _adapters[name]
+    except KeyError:
+        raise RuntimeError(f"no cancellation adapter registered as {name!r}")
+
+class VendorLimits:
+    """Concurrency cap + token bucket for one vendor; `async with limits:` around each call."""
+    def __init__(self, concurrency: int, rate: float):
+        self.concurrency = concurrency
+        self.sem = asyncio.Semaphore(concurrency)
+        self.bucket = TokenBucket(rate)
+        self.claimed = 0  # submits claimed and not finished yet (the dispatcher's view)
+
+    async def __aenter__(self):
+        await self.sem.acquire()
+        try:
+            await self.bucket.acquire()
+        except BaseException:
+            self.sem.release()
+            raise
+
+    async def __aexit__(self, *exc):
+        self.sem.release()
+
+def _req(r) -> dict:
+    return {"id": r.id, "subscription_id": r.subscription_id, "user_id": r.user_id, "vendor": r.vendor,
+            "vendor_ref": r.vendor_ref, "attempts": r.attempts or 0, "checks": r.checks or 0,
+            "started_at": r.started_at}
+
+_REQ_COLS = (CancellationRequest.id, CancellationRequest.subscription_id, CancellationRequest.user_id,
+             CancellationRequest.vendor, CancellationRequest.vendor_ref, CancellationRequest.attempts,
+             CancellationRequest.checks, CancellationRequest.started_at)
+
+async def enqueue(db: AsyncSession, user_id: int, subs: Dict[int, str], method: str = "auto") -> Dict[int, int]:
+    """
+    Queue a request per {subscription_id: merchant}, reusing any that's already open.
+    Returns {subscription_id: request id}. Caller commits, then pokes the engine.
+    """
+    if not subs:
+        return {}
+    CR = CancellationRequest
+    out = dict((await db.execute(
+        select(CR.subscription_id, CR.id).where(CR.subscription_id.in_(list(subs)), CR.status.in_(OPEN))
+    )).all())
+    new = [{"subscription_id": sid, "user_id": user_id, "vendor": vendor_key(m), "method": method,
+            "status": PENDING, "attempts": 0, "checks": 0, "started_at": datetime.utcnow()}
+           for sid, m in subs.items() if sid not in out]
+    if new:
+        out.update(dict((await db.execute(insert(CR).returning(CR.subscription_id, CR.id), new)).all()))
+    return out
+
+def _by_ids(sql: str):
+    return text(sql).bindparams(bindparam("ids", expanding=True))
+
+async def _bump_users(db: AsyncSession, user_ids: Set[int]):
+    for uid in user_ids:
+        await bump_async(db, uid)
+
+class CancelEngine:
+    """Dispatcher + verifier loops over cancellation_requests; start()/stop() with the app."""
+    def __init__(self, workers: int = CANCEL_WORKERS):
+        self.workers = workers
+        self._limits: Dict[str, VendorLimits] = {}
+        self._running: Set[asyncio.Task] = set()
+        self._loops: List[asyncio.Task] = []
+        self._wake: Optional[asyncio.Event] = None
+        self.counts = defaultdict(int)  # submitted / retried / succeeded / failed / checks / ...
+
+    def limits(self, vendor: str) -> VendorLimits:
+        lim = self._limits.get(vendor)
+        if lim is None:
+            a = adapter_for(vendor) or Adapter
+            lim = self._limits[vendor] = VendorLimits(a.concurrency, a.rate)
+        return lim
+
+    def _session(self):
+        return get_async_sessionmaker()()
+
+    async def start(self):
+        if self._loops:
+            return
+        if CANCEL_ADAPTER:
+            adapter_for("")  # fail at startup, not per request, if it isn't registered
+        self._wake = asyncio.Event()
+        self._loops = [asyncio.create_task(self._dispatch_loop(), name="cancel-dispatch"),
+                       asyncio.create_task(self._verify_loop(), name="cancel-verify")]
+
+    async def stop(self):
+        # in-flight submits are abandoned; their lease runs out and they're retried
+        tasks = self._loops + list(self._running)
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._loops, self._running = [], set()
+        for lim in self._limits.values():
+            lim.claimed = 0
+
+    def poke(self):
+        """New requests were committed; dispatch now rather than at the next poll."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _sleep(self, seconds: float):
+        try:
+            await asyncio.wait_for(self._wake.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
+
+    # --- submitting ---
+
+    async def _dispatch_loop(self):
+        while True:
+            try:
+                n = await self.dispatch_once()
+            except Exception:
+                log.exception("cancellation dispatch failed")
+                n = 0
+            if not n:
+                await self._sleep(CANCEL_POLL_INTERVAL)
+            elif len(self._running) >= self.workers:
+                await asyncio.wait(self._running, return_when=asyncio.FIRST_COMPLETED)
+
+    async def dispatch_once(self) -> int:
+        """Claim due pending requests the pool and their vendors have room for; start them."""
+        free = self.workers - len(self._running)
+        if free <= 0:
+            return 0
+        CR = CancellationRequest
+        now = datetime.utcnow()
+        full = [v for v, lim in self._limits.items() if lim.claimed >= lim.concurrency]
+        q = select(CR.id, CR.vendor, CR.error).where(CR.status == PENDING, CR.next_check_at.is_(None) | (CR.next_check_at <= now))
+        if full:
+            q = q.where(CR.vendor.not_in(full))
+        picked, unroutable, per_vendor = [], [], defaultdict(int)
+        async with self._session() as db:
+            for rid, vendor, error in (await db.execute(q.order_by(CR.id).limit(free * 4))).all():
+                if adapter_for(vendor) is None:
+                    unroutable.append((rid, error))
+                    continue
+                lim = self.limits(vendor)
+                if lim.claimed + per_vendor[vendor] < lim.concurrency:
+                    per_vendor[vendor] += 1
+                    picked.append(rid)
+                    if len(picked) == free:
+                        break
+            if unroutable:
+                await self._park(db, unroutable, now)
+            if not picked:
+                await db.commit()
+                return 0
+            # lease: if this process dies mid-call the verifier hands the row back after this
+            lease = now + timedelta(seconds=CANCEL_SUBMIT_TIMEOUT * 2 + 60)
+            claimed = (await db.execute(
+                update(CR).where(CR.id.in_(picked), CR.status == PENDING)
+                .values(status=IN_PROGRESS, attempts=CR.attempts + 1, next_check_at=lease, vendor_ref=None)
+                .returning(*_REQ_COLS)
+                .execution_options(synchronize_session=False)
+            )).all()
+            await db.commit()
+        for r in claimed:
+            req = _req(r)
+            self.limits(req["vendor"]).claimed += 1
+            t = asyncio.create_task(self._execute(req))
+            self._running.add(t)
+            t.add_done_callback(self._running.discard)
+        return len(claimed)
+
+    async def _park(self, db: AsyncSession, rows: List[tuple], now: datetime):
+        """No adapter: keep the requests pending (never sent, never succeeded) and flag them once."""
+        CR = CancellationRequest
+        await db.execute(update(CR).where(CR.id.in_([rid for rid, _ in rows]), CR.status == PENDING)
+                         .values(error=NO_ADAPTER, next_check_at=now + timedelta(seconds=CANCEL_NO_ADAPTER_RETRY_S))
+                         .execution_options(synchronize_session=False))
+        new = [rid for rid, error in rows if error != NO_ADAPTER]
+        if not new:
+            return
+        reqs = (await db.execute(select(CR.id, CR.subscription_id, CR.user_id).where(CR.id.in_(new)))).all()
+        await db.execute(_by_ids("UPDATE subscriptions SET cancel_status='attention_needed' WHERE id IN :ids"),
+                         {"ids": [r.subscription_id for r in reqs]})
+        await add_events(db, [event_row(r.user_id, "cancel.attention_needed", NO_ADAPTER,
+                                        {"subscription_id": r.subscription_id, "request_id": r.id})
+                              for r in reqs])
+        await _bump_users(db, {r.user_id for r in reqs})
+        self.counts["no_adapter"] += len(reqs)
+
+    async def _execute(self, req: dict):
+        vendor = req["vendor"]
+        lim = self.limits(vendor)
+        ref, error, retry = None, None, True
+        try:
+            async with lim:
+                ref = await asyncio.wait_for(adapter_for(vendor).submit(req), CANCEL_SUBMIT_TIMEOUT)
+        except AdapterError as e:
+            error, retry = str(e) or "adapter error", e.retry
+        except asyncio.TimeoutError:
+            error = "vendor timed out"
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.exception("cancellation adapter crashed (request %s)", req["id"])
+            error = f"adapter crashed: {e}"
+        finally:
+            lim.claimed -= 1
+        try:
+            await self._record_submit(req, ref, error, retry)
+        finally:
+            self._wake.set()  # a vendor slot opened up
+
+    async def _record_submit(self, req: dict, ref: Optional[str], error: Optional[str], retry: bool):
+        CR = CancellationRequest
+        now = datetime.utcnow()
+        sid, uid = req["subscription_id"], req["user_id"]
+        # still ours: in progress under this claim (a re-claim after the lease ran out bumps attempts)
+        cond = (CR.id == req["id"], CR.status == IN_PROGRESS, CR.attempts == req["attempts"])
+        async with self._session() as db:
+            # every write here is conditional on that; if the lease went elsewhere nothing is written
+            if error is None:
+                mine = (await db.execute(update(CR).where(*cond).values(
+                    vendor_ref=ref or f"req-{req['id']}", error=None,
+                    next_check_at=now + timedelta(seconds=CANCEL_VERIFY_DELAY_S)).returning(CR.id))).first()
+                if mine is None:
+                    return
+                log_event(db, uid, "cancel.queued", "Adapter sent; awaiting verification",
+                          {"subscription_id": sid, "request_id": req["id"]})
+                self.counts["submitted"] += 1
+            elif retry and req["attempts"] < CANCEL_MAX_ATTEMPTS:
+                backoff = CANCEL_RETRY_S * 2 ** (req["attempts"] - 1)
+                mine = (await db.execute(update(CR).where(*cond).values(
+                    status=PENDING, error=error, next_check_at=now + timedelta(seconds=backoff)).returning(CR.id))).first()
+                if mine is None:
+                    return
+                log_event(db, uid, "cancel.retry", f"{error}; retrying in {backoff:.0f}s",
+                          {"subscription_id": sid, "request_id": req["id"]})
+                self.counts["retried"] += 1
+            else:
+                if (await db.execute(select(CR.id).where(*cond).with_for_update())).first() is None:
+                    return
+                await self._fail(db, [req], error, "failed")
+            await db.commit()
+
+    # --- verifying ---
+
+    async def _verify_loop(self):
+        while True:
+            try:
+                n = await self.verify_once()
+            except Exception:
+                log.exception("cancellation verification pass failed")
+                n = 0
+            if n < CANCEL_VERIFY_BATCH:
+                await asyncio.sleep(CANCEL_POLL_INTERVAL)
+
+    async def verify_once(self) -> int:
+        """Recheck one batch of in-flight requests that are due; returns how many."""
+        CR = CancellationRequest
+        now = datetime.utcnow()
+        async with self._session() as db:
+            due = (await db.execute(
+                select(CR.id).where(CR.status == IN_PROGRESS, CR.next_check_at <= now)
+                .order_by(CR.next_check_at).limit(CANCEL_VERIFY_BATCH)
+            )).scalars().all()
+            if not due:
+                return 0
+            # lease the batch so another process's verifier leaves it alone
+            rows = (await db.execute(
+                update(CR).where(CR.id.in_(due), CR.status == IN_PROGRESS, CR.next_check_at <= now)
+                .values(next_check_at=now + timedelta(seconds=CANCEL_SUBMIT_TIMEOUT * 2 + 60))
+                .returning(*_REQ_COLS)
+                .execution_options(synchronize_session=False)
+            )).all()
+            await db.commit()
+        reqs = [_req(r) for r in rows]
+        # no vendor_ref: the submit never finished (process died mid-call) -- hand it back
+        orphans = [r for r in reqs if not r["vendor_ref"]]
+        sent = [r for r in reqs if r["vendor_ref"]]
+
+        by_vendor: Dict[str, List[dict]] = defaultdict(list)
+        for r in sent:
+            by_vendor[r["vendor"]].append(r)
+        answers: Dict[int, object] = {}
+        async def check(vendor: str, batch: List[dict]):
+            try:
+                a = adapter_for(vendor)
+                if a is None:  # sent by an adapter that's since been unconfigured: keep waiting
+                    raise AdapterError(NO_ADAPTER)
+                res = await a.verify_many(batch, self.limits(vendor))
+            except Exception as e:
+                res = [e] * len(batch)
+            answers.update(zip((r["id"] for r in batch), res))
+        await asyncio.gather(*(check(v, b) for v, b in by_vendor.items()))
+        self.counts["checks"] += len(sent)
+
+        done, refused, stuck, waiting = [], [], [], []
+        for r in sent:
+            a = answers.get(r["id"])
+            if a == CONFIRMED:
+                done.append(r)
+            elif a == REFUSED:
+                refused.append(r)
+            elif (now - r["started_at"]).total_seconds() > CANCEL_VERIFY_MAX_S:
+                stuck.append(r)
+            else:
+                if isinstance(a, BaseException):
+                    log.warning("cancellation check failed (request %s): %r", r["id"], a)
+                waiting.append(r)
+
+        async with self._session() as db:
+            if done:
+                await self._succeed(db, done, now)
+            if refused:
+                await self._fail(db, refused, "vendor refused the cancellation", "failed")
+            if stuck:
+                await self._fail(db, stuck, "vendor never confirmed the cancellation", "attention_needed")
+            by_checks: Dict[int, List[int]] = defaultdict(list)
+            for r in waiting:
+                by_checks[r["checks"]].append(r["id"])
+            for checks, ids in by_checks.items():  # back off: 2x, 4x, ... the first delay, up to an hour
+                delay = min(CANCEL_VERIFY_DELAY_S * 2 ** (checks + 1), 3600)
+                await db.execute(update(CR).where(CR.id.in_(ids), CR.status == IN_PROGRESS)
+                                 .values(checks=checks + 1, next_check_at=now + timedelta(seconds=delay))
+                                 .execution_options(synchronize_session=False))
+            retry = [r["id"] for r in orphans if r["attempts"] < CANCEL_MAX_ATTEMPTS]
+            if retry:
+                await db.execute(update(CR).where(CR.id.in_(retry), CR.status == IN_PROGRESS)
+                                 .values(status=PENDING, next_check_at=None)
+                                 .execution_options(synchronize_session=False))
+            lost = [r for r in orphans if r["attempts"] >= CANCEL_MAX_ATTEMPTS]
+            if lost:
+                await self._fail(db, lost, "vendor call never completed", "failed")
+            await db.commit()
+        if retry:
+            self.poke()
+        return len(reqs)
+
+    async def _succeed(self, db: AsyncSession, reqs: List[dict], now: datetime):
+        CR = CancellationRequest
+        ids = [r["id"] for r in reqs]
+        matched = set((await db.execute(update(CR).where(CR.id.in_(ids), CR.status == IN_PROGRESS)
+                                        .values(status=SUCCEEDED, completed_at=now, error=None, next_check_at=None)
+                                        .returning(CR.id)
+                                        .execution_options(synchronize_session=False))).scalars())
+        reqs = [r for r in reqs if r["id"] in matched]  # the rest were settled elsewhere meanwhile
+        if not reqs:
+            return
+        await db.execute(_by_ids(
+            "UPDATE subscriptions SET status='canceled', cancel_status='canceled', canceled_at=:now WHERE id IN :ids"
+        ), {"ids": [r["subscription_id"] for r in reqs], "now": now})
+        await add_events(db, [event_row(r["user_id"], "cancel.succeeded", "Vendor confirmed the cancellation",
+                                        {"subscription_id": r["subscription_id"], "request_id": r["id"]})
+                              for r in reqs])
+        await _bump_users(db, {r["user_id"] for r in reqs})
+        self.counts["succeeded"] += len(reqs)
+
+    async def _fail(self, db: AsyncSession, reqs: List[dict], error: str, cancel_status: str):
+        CR = CancellationRequest
+        matched = set((await db.execute(update(CR).where(CR.id.in_([r["id"] for r in reqs]), CR.status.in_(OPEN))
+                                        .values(status=FAILED, error=error, completed_at=datetime.utcnow(), next_check_at=None)
+                                        .returning(CR.id)
+                                        .execution_options(synchronize_session=False))).scalars())
+        reqs = [r for r in reqs if r["id"] in matched]
+        if not reqs:
+            return
+        await db.execute(_by_ids("UPDATE subscriptions SET cancel_status=:cs WHERE id IN :ids"),
+                         {"ids": [r["subscription_id"] for r in reqs], "cs": cancel_status})
+        await add_events(db, [event_row(r["user_id"], "cancel.failed", error,
+                                        {"subscription_id": r["subscription_id"], "request_id": r["id"]})
+                              for r in reqs])
+        await _bump_users(db, {r["user_id"] for r in reqs})
+        self.counts["failed"] += len(reqs)
+
+    async def stats(self) -> dict:
+        CR = CancellationRequest
+        async with self._session() as db:
+            rows = (await db.execute(
+                select(CR.status, func.count()).where(CR.status.in_(OPEN)).group_by(CR.status)
+            )).all()
+        return {
+            "running": bool(self._loops) and not any(t.done() for t in self._loops),
+            "in_flight": len(self._running),
+            "workers": self.workers,
+            "pending": 0, "in_progress": 0, **{s.value: n for s, n in rows},
+            **self.counts,
+            "vendors": {v: {"claimed": l.claimed, "concurrency": l.concurrency, "throttled_s": round(l.bucket.waited, 3)}
+                        for v, l in self._limits.items()},
+        }
+
+cancel_engine = CancelEngine()
@@ -0,0 +1,188 @@
+"""
+Idempotency-Key support for the write endpoints (approvals, batch approvals,
+cancellation starts).
+
+A request carrying an Idempotency-Key header runs once per (user, key). Its response
+(2xx, or a 4xx HTTPException) is kept for IDEMPOTENCY_TTL, and a retry with the same
+key and body gets that response back (with Idempotent-Replayed: true) without running
+the handler, so nothing is re-logged, re-committed or re-started.
+
+Two tiers: a per-process TTLCache answers most replays from memory; the
+idempotency_keys table makes keys hold across processes and restarts. A key is claimed
+by inserting its row before the handler runs:
+  - a duplicate arriving while the first is still running in this process waits for it
+    and gets the same result;
+  - one arriving in another process polls the row for up to IDEMPOTENCY_WAIT_S (then 409);
+  - a claim whose owner died (locked_until passed with no response) is taken over.
+5xx / unexpected errors release the key so the client can retry. Reusing a key with a
+different body is a 422.
+"""
+import asyncio, hashlib, os
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from ..db import get_async_sessionmaker, json_dumps, json_loads
+from ..models import IdempotencyKey
+from .cache import TTLCache
+
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+IDEMPOTENCY_LOCK_S = float(os.getenv("IDEMPOTENCY_LOCK_S", "60"))   # how long a claim outlives a dead owner
+IDEMPOTENCY_WAIT_S = float(os.getenv("IDEMPOTENCY_WAIT_S", "10"))   # wait on another process's claim
+MAX_KEY_LEN = 255
+
+Stored = Tuple[str, int, Any]  # (fingerprint, status code, body)
+
+_cache = TTLCache(maxsize=IDEMPOTENCY_CACHE_SIZE, ttl=IDEMPOTENCY_TTL)
+_inflight: Dict[Tuple[int, str], asyncio.Future] = {}
+_purged_at = 0.0
+
+def idempotency_stats() -> dict:
+    return {**_cache.stats(), "inflight": len(_inflight)}
+
+def fingerprint(route: str, payload: Any) -> str:
+    return hashlib.sha256(f"{route}\n{json_dumps(jsonable_encoder(payload))}".encode()).hexdigest()
+
+def _replay(stored: Stored, fp: str) -> JSONResponse:
+    if stored[0] != fp:
+        raise HTTPException(422, "Idempotency-Key was already used with a different request")
+    return JSONResponse(stored[2], status_code=stored[1], headers={"Idempotent-Replayed": "true"})
+
+async def idempotent(key: Optional[str], user_id: int, route: str, payload: Any,
+                     run: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Run `run()` once per (user, key); replays get its stored response.
+    Usage: return await idempotent(idempotency_key, user.id, "POST /approvals", payload, lambda: _decide(...))
+    """
+    if not key:
+        return await run()
+    if len(key) > MAX_KEY_LEN:
+        raise HTTPException(400, f"Idempotency-Key must be at most {MAX_KEY_LEN} characters")
+    k = (user_id, key)
+    fp = fingerprint(route, payload)
+
+    stored = _cache.get(k)
+    if stored is not None:
+        return _replay(stored, fp)
+    fut = _inflight.get(k)
+    if fut is not None:
+        # same key already running in this process: coalesce onto it
+        try:
+            return _replay(await asyncio.shield(fut), fp)
+        except asyncio.CancelledError:
+            if fut.cancelled():  # the first request was dropped, not this one
+                raise _busy()
+            raise
+
+    fut = asyncio.get_running_loop().create_future()
+    _inflight[k] = fut
+    ran = False
+    try:
+        stored = await _claim(user_id, key, route, fp)
+        if stored is None:
+            ran = True
+            stored = await _execute(user_id, key, fp, run)
+        _cache.set(k, stored)
+        fut.set_result(stored)
+    except asyncio.CancelledError:
+        fut.cancel()
+        raise
+    except BaseException as e:
+        fut.set_exception(e)
+        fut.exception()  # mark retrieved; waiters re-raise it
+        raise
+    finally:
+        _inflight.pop(k, None)
+    if not ran:
+        return _replay(stored, fp)
+    if stored[1] != 200:
+        raise HTTPException(stored[1], stored[2]["detail"])  # first caller sees the error as usual
+    return stored[2]
+
+def _busy() -> HTTPException:
+    return HTTPException(409, "A request with this Idempotency-Key is still in progress", headers={"Retry-After": "1"})
+
+async def _execute(user_id: int, key: str, fp: str, run: Callable[[], Awaitable[Any]]) -> Stored:
+    """Run the handler as the key's owner and store what it answered (2xx or 4xx)."""
+    try:
+        body, status = jsonable_encoder(await run()), 200
+    except HTTPException as e:
+        if e.status_code >= 500:
+            await _release(user_id, key)
+            raise
+        body, status = {"detail": e.detail}, e.status_code
+    except BaseException:
+        await _release(user_id, key)
+        raise
+    await _store(user_id, key, status, body)
+    return (fp, status, body)
+
+async def _claim(user_id: int, key: str, route: str, fp: str) -> Optional[Stored]:
+    """
+    Insert the claim row. None when this request owns the key now; otherwise the stored
+    response to replay (after waiting for another process's in-flight run if needed).
+    """
+    IK = IdempotencyKey
+    deadline = asyncio.get_running_loop().time() + IDEMPOTENCY_WAIT_S
+    while True:
+        now = datetime.utcnow()
+        async with get_async_sessionmaker()() as db:
+            db.add(IK(user_id=user_id, key=key, route=route, fingerprint=fp, created_at=now,
+                      locked_until=now + timedelta(seconds=IDEMPOTENCY_LOCK_S),
+                      expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL)))
+            try:
+                await db.commit()
+                await _maybe_purge()
+                return None
+            except IntegrityError:
+                await db.rollback()
+            row = (await db.execute(select(IK).where(IK.user_id == user_id, IK.key == key))).scalars().first()
+            if row is None:
+                continue  # purged between the insert and the select
+            if row.expires_at <= now or (row.status_code is None and row.locked_until <= now):
+                # expired, or its owner died mid-request: take it over
+                taken = await db.execute(
+                    update(IK).where(IK.id == row.id, IK.locked_until == row.locked_until)
+                    .values(route=route, fingerprint=fp, status_code=None, response=None, created_at=now,
+                            locked_until=now + timedelta(seconds=IDEMPOTENCY_LOCK_S),
+                            expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL))
+                )
+                await db.commit()
+                if taken.rowcount == 1:
+                    return None
+                continue
+            if row.fingerprint != fp:
+                raise HTTPException(422, "Idempotency-Key was already used with a different request")
+            if row.status_code is not None:
+                return (row.fingerprint, row.status_code, json_loads(row.response))
+        if asyncio.get_running_loop().time() >= deadline:
+            raise _busy()
+        await asyncio.sleep(0.1)
+
+async def _store(user_id: int, key: str, status: int, body: Any):
+    IK = IdempotencyKey
+    async with get_async_sessionmaker()() as db:
+        await db.execute(update(IK).where(IK.user_id == user_id, IK.key == key)
+                         .values(status_code=status, response=json_dumps(body)))
+        await db.commit()
+
+async def _release(user_id: int, key: str):
+    IK = IdempotencyKey
+    async with get_async_sessionmaker()() as db:
+        await db.execute(delete(IK).where(IK.user_id == user_id, IK.key == key, IK.status_code.is_(None)))
+        await db.commit()
+
+async def _maybe_purge():
+    """Drop expired keys, at most every few minutes per process."""
+    global _purged_at
+    loop_now = asyncio.get_running_loop().time()
+    if loop_now - _purged_at < 300:
+        return
+    _purged_at = loop_now
+    async with get_async_sessionmaker()() as db:
+        await db.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at < datetime.utcnow()))
+        await db.commit()
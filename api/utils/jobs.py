@@ -0,0 +1,301 @@
+"""
+Background jobs.
+
+Slow work (Plaid scans) runs on a few asyncio workers instead of inside the request:
+routes submit a job, answer 202 with its id, and clients poll GET /jobs/{id}.
+
+JOB_BACKEND=memory (default) keeps jobs in the process. JOB_BACKEND=db keeps them in the
+jobs table, so queued jobs survive a restart and several API processes can share one
+queue (workers claim jobs with a conditional UPDATE).
+
+An identical job (same kind, user and params) that is already queued or running is
+returned instead of queuing another one.
+"""
+import asyncio, json, logging, os, time, uuid
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from ..db import get_async_sessionmaker
+from ..models import Job
+from .cache import TTLCache
+from .metrics import record_job, traced
+
+JOB_BACKEND = os.getenv("JOB_BACKEND", "memory")            # memory | db
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))              # max jobs running at once (per process)
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", "1000"))   # queued jobs before submit answers 503
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "300"))
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "3600"))   # how long finished jobs can be polled
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+log = logging.getLogger("api.jobs")
+
+Handler = Callable[[int, dict], Awaitable[Any]]
+_handlers: Dict[str, Handler] = {}
+
+def handler(kind: str):
+    """Register `async fn(user_id, params)` as the runner for `kind`; its return value is the job result."""
+    def deco(fn: Handler) -> Handler:
+        _handlers[kind] = fn
+        return fn
+    return deco
+
+def _busy() -> HTTPException:
+    return HTTPException(503, "Job queue full, try again", headers={"Retry-After": "5"})
+
+def _new(kind: str, user_id: int, params: dict, key: str) -> dict:
+    return {
+        "id": uuid.uuid4().hex, "kind": kind, "user_id": user_id, "params": params,
+        "dedup_key": key, "status": QUEUED, "result": None, "error": None,
+        "created_at": datetime.utcnow(), "started_at": None, "finished_at": None,
+    }
+
+class MemoryStore:
+    """In-process queue; finished jobs stay pollable for JOB_RESULT_TTL."""
+    def __init__(self, limit: int = JOB_QUEUE_LIMIT):
+        self.limit = limit
+        self.active: Dict[str, dict] = {}
+        self.finished = TTLCache(maxsize=10000, ttl=JOB_RESULT_TTL)
+        self.by_key: Dict[str, str] = {}
+        self.queue: Deque[str] = deque()
+
+    async def submit(self, kind: str, user_id: int, params: dict, key: str) -> Tuple[dict, bool]:
+        jid = self.by_key.get(key)
+        if jid in self.active:
+            return self.active[jid], False
+        if len(self.queue) >= self.limit:
+            raise _busy()
+        job = _new(kind, user_id, params, key)
+        self.active[job["id"]] = job
+        self.by_key[key] = job["id"]
+        self.queue.append(job["id"])
+        return job, True
+
+    async def claim(self) -> Optional[dict]:
+        while self.queue:
+            job = self.active.get(self.queue.popleft())
+            if job is not None:
+                job.update(status=RUNNING, started_at=datetime.utcnow())
+                return job
+        return None
+
+    async def finish(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None):
+        job = self.active.pop(job_id, None)
+        if job is None:
+            return
+        job.update(status=status, result=result, error=error, finished_at=datetime.utcnow())
+        if self.by_key.get(job["dedup_key"]) == job_id:
+            del self.by_key[job["dedup_key"]]
+        self.finished.set(job_id, job)
+
+    async def release(self, job_id: str):
+        job = self.active.get(job_id)
+        if job is not None:
+            job.update(status=QUEUED, started_at=None)
+            self.queue.appendleft(job_id)
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return self.active.get(job_id) or self.finished.get(job_id)
+
+    async def counts(self) -> dict:
+        return {QUEUED: len(self.queue), RUNNING: len(self.active) - len(self.queue)}
+
+    async def recover(self):
+        pass
+
+    async def prune(self):
+        pass
+
+def _row(j: Job) -> dict:
+    return {
+        "id": j.id, "kind": j.kind, "user_id": j.user_id, "params": json.loads(j.params or "{}"),
+        "dedup_key": j.dedup_key, "status": j.status,
+        "result": json.loads(j.result) if j.result is not None else None, "error": j.error,
+        "created_at": j.created_at, "started_at": j.started_at, "finished_at": j.finished_at,
+    }
+
+class DBStore:
+    """Jobs in the jobs table (SQLite or Postgres), shared by every process on the database."""
+    def __init__(self, limit: int = JOB_QUEUE_LIMIT):
+        self.limit = limit
+
+    def _session(self):
+        return get_async_sessionmaker()()
+
+    async def _active(self, db, key: str) -> Optional[Job]:
+        return (await db.execute(
+            select(Job).where(Job.dedup_key == key, Job.status.in_((QUEUED, RUNNING))).limit(1)
+        )).scalars().first()
+
+    async def submit(self, kind: str, user_id: int, params: dict, key: str) -> Tuple[dict, bool]:
+        async with self._session() as db:
+            dup = await self._active(db, key)
+            if dup is not None:
+                return _row(dup), False
+            if await db.scalar(select(func.count()).select_from(Job).where(Job.status == QUEUED)) >= self.limit:
+                raise _busy()
+            job = _new(kind, user_id, params, key)
+            db.add(Job(**{**job, "params": json.dumps(params)}))
+            try:
+                await db.commit()
+            except IntegrityError:
+                # a concurrent submit won the race (uq_jobs_active_dedup); hand back its job
+                await db.rollback()
+                dup = await self._active(db, key)
+                if dup is None:
+                    raise
+                return _row(dup), False
+            return job, True
+
+    async def claim(self) -> Optional[dict]:
+        async with self._session() as db:
+            ids = (await db.execute(
+                select(Job.id).where(Job.status == QUEUED).order_by(Job.created_at).limit(8)
+            )).scalars().all()
+            for jid in ids:
+                # another worker (or process) may have taken it since the select
+                res = await db.execute(
+                    update(Job).where(Job.id == jid, Job.status == QUEUED)
+                    .values(status=RUNNING, started_at=datetime.utcnow())
+                )
+                await db.commit()
+                if res.rowcount == 1:
+                    return _row(await db.get(Job, jid))
+        return None
+
+    async def finish(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None):
+        async with self._session() as db:
+            await db.execute(update(Job).where(Job.id == job_id).values(
+                status=status, result=json.dumps(result) if result is not None else None,
+                error=error, finished_at=datetime.utcnow(),
+            ))
+            await db.commit()
+
+    async def release(self, job_id: str):
+        async with self._session() as db:
+            await db.execute(update(Job).where(Job.id == job_id, Job.status == RUNNING).values(status=QUEUED, started_at=None))
+            await db.commit()
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        async with self._session() as db:
+            j = await db.get(Job, job_id)
+            return _row(j) if j is not None else None
+
+    async def counts(self) -> dict:
+        async with self._session() as db:
+            rows = (await db.execute(
+                select(Job.status, func.count()).where(Job.status.in_((QUEUED, RUNNING))).group_by(Job.status)
+            )).all()
+        return {QUEUED: 0, RUNNING: 0, **{s: n for s, n in rows}}
+
+    async def recover(self):
+        # jobs left "running" by a process that died mid-job
+        stale = datetime.utcnow() - timedelta(seconds=JOB_TIMEOUT * 2)
+        async with self._session() as db:
+            await db.execute(update(Job).where(Job.status == RUNNING, Job.started_at < stale).values(status=QUEUED, started_at=None))
+            await db.commit()
+
+    async def prune(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=JOB_RESULT_TTL)
+        async with self._session() as db:
+            await db.execute(delete(Job).where(Job.status.in_((DONE, FAILED)), Job.finished_at < cutoff))
+            await db.commit()
+
+class JobQueue:
+    """JOB_WORKERS asyncio workers pulling from a store; start()/stop() from the app lifecycle."""
+    def __init__(self, store, workers: int = JOB_WORKERS):
+        self.store = store
+        self.workers = workers
+        self._tasks: List[asyncio.Task] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._pruned_at = 0.0
+
+    async def submit(self, kind: str, user_id: int, params: Optional[dict] = None) -> dict:
+        if kind not in _handlers:
+            raise ValueError(f"unknown job kind: {kind}")
+        params = params or {}
+        key = f"{kind}:{user_id}:{json.dumps(params, sort_keys=True)}"
+        job, new = await self.store.submit(kind, user_id, params, key)
+        if new and self._wake is not None:
+            self._wake.set()
+        return job
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await self.store.get(job_id)
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._wake = asyncio.Event()
+        await self.store.recover()
+        self._tasks = [asyncio.create_task(self._worker(), name=f"job-worker-{i}") for i in range(self.workers)]
+
+    async def stop(self):
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        while True:
+            self._wake.clear()
+            try:
+                job = await self.store.claim()
+            except Exception:
+                log.exception("job claim failed")
+                job = None
+            if job is None:
+                await self._maybe_prune()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _run(self, job: dict):
+        t0 = time.perf_counter()
+        with traced() as tr:
+            status = await self._execute(job)
+        record_job(job["kind"], status, time.perf_counter() - t0, tr)
+
+    async def _execute(self, job: dict) -> str:
+        fn = _handlers.get(job["kind"])
+        try:
+            if fn is None:
+                raise RuntimeError(f"no handler for job kind {job['kind']}")
+            result = await asyncio.wait_for(fn(job["user_id"], job["params"]), JOB_TIMEOUT)
+        except asyncio.CancelledError:
+            await self.store.release(job["id"])  # shutting down; requeue for the next start
+            raise
+        except asyncio.TimeoutError:
+            await self.store.finish(job["id"], FAILED, error=f"timed out after {JOB_TIMEOUT:g}s")
+        except HTTPException as e:
+            await self.store.finish(job["id"], FAILED, error=str(e.detail))
+        except Exception as e:
+            log.exception("job %s (%s) failed", job["id"], job["kind"])
+            await self.store.finish(job["id"], FAILED, error=f"{type(e).__name__}: {e}")
+        else:
+            await self.store.finish(job["id"], DONE, result=jsonable_encoder(result))
+            return DONE
+        return FAILED
+
+    async def _maybe_prune(self):
+        now = time.monotonic()
+        if now - self._pruned_at < 60:
+            return
+        self._pruned_at = now
+        try:
+            await self.store.prune()
+        except Exception:
+            log.exception("job prune failed")
+
+    async def stats(self) -> dict:
+        return {"backend": JOB_BACKEND, "workers": self.workers, **(await self.store.counts())}
+
+job_queue = JobQueue(DBStore() if JOB_BACKEND == "db" else MemoryStore())
@@ -1,12 +1,237 @@
-import json
-from typing import Optional, Dict, Any
+"""
+Event log writes.
+
+Events go to a process-wide EventSink by default: log_event() drops the row on an
+in-memory queue and returns, and a background thread writes batches with one
+executemany INSERT when EVENT_FLUSH_SIZE rows are waiting or EVENT_FLUSH_MS has passed.
+So the event is usually visible in /events a moment after the request returns.
+
+Notifications (approval.*, cancel.queued/retry, renewal reminders) take that path.
+add_events() / transactional=True instead write in the caller's transaction, so the
+event commits (or rolls back) with the business write -- for the cancellation state
+changes a client must not miss. If the queue is full (EVENT_QUEUE_SIZE) events fall
+back to the caller's session rather than being dropped or blocking.
+
+Ordering: readers are per user (/events keyset pages, SSE Last-Event-ID resume), so a
+user's ids must follow commit order: once a client has seen id N, none of that user's
+events with a lower id may still become visible. Every event insert (sink batch,
+add_events, a flushed EventLog) first takes _lock_event_order() for the users it
+writes: on Postgres a transaction-level advisory lock keyed by user id, held until
+commit. Only writers for the same user wait on each other -- and those already queue on
+the users row when they bump data_version. SQLite's single writer lock covers it.
+created_at is stamped under the lock, so it follows a user's id order too.
+"""
+import atexit, logging, os, queue, threading, time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+from sqlalchemy import event, insert, text
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from ..models import EventLog
+from .pubsub import broker
+
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "10000"))
+EVENT_FLUSH_SIZE = int(os.getenv("EVENT_FLUSH_SIZE", "500"))
+EVENT_FLUSH_MS = float(os.getenv("EVENT_FLUSH_MS", "200"))
+EVENT_ORDER_LOCK = 0x65766e74  # pg_advisory_xact_lock(key, user_id) namespace for event writers
+
+log = logging.getLogger("api.events")
+
+_STOP = object()
+
+def _public(id_: int, r) -> dict:
+    """What /events and /events/stream show for a row (dict or EventLog)."""
+    get = r.get if isinstance(r, dict) else lambda k: getattr(r, k)
+    created = get("created_at")
+    return {"id": id_, "type": get("type"), "message": get("message"),
+            "created_at": created.isoformat() if created else None}
+
+def _lock_event_order(conn, user_ids: Iterable[int]) -> datetime:
+    """Call inside the transaction, right before inserting the users' events; returns their created_at."""
+    ids = sorted({u for u in user_ids if u is not None})
+    if ids and conn.dialect.name == "postgresql":
+        # one statement, locks taken in id order so two multi-user writers can't deadlock
+        conn.execute(text(
+            "SELECT count(pg_advisory_xact_lock(:k, u)) FROM (SELECT unnest(:ids) AS u ORDER BY u) s"
+        ), {"k": EVENT_ORDER_LOCK, "ids": ids})
+    return datetime.utcnow()
+
+class EventSink:
+    """Bounded queue + one writer thread doing bulk INSERTs into event_logs."""
+    def __init__(self, engine=None, maxsize: int = EVENT_QUEUE_SIZE,
+                 batch_size: int = EVENT_FLUSH_SIZE, interval_ms: float = EVENT_FLUSH_MS):
+        self._engine = engine
+        self.batch_size = batch_size
+        self.interval = interval_ms / 1000
+        self._q: "queue.Queue" = queue.Queue(maxsize)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.batches = 0
+        self.fallbacks = 0  # events routed into the caller's session because the queue was full
+        self.dropped = 0    # batches that failed to write after retries
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            from ..db import engine
+            self._engine = engine
+        return self._engine
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="event-sink", daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def emit(self, row: Dict[str, Any]) -> bool:
+        """Queue a row; False when the queue is full (caller should write it itself)."""
+        if self._thread is None:
+            self.start()
+        try:
+            self._q.put_nowait(row)
+            return True
+        except queue.Full:
+            self.fallbacks += 1
+            return False
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Block until everything queued so far is written."""
+        done = threading.Event()
+        if self._thread is None:
+            return True
+        self._q.put(done, timeout=timeout)
+        return done.wait(timeout)
+
+    def stop(self, timeout: float = 5.0):
+        """Write what's queued and stop the thread (app shutdown / atexit)."""
+        t = self._thread
+        if t is None or not t.is_alive():
+            return
+        try:
+            self._q.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        t.join(timeout)
 
-def log_event(db: Session, user_id: int, type_: str, message: str, payload: Optional[Dict[str, Any]] = None):
+    def _run(self):
+        batch: List[dict] = []
+        deadline = None
+        while True:
+            try:
+                item = self._q.get(timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+            if isinstance(item, dict):
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.interval
+                if len(batch) < self.batch_size:
+                    continue
+            # size or time threshold, a flush marker, or stop
+            if batch:
+                self._write(batch)
+                batch, deadline = [], None
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is _STOP:
+                return
+
+    def _write(self, rows: List[dict]):
+        for attempt in range(3):
+            try:
+                with self.engine.begin() as conn:
+                    now = _lock_event_order(conn, (r["user_id"] for r in rows))
+                    for r in rows:
+                        r["created_at"] = now
+                    ids = conn.execute(
+                        insert(EventLog).returning(EventLog.id, sort_by_parameter_order=True), rows
+                    ).scalars().all()
+                self.written += len(rows)
+                self.batches += 1
+                for i, r in zip(ids, rows):
+                    broker.publish(r["user_id"], _public(i, r))
+                return
+            except Exception:
+                log.exception("event batch write failed (attempt %d, %d rows)", attempt + 1, len(rows))
+                time.sleep(0.2 * (attempt + 1))
+        self.dropped += len(rows)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._q.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "fallbacks": self.fallbacks,
+            "dropped": self.dropped,
+        }
+
+event_sink = EventSink()
+
+def log_event(db, user_id: int, type_: str, message: str, payload: Optional[Dict[str, Any]] = None,
+              transactional: bool = False):
     """
     Lightweight event logger.
     Usage: log_event(db, user_id, "approval.decide", "DENY Netflix", {"subscription_id": 123})
+    `db` is a Session or AsyncSession; it's only written to when transactional=True or the
+    sink is backed up, and then the calling router commits as usual.
     """
-    ev = EventLog(user_id=user_id, type=type_, message=message, payload=json.dumps(payload or {}))
-    db.add(ev)  # commit happens in the calling router
+    row = event_row(user_id, type_, message, payload)
+    if transactional or not event_sink.emit(row):
+        db.add(EventLog(**row))
+
+def log_events(db, rows: List[dict]):
+    """log_event() for many rows from event_row(): onto the sink, the caller's session if it's full."""
+    for r in rows:
+        if not event_sink.emit(r):
+            db.add(EventLog(**r))
+
+def event_row(user_id: int, type_: str, message: str, payload: Optional[Dict[str, Any]] = None) -> dict:
+    payload = payload or {}
+    sid = payload.get("subscription_id")
+    return {"user_id": user_id, "type": type_, "message": message, "payload": payload,
+            "subscription_id": int(sid) if isinstance(sid, int) or (isinstance(sid, str) and sid.isdigit()) else None,
+            "created_at": datetime.utcnow()}
+
+async def add_events(db: AsyncSession, rows: List[dict]):
+    """
+    Many transactional events in one INSERT (rows from event_row()). Like
+    log_event(transactional=True) they commit with the caller and go live after it.
+    """
+    if not rows:
+        return
+    now = await (await db.connection()).run_sync(_lock_event_order, [r["user_id"] for r in rows])
+    for r in rows:
+        r["created_at"] = now
+    ids = (await db.execute(
+        insert(EventLog).returning(EventLog.id, sort_by_parameter_order=True), rows
+    )).scalars().all()
+    db.sync_session.info.setdefault("pending_events", []).extend(
+        _public(i, r) | {"user_id": r["user_id"]} for i, r in zip(ids, rows)
+    )
+
+@event.listens_for(Session, "before_flush")
+def _order_events(session, _ctx, _instances):
+    evs = [o for o in session.new if isinstance(o, EventLog)]
+    if evs:
+        now = _lock_event_order(session.connection(), (o.user_id for o in evs))
+        for o in evs:
+            o.created_at = now
+
+# transactional events go live once their transaction commits (AsyncSession runs on a
+# sync Session underneath, so these cover both)
+@event.listens_for(Session, "after_flush")
+def _collect_events(session, _ctx):
+    evs = [_public(o.id, o) | {"user_id": o.user_id} for o in session.new if isinstance(o, EventLog)]
+    if evs:
+        session.info.setdefault("pending_events", []).extend(evs)
+
+@event.listens_for(Session, "after_commit")
+def _publish_events(session):
+    for ev in session.info.pop("pending_events", ()):
+        broker.publish(ev.pop("user_id"), ev)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_events(session):
+    session.info.pop("pending_events", None)
@@ -0,0 +1,137 @@
+"""
+Merchant canonicalization.
+
+Raw bank descriptors ("NETFLIX.COM", "Spotify USA", "APPLE.COM/BILL") are mapped to
+a canonical merchant name using an alias dictionary (api/data/merchants.json, or
+MERCHANTS_FILE). Aliases are compiled once into a token trie, so lookup cost depends
+on the descriptor length, not on how many aliases there are. Results are memoized in
+a process-wide LRU since the same descriptors repeat across users and scans.
+
+Generic words make bad aliases ("Disney Store", "Calm Coffee Shop", "Costco Whse #0123"
+are not subscriptions), so:
+- an alias written "^calm$" only matches at the start / end of the descriptor (trailing
+  store and reference numbers don't count); single-token aliases of 3 characters or
+  fewer are always start-anchored
+- phrases under "!not" block a match where they appear ("costco whse")
+- concatenated descriptors ("YOUTUBEPREMIUM") match an unanchored one-token alias of 5+
+  characters followed only by billing words (premium, plus, usa, ...)
+"""
+import functools, json, os, re, threading
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+MERCHANTS_FILE = os.getenv("MERCHANTS_FILE") or str(Path(__file__).resolve().parent.parent / "data" / "merchants.json")
+MERCHANT_CACHE_SIZE = int(os.getenv("MERCHANT_CACHE_SIZE", "65536"))
+
+# same junk the old sequential str.replace chain stripped, in one pass
+_JUNK = re.compile(r" inc| llc|\.com| subscription| member|[*\-_]")
+_TOKEN = re.compile(r"[a-z0-9]+")
+_END = ""  # trie key marking "an alias ends here"
+NOT = "!not"  # merchants.json key listing phrases that must not match
+SHORT_ALIAS = 3  # one-token aliases this short only match at the start
+CONCAT_MIN = 5   # shortest alias matched inside a concatenated token
+# what billers glue onto a brand: YOUTUBEPREMIUM, SPOTIFYUSA, NETFLIXCOMBILL
+_BILLING = ("premium|plus|music|tv|com|net|usa|us|app|bill|billing|subscr|subscription|sub|"
+            "member|membership|annual|yearly|monthly|family|digital|online|pro|svc|service|payment|pmt")
+
+def clean(s: str) -> str:
+    s = _JUNK.sub(" ", (s or "").lower().replace("+", " plus "))
+    return " ".join(s.split())
+
+class MerchantMatcher:
+    """Token trie over aliases; finds the leftmost, longest alias in a descriptor."""
+    def __init__(self, aliases: Dict[str, str], negatives: Iterable[str] = ()):
+        self.root: dict = {}
+        self.size = 0
+        concat: Dict[str, str] = {}
+        for alias, canonical in [*aliases.items(), *((n, None) for n in negatives)]:
+            start, end = alias.startswith("^"), alias.endswith("$")
+            toks = _TOKEN.findall(clean(alias.strip("^$")))
+            if not toks:
+                continue
+            if len(toks) == 1 and len(toks[0]) <= SHORT_ALIAS:
+                start = True
+            node = self.root
+            for t in toks:
+                node = node.setdefault(t, {})
+            node[_END] = (canonical, start, end)  # canonical None: a negative
+            if canonical is not None:
+                self.size += 1
+                if len(toks) == 1 and len(toks[0]) >= CONCAT_MIN and not (start or end):
+                    concat[toks[0]] = canonical
+        self.concat = concat
+        alts = "|".join(sorted(map(re.escape, concat), key=len, reverse=True))
+        self._concat = re.compile(rf"({alts})(?:{_BILLING})+") if concat else None
+
+    @classmethod
+    def from_file(cls, path: str) -> "MerchantMatcher":
+        # file format: {"Canonical Name": ["alias one", "^anchored$", ...], ..., "!not": ["phrase", ...]}
+        with open(path) as f:
+            data = json.load(f)
+        negatives = data.pop(NOT, [])
+        return cls({alias: canonical for canonical, aliases in data.items() for alias in aliases}, negatives)
+
+    def match(self, cleaned: str) -> Optional[str]:
+        toks = _TOKEN.findall(cleaned)
+        last = len(toks)
+        while last and toks[last - 1].isdigit():
+            last -= 1  # store / reference numbers don't count against a $ anchor
+        i = 0
+        while i < len(toks):
+            node, found, width = self.root, None, 0
+            for j in range(i, len(toks)):
+                node = node.get(toks[j])
+                if node is None:
+                    break
+                hit = node.get(_END)
+                if hit is not None and (i == 0 or not hit[1]) and (j + 1 >= last or not hit[2]):
+                    found, width = hit, j + 1 - i
+            if found is None:
+                i += 1
+            elif found[0] is None:
+                i += width  # a negative phrase: nothing inside it counts
+            else:
+                return found[0]
+        if self._concat is not None:
+            for t in toks:
+                m = self._concat.fullmatch(t)
+                if m:
+                    return self.concat[m[1]]
+        return None
+
+_matcher: Optional[MerchantMatcher] = None
+_lock = threading.Lock()
+
+def get_matcher() -> MerchantMatcher:
+    global _matcher
+    if _matcher is None:
+        with _lock:
+            if _matcher is None:
+                _matcher = MerchantMatcher.from_file(MERCHANTS_FILE)
+    return _matcher
+
+def load_merchants(path: str) -> MerchantMatcher:
+    """Swap in a different alias file (and drop memoized results made with the old one)."""
+    global _matcher
+    m = MerchantMatcher.from_file(path)
+    with _lock:
+        _matcher = m
+    normalize_name.cache_clear()
+    return m
+
+@functools.lru_cache(maxsize=MERCHANT_CACHE_SIZE)
+def normalize_name(s: str) -> str:
+    s = clean(s)
+    return get_matcher().match(s) or s.title()
+
+def merchant_cache_stats() -> dict:
+    info = normalize_name.cache_info()
+    total = info.hits + info.misses
+    return {
+        "aliases": get_matcher().size if _matcher is not None else 0,
+        "size": info.currsize,
+        "maxsize": info.maxsize,
+        "hits": info.hits,
+        "misses": info.misses,
+        "hit_rate": round(info.hits / total, 4) if total else 0.0,
+    }
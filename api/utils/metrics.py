@@ -0,0 +1,254 @@
+"""
+Request and DB instrumentation, exported in Prometheus text format on GET /metrics.
+
+- MetricsMiddleware records a latency histogram and status counts per route template
+  (/subscriptions/{sub_id}/timeline, not the raw path), plus SQL statements and DB time
+  per request. A route whose queries-per-request grows with the data is an N+1.
+- Cursor hooks on every SQLAlchemy engine (the async engines run on sync ones) count
+  statements against the current request or job via a contextvar; anything else
+  (event sink, schedulers, cancellation engine) lands under source="background".
+- Plaid calls come from plaid_client's per-endpoint stats.
+- SLOW_REQUEST_MS > 0 logs each request slower than that, with the SQL it ran.
+
+/metrics and the /healthz/* stats expose internals (queue sizes, vendors, route
+timings): with METRICS_TOKEN set they need "Authorization: Bearer <token>" (Prometheus'
+bearer_token), without it they only answer requests from localhost.
+"""
+import hmac, logging, os, threading, time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+from fastapi import Depends, HTTPException, Request
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))  # 0 = off
+SLOW_REQUEST_MAX_SQL = int(os.getenv("SLOW_REQUEST_MAX_SQL", "50"))  # statements kept per slow request
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+LOCALHOST = {"127.0.0.1", "::1"}
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+log = logging.getLogger("api.metrics")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+JOB_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+class Histogram:
+    """Cumulative buckets, prometheus-style (same shape as plaid_client.EndpointStats)."""
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.BUCKETS = buckets
+        self.buckets = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        for i, ub in enumerate(self.BUCKETS):
+            if value <= ub:
+                self.buckets[i] += 1
+
+class Trace:
+    """SQL issued by one request or job."""
+    __slots__ = ("queries", "db_s", "statements")
+
+    def __init__(self, keep_sql: bool = False):
+        self.queries = 0
+        self.db_s = 0.0
+        self.statements: Optional[List[str]] = [] if keep_sql else None
+
+class Stats:
+    """Everything recorded for one route (or job kind)."""
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.latency = Histogram(buckets)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.db_s = 0.0
+        self.outcomes: Dict[str, int] = {}
+
+    def record(self, outcome: str, seconds: float, tr: Trace):
+        self.latency.observe(seconds)
+        self.queries.observe(tr.queries)
+        self.db_s += tr.db_s
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+_trace: ContextVar[Optional[Trace]] = ContextVar("metrics_trace", default=None)
+_lock = threading.Lock()
+_routes: Dict[Tuple[str, str], Stats] = {}
+_jobs: Dict[str, Stats] = {}
+_background = Trace()
+
+@contextmanager
+def traced(keep_sql: bool = False) -> Iterator[Trace]:
+    """Count SQL run inside the block (and tasks/threads started from it) into one Trace."""
+    tr = Trace(keep_sql)
+    token = _trace.set(tr)
+    try:
+        yield tr
+    finally:
+        _trace.reset(token)
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor(conn, cursor, statement, parameters, context, executemany):
+    conn.info["metrics_t0"] = time.perf_counter()
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info.pop("metrics_t0", time.perf_counter())
+    tr = _trace.get()
+    if tr is None:
+        with _lock:
+            _background.queries += 1
+            _background.db_s += elapsed
+        return
+    tr.queries += 1
+    tr.db_s += elapsed
+    if tr.statements is not None and len(tr.statements) < SLOW_REQUEST_MAX_SQL:
+        tr.statements.append(f"{elapsed * 1000:7.1f}ms  {' '.join(statement.split())}")
+
+_bearer = HTTPBearer(auto_error=False)
+
+def require_metrics_access(request: Request, creds: Optional[HTTPAuthorizationCredentials] = Depends(_bearer)):
+    """Dependency for the internal endpoints; see the module docstring."""
+    if METRICS_TOKEN:
+        if creds is None or not hmac.compare_digest(creds.credentials.encode(), METRICS_TOKEN.encode()):
+            raise HTTPException(401, "metrics token required", headers={"WWW-Authenticate": "Bearer"})
+    elif (request.client is None or request.client.host not in LOCALHOST
+          or "x-forwarded-for" in request.headers):  # a local reverse proxy isn't local
+        raise HTTPException(403, "set METRICS_TOKEN to read metrics remotely")
+
+def record_job(kind: str, status: str, seconds: float, tr: Trace):
+    with _lock:
+        _jobs.setdefault(kind, Stats(JOB_BUCKETS)).record(status, seconds, tr)
+
+class MetricsMiddleware:
+    """
+    Pure ASGI (so streaming responses pass straight through). Latency is time to the
+    response start; for SSE that's the replay, not how long the stream stays open.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        t0 = time.perf_counter()
+        started: List = [500, None]  # status, seconds to response start
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                started[0], started[1] = message["status"], time.perf_counter() - t0
+            await send(message)
+
+        with traced(keep_sql=SLOW_REQUEST_MS > 0) as tr:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                seconds = started[1] if started[1] is not None else time.perf_counter() - t0
+                route = getattr(scope.get("route"), "path", None) or "unmatched"  # set by the router
+                with _lock:
+                    _routes.setdefault((scope["method"], route), Stats(LATENCY_BUCKETS)).record(
+                        str(started[0]), seconds, tr)
+                if SLOW_REQUEST_MS > 0 and seconds * 1000 >= SLOW_REQUEST_MS:
+                    log.warning("slow request %s %s -> %s in %.0fms: %d queries, %.1fms in the DB%s",
+                                scope["method"], scope["path"], started[0], seconds * 1000, tr.queries,
+                                tr.db_s * 1000, "".join(f"\n  {s}" for s in tr.statements))
+
+# ---------- exposition ----------
+
+def _esc(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(labels: Dict[str, str]) -> str:
+    return "{" + ",".join(f'{k}="{_esc(v)}"' for k, v in labels.items()) + "}" if labels else ""
+
+def _num(v) -> str:
+    return str(int(v)) if isinstance(v, (bool, int)) else repr(float(v))
+
+def _histogram(out: List[str], name: str, labels: Dict[str, str], bounds, buckets, count, total):
+    for ub, n in zip(bounds, buckets):
+        out.append(f"{name}_bucket{_labels({**labels, 'le': _num(ub)})} {n}")
+    out.append(f"{name}_bucket{_labels({**labels, 'le': '+Inf'})} {count}")
+    out.append(f"{name}_sum{_labels(labels)} {_num(total)}")
+    out.append(f"{name}_count{_labels(labels)} {count}")
+
+def _gauges(out: List[str], seen: set, name: str, d: dict, labels: Dict[str, str]):
+    """Numbers in a stats() dict as gauges; nested dicts extend the name, dicts of dicts become a `name` label."""
+    for k, v in d.items():
+        metric = f"{name}_{k}"
+        if isinstance(v, dict):
+            if v and all(isinstance(x, dict) for x in v.values()):
+                for key, sub in v.items():
+                    _gauges(out, seen, metric, sub, {**labels, "name": key})
+            else:
+                _gauges(out, seen, metric, v, labels)
+        elif isinstance(v, (bool, int, float)):
+            if metric not in seen:
+                seen.add(metric)
+                out.append(f"# TYPE {metric} gauge")
+            out.append(f"{metric}{_labels(labels)} {_num(v)}")
+
+def render(gauges: Dict[str, dict]) -> str:
+    """Everything as Prometheus text; `gauges` are stats() snapshots, exported as approval_<key>_*."""
+    from .plaid_client import endpoint_stats
+    out: List[str] = []
+    with _lock:
+        routes = sorted(_routes.items())
+        jobs = sorted(_jobs.items())
+        bg_queries, bg_db_s = _background.queries, _background.db_s
+
+        out.append("# TYPE http_request_duration_seconds histogram")
+        for (method, route), s in routes:
+            h = s.latency
+            _histogram(out, "http_request_duration_seconds", {"method": method, "route": route},
+                       h.BUCKETS, h.buckets, h.count, h.total)
+        out.append("# TYPE http_requests_total counter")
+        for (method, route), s in routes:
+            for status, n in sorted(s.outcomes.items()):
+                out.append(f"http_requests_total{_labels({'method': method, 'route': route, 'status': status})} {n}")
+        out.append("# TYPE http_request_db_queries histogram")
+        for (method, route), s in routes:
+            h = s.queries
+            _histogram(out, "http_request_db_queries", {"method": method, "route": route},
+                       h.BUCKETS, h.buckets, h.count, h.total)
+        out.append("# TYPE http_request_db_seconds_total counter")
+        for (method, route), s in routes:
+            out.append(f"http_request_db_seconds_total{_labels({'method': method, 'route': route})} {_num(s.db_s)}")
+
+        out.append("# TYPE job_duration_seconds histogram")
+        for kind, s in jobs:
+            h = s.latency
+            _histogram(out, "job_duration_seconds", {"kind": kind}, h.BUCKETS, h.buckets, h.count, h.total)
+        out.append("# TYPE jobs_total counter")
+        for kind, s in jobs:
+            for status, n in sorted(s.outcomes.items()):
+                out.append(f"jobs_total{_labels({'kind': kind, 'status': status})} {n}")
+        out.append("# TYPE job_db_queries histogram")
+        for kind, s in jobs:
+            h = s.queries
+            _histogram(out, "job_db_queries", {"kind": kind}, h.BUCKETS, h.buckets, h.count, h.total)
+
+        out.append("# TYPE db_queries_total counter")
+        out.append(f'db_queries_total{{source="http"}} {sum(int(s.queries.total) for _, s in routes)}')
+        out.append(f'db_queries_total{{source="job"}} {sum(int(s.queries.total) for _, s in jobs)}')
+        out.append(f'db_queries_total{{source="background"}} {bg_queries}')
+        out.append("# TYPE db_query_seconds_total counter")
+        out.append(f'db_query_seconds_total{{source="http"}} {_num(sum(s.db_s for _, s in routes))}')
+        out.append(f'db_query_seconds_total{{source="job"}} {_num(sum(s.db_s for _, s in jobs))}')
+        out.append(f'db_query_seconds_total{{source="background"}} {_num(bg_db_s)}')
+
+    plaid = sorted(endpoint_stats.items())
+    out.append("# TYPE plaid_request_duration_seconds histogram")
+    for path, st in plaid:
+        _histogram(out, "plaid_request_duration_seconds", {"path": path}, st.BUCKETS, st.buckets, st.count, st.total)
+    for metric, attr in (("plaid_errors_total", "errors"), ("plaid_retries_total", "retries")):
+        out.append(f"# TYPE {metric} counter")
+        for path, st in plaid:
+            out.append(f"{metric}{_labels({'path': path})} {getattr(st, attr)}")
+
+    seen: set = set()
+    for key, d in gauges.items():
+        _gauges(out, seen, f"approval_{key}", d, {})
+    return "\n".join(out) + "\n"
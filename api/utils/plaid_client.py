@@ -0,0 +1,170 @@
+import asyncio, os, random, time
+from typing import TYPE_CHECKING, Any, Dict, Optional
+from fastapi import HTTPException
+from .ratelimit import TokenBucket
+
+if TYPE_CHECKING:
+    import httpx  # imported on first PlaidClient, so processes that never call Plaid skip it
+
+PLAID_ENV = os.getenv("PLAID_ENV", "sandbox")
+BASES = {
+    "sandbox": "https://sandbox.plaid.com",
+    "development": "https://development.plaid.com",
+    "production": "https://production.plaid.com",
+}
+# PLAID_BASE_URL points the client at something else, e.g. the local fake (api/dev/fake_plaid.py)
+BASE = os.getenv("PLAID_BASE_URL") or BASES[PLAID_ENV]
+CID = os.getenv("PLAID_CLIENT_ID")
+SEC = os.getenv("PLAID_SECRET")
+
+PLAID_TIMEOUT = float(os.getenv("PLAID_TIMEOUT", "20"))
+PLAID_MAX_CONNECTIONS = int(os.getenv("PLAID_MAX_CONNECTIONS", "20"))
+PLAID_MAX_CONCURRENCY = int(os.getenv("PLAID_MAX_CONCURRENCY", "10"))
+PLAID_MAX_RETRIES = int(os.getenv("PLAID_MAX_RETRIES", "3"))
+PLAID_BACKOFF_BASE = float(os.getenv("PLAID_BACKOFF_BASE", "0.5"))
+PLAID_BACKOFF_MAX = float(os.getenv("PLAID_BACKOFF_MAX", "8"))
+PLAID_RATE_LIMIT = float(os.getenv("PLAID_RATE_LIMIT", "0"))  # requests/sec across the process, 0 = off
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class EndpointStats:
+    # upper bounds in seconds, prometheus-style cumulative buckets
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0)
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(self.BUCKETS)
+
+    def observe(self, seconds: float, ok: bool):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if not ok:
+            self.errors += 1
+        for i, ub in enumerate(self.BUCKETS):
+            if seconds <= ub:
+                self.buckets[i] += 1
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "retries": self.retries,
+            "avg_ms": round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            "max_ms": round(self.max * 1000, 2),
+        }
+
+# per-endpoint latency, shared by every client instance in the process
+endpoint_stats: Dict[str, EndpointStats] = {}
+
+def plaid_stats() -> dict:
+    return {path: s.as_dict() for path, s in endpoint_stats.items()}
+
+class PlaidClient:
+    """
+    One keep-alive connection pool for every Plaid call in the process.
+    Concurrency is capped with a semaphore; 429/5xx and transport errors are
+    retried with exponential backoff (+ jitter, honoring Retry-After).
+    Calls that aren't safe to repeat pass retry=False: those are only retried
+    when the connection was never made, so Plaid can't have seen the request.
+    """
+    def __init__(
+        self,
+        base: str = BASE,
+        client_id: Optional[str] = CID,
+        secret: Optional[str] = SEC,
+        max_connections: int = PLAID_MAX_CONNECTIONS,
+        concurrency: int = PLAID_MAX_CONCURRENCY,
+        timeout: float = PLAID_TIMEOUT,
+        max_retries: int = PLAID_MAX_RETRIES,
+        rate_limiter=None,
+    ):
+        self.base = base.rstrip("/")
+        self.client_id = client_id
+        self.secret = secret
+        self.max_retries = max_retries
+        self.rate_limiter = rate_limiter  # optional; anything with `async acquire()`
+        self._sem = asyncio.Semaphore(concurrency)
+        import httpx
+        self._transport_error = httpx.TransportError
+        self._not_sent = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+        self._http = httpx.AsyncClient(
+            base_url=self.base,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        self.stats = endpoint_stats
+
+    def _backoff(self, attempt: int, resp: Optional["httpx.Response"]) -> float:
+        if resp is not None:
+            ra = resp.headers.get("Retry-After")
+            if ra and ra.isdigit():
+                return min(float(ra), PLAID_BACKOFF_MAX)
+        delay = min(PLAID_BACKOFF_BASE * (2 ** attempt), PLAID_BACKOFF_MAX)
+        return delay * (0.5 + random.random() / 2)
+
+    async def post(self, path: str, payload: Dict[str, Any], retry: bool = True) -> Dict[str, Any]:
+        if not (self.client_id and self.secret):
+            raise HTTPException(500, "Plaid keys not set in .env")
+        body = {"client_id": self.client_id, "secret": self.secret, **payload}
+        st = self.stats.setdefault(path, EndpointStats())
+        attempt = 0
+        while True:
+            resp = None
+            err: Optional[Exception] = None
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire()
+            t0 = time.perf_counter()
+            async with self._sem:
+                try:
+                    resp = await self._http.post(path, json=body)
+                except self._transport_error as e:
+                    err = e
+            ok = resp is not None and resp.is_success
+            st.observe(time.perf_counter() - t0, ok)
+            if ok:
+                return resp.json()
+            if retry:
+                retryable = err is not None or resp.status_code in RETRY_STATUSES
+            else:
+                retryable = isinstance(err, self._not_sent)
+            if not retryable or attempt >= self.max_retries:
+                if err is not None:
+                    raise HTTPException(502, f"Plaid unreachable: {err}")
+                raise HTTPException(resp.status_code, resp.text)
+            st.retries += 1
+            await asyncio.sleep(self._backoff(attempt, resp))
+            attempt += 1
+
+    async def aclose(self):
+        await self._http.aclose()
+
+# one client per event loop (the app has one; scripts may run several asyncio.run()s)
+_client: Optional[PlaidClient] = None
+_client_loop = None
+
+def get_plaid() -> PlaidClient:
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        _client = PlaidClient(rate_limiter=TokenBucket(PLAID_RATE_LIMIT) if PLAID_RATE_LIMIT > 0 else None)
+        _client_loop = loop
+    return _client
+
+def use_plaid(client: PlaidClient):
+    """Make `client` the shared client for the running loop (scripts with their own limits)."""
+    global _client, _client_loop
+    _client, _client_loop = client, asyncio.get_running_loop()
+
+async def close_plaid():
+    global _client, _client_loop
+    if _client is not None and _client_loop is asyncio.get_running_loop():
+        await _client.aclose()
+    _client = _client_loop = None
+
+async def plaid_req(path: str, payload: dict, retry: bool = True) -> dict:
+    return await get_plaid().post(path, payload, retry=retry)
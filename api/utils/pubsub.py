@@ -0,0 +1,93 @@
+"""
+In-process pub/sub for live events.
+
+Each connected stream gets a small bounded asyncio.Queue registered under its user id;
+publish() fans an event out to that user's queues. publish() is safe to call from any
+thread (the event sink's writer thread publishes after each batch) -- delivery is always
+hopped onto the event loop the subscribers live on.
+
+A subscriber that falls SSE_QUEUE_SIZE events behind is disconnected rather than
+buffered without bound; its client reconnects with Last-Event-ID and replays from the DB.
+This is per process: with several API workers, each one only sees the events it wrote.
+"""
+import asyncio, os, threading
+from typing import Dict, Optional, Set
+
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "256"))
+
+class Subscriber:
+    __slots__ = ("user_id", "queue", "closed")
+
+    def __init__(self, user_id: int, maxsize: int):
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.closed = False
+
+    async def get(self) -> Optional[dict]:
+        """Next event, or None once the broker has dropped this subscriber."""
+        return await self.queue.get()
+
+class Broker:
+    def __init__(self, queue_size: int = SSE_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subs: Dict[int, Set[Subscriber]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+        self.clients = 0
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def subscribe(self, user_id: int) -> Subscriber:
+        """Call from the event loop; pair with unsubscribe() in a finally."""
+        self._loop = asyncio.get_running_loop()
+        sub = Subscriber(user_id, self.queue_size)
+        with self._lock:
+            self._subs.setdefault(user_id, set()).add(sub)
+            self.clients += 1
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        with self._lock:
+            subs = self._subs.get(sub.user_id)
+            if subs is not None and sub in subs:
+                subs.discard(sub)
+                self.clients -= 1
+                if not subs:
+                    del self._subs[sub.user_id]
+
+    def publish(self, user_id: int, event: dict):
+        loop = self._loop
+        if loop is None or user_id not in self._subs or loop.is_closed():
+            return  # nobody listening in this process
+        self.published += 1
+        try:
+            loop.call_soon_threadsafe(self._deliver, user_id, event)
+        except RuntimeError:
+            pass  # loop shut down between the check and the call
+
+    def _deliver(self, user_id: int, event: dict):
+        with self._lock:
+            subs = list(self._subs.get(user_id, ()))
+        for sub in subs:
+            if sub.closed:
+                continue
+            try:
+                sub.queue.put_nowait(event)
+                self.delivered += 1
+            except asyncio.QueueFull:
+                # too slow: cut it loose; the None wakes the stream so it can end
+                sub.closed = True
+                self.dropped += 1
+                self.unsubscribe(sub)
+                try:
+                    sub.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    pass
+                sub.queue.put_nowait(None)
+
+    def stats(self) -> dict:
+        return {"clients": self.clients, "users": len(self._subs), "published": self.published,
+                "delivered": self.delivered, "dropped": self.dropped}
+
+broker = Broker()
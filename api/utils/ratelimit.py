@@ -0,0 +1,31 @@
+import asyncio, time
+from typing import Optional
+
+class TokenBucket:
+    """
+    Async token bucket: `rate` tokens/sec, bursts of up to `burst`.
+    Waiters queue on a lock, so they're served in arrival order.
+    Usage: limiter = TokenBucket(rate=50); await limiter.acquire()
+    """
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate must be > 0")
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.waited = 0.0  # total seconds callers spent throttled
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, n: float = 1.0):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                wait = (n - self.tokens) / self.rate
+                self.waited += wait
+                await asyncio.sleep(wait)
@@ -0,0 +1,161 @@
+"""
+Batch recurrence detection.
+
+All groups (one user's merchants, or every user's) go in as three flat arrays --
+group id, day ordinal, amount -- and come out classified in one vectorized pass:
+cadence (weekly/monthly/quarterly/yearly), a 0..1 confidence, the median gap and a
+predicted next charge date.
+"""
+import os
+from datetime import date, datetime
+from typing import Iterable, List, Optional
+import numpy as np
+
+# name, nominal period in days, relative gap tolerance, charges needed for full confidence
+CADENCES = (
+    ("weekly", 7.0, 0.22, 4),
+    ("monthly", 30.44, 0.15, 3),
+    ("quarterly", 91.31, 0.12, 2),
+    ("yearly", 365.25, 0.06, 2),
+)
+NAMES = np.array([c[0] for c in CADENCES])
+PERIODS = np.array([c[1] for c in CADENCES])
+TOLERANCE = np.array([c[2] for c in CADENCES])
+FULL_AT = np.array([c[3] for c in CADENCES], dtype=float)
+
+RECURRENCE_MIN_CONFIDENCE = float(os.getenv("RECURRENCE_MIN_CONFIDENCE", "0.6"))
+AMOUNT_DRIFT_TOLERANCE = float(os.getenv("AMOUNT_DRIFT_TOLERANCE", "0.25"))  # max change between consecutive charges
+
+def detect_batch(group_ids: np.ndarray, days: np.ndarray, amounts: np.ndarray,
+                 n_groups: Optional[int] = None, as_of: Optional[int] = None) -> dict:
+    """
+    group_ids: int array, 0..n_groups-1, one entry per charge
+    days:      int array of date ordinals
+    amounts:   float array (absolute charge amounts)
+    as_of:     date ordinal used to down-weight groups that stopped charging
+
+    Returns per-group arrays: cadence (index into CADENCES, -1 = none), confidence,
+    period (median gap, days), next_day (ordinal), amount (latest charge), count.
+    """
+    group_ids = np.asarray(group_ids, dtype=np.int64)
+    days = np.asarray(days, dtype=np.int64)
+    amounts = np.asarray(amounts, dtype=np.float64)
+    n = int(n_groups if n_groups is not None else (group_ids.max() + 1 if group_ids.size else 0))
+
+    order = np.lexsort((days, group_ids))
+    g, d, a = group_ids[order], days[order], amounts[order]
+    count = np.bincount(g, minlength=n)
+
+    # latest charge per group (rows are sorted by group, then day)
+    last_idx = np.cumsum(count) - 1
+    has = count > 0
+    last_day = np.zeros(n, dtype=np.int64)
+    last_amt = np.zeros(n)
+    last_day[has] = d[last_idx[has]]
+    last_amt[has] = a[last_idx[has]]
+
+    # gaps between consecutive charges of the same group; same-day duplicates ignored
+    same = g[1:] == g[:-1]
+    gaps = np.diff(d)[same].astype(np.float64)
+    gap_g = g[1:][same]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        drift = (np.abs(np.diff(a)) / np.maximum(a[:-1], 0.01))[same]
+    keep = gaps > 0
+    gaps, gap_g, drift = gaps[keep], gap_g[keep], drift[keep]
+    n_gaps = np.bincount(gap_g, minlength=n)
+
+    # amount stability: share of consecutive charges within the drift tolerance, so an
+    # occasional price rise is fine but a merchant with scattered amounts is not
+    steady = np.bincount(gap_g, weights=(drift <= AMOUNT_DRIFT_TOLERANCE).astype(np.float64), minlength=n)
+
+    # median gap per group
+    go = np.lexsort((gaps, gap_g))
+    sg = gaps[go]
+    start = np.cumsum(n_gaps) - n_gaps
+    ok = n_gaps > 0
+    median = np.zeros(n)
+    lo = start[ok] + (n_gaps[ok] - 1) // 2
+    hi = start[ok] + n_gaps[ok] // 2
+    median[ok] = (sg[lo] + sg[hi]) / 2
+
+    # nearest cadence by relative error
+    rel = np.abs(median[:, None] - PERIODS[None, :]) / PERIODS[None, :]
+    cad = rel.argmin(axis=1)
+    cad_ok = ok & (rel[np.arange(n), cad] <= TOLERANCE[cad])
+
+    # confidence = share of gaps that fit the cadence x enough history x amount stability x recency
+    period = PERIODS[cad]
+    fits = np.abs(gaps - period[gap_g]) / period[gap_g] <= TOLERANCE[cad][gap_g]
+    hit = np.bincount(gap_g, weights=fits.astype(np.float64), minlength=n)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        conf = np.where(ok, hit / n_gaps, 0.0)
+    conf *= np.minimum(1.0, count / FULL_AT[cad])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        conf *= np.where(ok, steady / n_gaps, 0.0)
+    if as_of is not None:
+        overdue = (as_of - last_day) / np.maximum(median, 1.0)
+        conf *= np.where(overdue > 2.0, 0.5, 1.0)
+    conf = np.where(cad_ok, conf, 0.0)
+
+    next_day = last_day + np.rint(np.where(ok, median, 0)).astype(np.int64)
+    return {
+        "cadence": np.where(cad_ok, cad, -1),
+        "confidence": conf,
+        "period": median,
+        "next_day": next_day,
+        "amount": last_amt,
+        "count": count,
+    }
+
+def split_plans(points: list) -> List[list]:
+    """
+    One merchant's charges as one list per plan. Charges are bucketed by amount (a new
+    bucket wherever the sorted amounts jump by more than AMOUNT_DRIFT_TOLERANCE); the
+    buckets only count as separate plans if they run at the same time -- a price change
+    gives buckets one after the other, and that's still one subscription.
+    """
+    by_amt = sorted(points, key=lambda p: p[1])
+    buckets = [[by_amt[0]]] if by_amt else []
+    for prev, p in zip(by_amt, by_amt[1:]):
+        if p[1] > max(prev[1], 0.01) * (1 + AMOUNT_DRIFT_TOLERANCE):
+            buckets.append([])
+        buckets[-1].append(p)
+    if len(buckets) < 2:
+        return [points]
+    spans = sorted((min(p[0] for p in b), max(p[0] for p in b)) for b in buckets)
+    if all(a[1] < b[0] for a, b in zip(spans, spans[1:])):
+        return [points]
+    return [sorted(b) for b in buckets]
+
+def detect_groups(groups: Iterable, as_of: Optional[date] = None,
+                  min_confidence: float = RECURRENCE_MIN_CONFIDENCE) -> List[dict]:
+    """
+    Run detect_batch over GroupState-like objects (.merchant, .points = [(datetime, amount, id), ...]).
+    Returns subscription rows for groups that clear min_confidence. A merchant billing
+    several plans at once (split_plans) gets one row per detected plan: the oldest keeps
+    the merchant name, the others are "Merchant (2)", "Merchant (3)"...
+    """
+    series = [(gr.merchant, pts) for gr in groups for pts in split_plans(list(gr.points))]
+    if not series:
+        return []
+    sizes = np.fromiter((len(pts) for _, pts in series), dtype=np.int64, count=len(series))
+    gid = np.repeat(np.arange(len(series)), sizes)
+    days = np.fromiter((p[0].toordinal() for _, pts in series for p in pts), dtype=np.int64, count=int(sizes.sum()))
+    amts = np.fromiter((p[1] for _, pts in series for p in pts), dtype=np.float64, count=int(sizes.sum()))
+    as_of = (as_of or date.today()).toordinal()
+    r = detect_batch(gid, days, amts, n_groups=len(series), as_of=as_of)
+
+    found = {}
+    for i in np.flatnonzero((r["cadence"] >= 0) & (r["confidence"] >= min_confidence)):
+        merchant, pts = series[i]
+        found.setdefault(merchant, []).append((min(p[0] for p in pts), {
+            "merchant": merchant,
+            "amount": round(float(r["amount"][i]), 2),
+            "interval": str(NAMES[r["cadence"][i]]),
+            "next_renewal_at": datetime.combine(date.fromordinal(int(r["next_day"][i])), datetime.min.time()),
+        }))
+    out = []
+    for merchant, plans in found.items():
+        for n, (_, row) in enumerate(sorted(plans, key=lambda x: x[0])):
+            out.append({**row, "merchant": merchant if n == 0 else f"{merchant} ({n + 1})"})
+    return out
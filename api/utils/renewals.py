@@ -0,0 +1,200 @@
+"""
+Renewal scheduler.
+
+Active subscriptions renewing soon (within RENEWAL_LEAD_HOURS plus two reload
+intervals) are loaded across all users, off the (status, next_renewal_at) index, into a
+min-heap ordered by when their reminder is due: next_renewal_at - RENEWAL_LEAD_HOURS. One task sleeps until the
+head of the heap is due (or the next reload), pops everything that's due, and emits an
+"approval.requested" event per subscription in one batch.
+
+Each batch is claimed with a conditional UPDATE of subscriptions.renewal_notified_at,
+which also re-checks status and next_renewal_at. So a subscription that was canceled or
+rescanned after it was loaded is skipped. Running several API processes doesn't
+double-send, and a restart doesn't resend. New or changed subscriptions are picked up on
+the next reload (RENEWAL_RELOAD_S), or right away when a scan pokes the scheduler with
+a renewal date that falls inside the horizon.
+"""
+import asyncio, heapq, logging, os
+from datetime import datetime, timedelta
+from typing import Iterable, List, NamedTuple, Optional
+from sqlalchemy import select, update
+from ..db import get_async_sessionmaker
+from ..models import Subscription, SubStatus
+from .log import event_row, log_events
+
+RENEWAL_SCHEDULER = os.getenv("RENEWAL_SCHEDULER", "1") == "1"
+RENEWAL_LEAD_HOURS = float(os.getenv("RENEWAL_LEAD_HOURS", "24"))   # how early to ask
+RENEWAL_RELOAD_S = float(os.getenv("RENEWAL_RELOAD_S", "300"))
+RENEWAL_BATCH = int(os.getenv("RENEWAL_BATCH", "500"))
+
+log = logging.getLogger("api.renewals")
+
+class Due(NamedTuple):
+    remind_at: datetime  # heap key
+    subscription_id: int
+    user_id: int
+    renews_at: datetime
+    merchant: str
+    amount: Optional[float]
+
+class RenewalScheduler:
+    def __init__(self, lead_hours: float = RENEWAL_LEAD_HOURS, reload_s: float = RENEWAL_RELOAD_S,
+                 batch: int = RENEWAL_BATCH):
+        self.lead = timedelta(hours=lead_hours)
+        self.reload_s = reload_s
+        # everything whose reminder falls due before the next reload, with slack
+        self.horizon = self.lead + timedelta(seconds=2 * reload_s)
+        self.batch = batch
+        self._heap: List[Due] = []
+        self._queued: set = set()  # (subscription_id, renews_at) already in the heap
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loaded_at: Optional[datetime] = None
+        self.sent = 0
+        self.skipped = 0  # popped but no longer due (canceled, rescanned, or another process sent it)
+        self.batches = 0
+
+    # --- heap ---
+
+    def push(self, d: Due):
+        key = (d.subscription_id, d.renews_at)
+        if key not in self._queued:
+            self._queued.add(key)
+            heapq.heappush(self._heap, d)
+
+    def pop_due(self, now: datetime, limit: int) -> List[Due]:
+        out = []
+        while self._heap and self._heap[0].remind_at <= now and len(out) < limit:
+            d = heapq.heappop(self._heap)
+            self._queued.discard((d.subscription_id, d.renews_at))
+            out.append(d)
+        return out
+
+    # --- db ---
+
+    async def load(self, now: Optional[datetime] = None) -> int:
+        """(Re)fill the heap from subscriptions renewing within the horizon."""
+        now = now or datetime.utcnow()
+        S = Subscription
+        q = (
+            select(S.id, S.user_id, S.next_renewal_at, S.merchant, S.amount)
+            .where(
+                S.status == SubStatus.active,
+                S.next_renewal_at > now,
+                S.next_renewal_at <= now + self.horizon,
+                S.renewal_notified_at.is_distinct_from(S.next_renewal_at),
+            )
+        )
+        n = 0
+        async with get_async_sessionmaker()() as db:
+            for r in (await db.execute(q)).all():
+                self.push(Due(r.next_renewal_at - self.lead, r.id, r.user_id, r.next_renewal_at, r.merchant, r.amount))
+                n += 1
+        self.loaded_at = now
+        return n
+
+    async def send(self, batch: List[Due]) -> int:
+        """Claim the batch, then hand its events to the sink; returns how many were sent."""
+        S = Subscription
+        expected = {d.subscription_id: d for d in batch}
+        async with get_async_sessionmaker()() as db:
+            claimed = (await db.execute(
+                update(S)
+                .where(
+                    S.id.in_(list(expected)),
+                    S.status == SubStatus.active,
+                    S.renewal_notified_at.is_distinct_from(S.next_renewal_at),
+                )
+                .values(renewal_notified_at=S.next_renewal_at)
+                .returning(S.id, S.next_renewal_at)
+                .execution_options(synchronize_session=False)
+            )).all()
+            # a rescan may have moved the date since load(); that renewal gets its own turn
+            ids = [r.id for r in claimed if r.next_renewal_at == expected[r.id].renews_at]
+            stale = [r.id for r in claimed if r.id not in ids]
+            if stale:
+                await db.execute(
+                    update(S).where(S.id.in_(stale)).values(renewal_notified_at=None)
+                    .execution_options(synchronize_session=False)
+                )
+            rows = []
+            for sid in ids:
+                d = expected[sid]
+                amount = f" (${d.amount:.2f})" if d.amount is not None else ""
+                rows.append(event_row(
+                    d.user_id, "approval.requested",
+                    f"{d.merchant} renews {d.renews_at:%b %d}{amount} -- approve or deny",
+                    {"subscription_id": sid, "renews_at": d.renews_at.isoformat(), "amount": d.amount},
+                ))
+            log_events(db, rows)  # reminders go through the sink (this session only if it's full)
+            await db.commit()
+        self.sent += len(rows)
+        self.skipped += len(batch) - len(rows)
+        self.batches += 1
+        return len(rows)
+
+    # --- loop ---
+
+    async def start(self):
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._loop = asyncio.get_running_loop()
+            self._task = asyncio.create_task(self._run(), name="renewal-scheduler")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def poke(self, renews_at: Optional[Iterable[Optional[datetime]]] = None):
+        """
+        Reload now instead of at the next interval; call after committing new renewal
+        dates (scans, imports). Given the dates, only reloads if one of them falls inside
+        the horizon -- anything later is loaded in time anyway. Safe from any thread.
+        """
+        if renews_at is not None:
+            cutoff = datetime.utcnow() + self.horizon
+            if not any(d is not None and d <= cutoff for d in renews_at):
+                return
+        self.loaded_at = None
+        if self._loop is not None and self._wake is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def _run(self):
+        while True:
+            self._wake.clear()  # before the scan, so a poke that lands during it isn't lost
+            now = datetime.utcnow()
+            try:
+                if self.loaded_at is None or (now - self.loaded_at).total_seconds() >= self.reload_s:
+                    await self.load(now)
+                while True:
+                    batch = self.pop_due(datetime.utcnow(), self.batch)
+                    if not batch:
+                        break
+                    await self.send(batch)
+            except Exception:
+                log.exception("renewal scheduler pass failed")
+                self.loaded_at = None  # start over from the table next time
+            now = datetime.utcnow()
+            wait = self.reload_s - (now - self.loaded_at).total_seconds() if self.loaded_at else self.reload_s
+            if self._heap:
+                wait = min(wait, (self._heap[0].remind_at - now).total_seconds())
+            try:
+                await asyncio.wait_for(self._wake.wait(), max(wait, 0.05))
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "queued": len(self._heap),
+            "next_due": self._heap[0].remind_at.isoformat() if self._heap else None,
+            "loaded_at": self.loaded_at.isoformat() if self.loaded_at else None,
+            "sent": self.sent,
+            "skipped": self.skipped,
+            "batches": self.batches,
+        }
+
+renewal_scheduler = RenewalScheduler()
@@ -0,0 +1,263 @@
+import asyncio, heapq, json, os
+from datetime import date, datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..models import InstitutionConnection, RecurrenceState, SubStatus
+from .plaid_client import plaid_req
+from .merchants import normalize_name
+from .subs import upsert_subscriptions_async
+from .jobs import handler
+from .renewals import renewal_scheduler
+from ..db import get_async_sessionmaker
+
+SCAN_PAGE_SIZE = int(os.getenv("SCAN_PAGE_SIZE", "500"))        # Plaid's max for /transactions/get
+SCAN_DEFAULT_DAYS = int(os.getenv("SCAN_DEFAULT_DAYS", "90"))
+SCAN_MAX_DAYS = int(os.getenv("SCAN_MAX_DAYS", "730"))          # Plaid keeps ~24 months
+SCAN_GROUP_POINTS = int(os.getenv("SCAN_GROUP_POINTS", "36"))   # most recent charges kept per group
+SCAN_MAX_GROUPS = int(os.getenv("SCAN_MAX_GROUPS", "20000"))
+SYNC_PAGE_SIZE = int(os.getenv("SYNC_PAGE_SIZE", "500"))        # Plaid's max for /transactions/sync
+
+class GroupState:
+    """
+    Running state for one merchant's charges.
+    Only the newest SCAN_GROUP_POINTS charges are kept (min-heap on date), so memory
+    per group is constant no matter how much history streams through. Points carry
+    the Plaid transaction_id so incremental syncs can drop removed/modified charges.
+    """
+    __slots__ = ("merchant", "points", "amount_sum", "count", "dirty")
+
+    def __init__(self, merchant: str = "", points: Optional[list] = None):
+        self.merchant = merchant
+        self.points: List[Tuple[datetime, float, str]] = points or []
+        heapq.heapify(self.points)
+        self.amount_sum = sum(p[1] for p in self.points)
+        self.count = len(self.points)
+        self.dirty = False
+
+    @property
+    def dates(self) -> List[datetime]:
+        return [p[0] for p in self.points]
+
+    def add(self, dt: datetime, amount: float, txn_id: str = ""):
+        self.amount_sum += amount
+        self.count += 1
+        self.dirty = True
+        pt = (dt, amount, txn_id)
+        if len(self.points) < SCAN_GROUP_POINTS:
+            heapq.heappush(self.points, pt)
+        elif pt > self.points[0]:
+            heapq.heapreplace(self.points, pt)
+
+    def remove(self, txn_id: str) -> bool:
+        for i, p in enumerate(self.points):
+            if p[2] == txn_id:
+                self.points.pop(i)
+                heapq.heapify(self.points)
+                self.amount_sum -= p[1]
+                self.count -= 1
+                self.dirty = True
+                return True
+        return False
+
+    def dumps(self) -> str:
+        return json.dumps([[p[0].date().isoformat(), p[1], p[2]] for p in sorted(self.points)])
+
+    @classmethod
+    def loads(cls, merchant: str, raw: str) -> "GroupState":
+        pts = [(datetime.fromisoformat(d), float(a), t) for d, a, t in json.loads(raw or "[]")]
+        return cls(merchant, pts)
+
+# one group per canonical merchant; the detector tolerates amount drift within it
+GroupKey = str
+
+async def iter_transaction_pages(access_token: str, start: date, end: date,
+                                 page_size: int = SCAN_PAGE_SIZE) -> AsyncIterator[list]:
+    """Yield /transactions/get pages until total_transactions is exhausted."""
+    offset = 0
+    while True:
+        data = await plaid_req("/transactions/get", {
+            "access_token": access_token,
+            "start_date": start.isoformat(),
+            "end_date": end.isoformat(),
+            "options": {"count": page_size, "offset": offset},
+        })
+        page = data.get("transactions", [])
+        if not page:
+            return
+        yield page
+        offset += len(page)
+        if offset >= data.get("total_transactions", 0):
+            return
+
+def txn_key(t: dict) -> Tuple[GroupKey, datetime, float]:
+    nm = normalize_name(t.get("merchant_name") or t.get("name") or "")
+    amt = abs(float(t.get("amount", 0)))
+    dt = datetime.fromisoformat(t.get("date"))
+    return nm, dt, amt
+
+def bucket_page(groups: Dict[GroupKey, GroupState], page: list) -> None:
+    for t in page:
+        key, dt, amt = txn_key(t)
+        g = groups.get(key)
+        if g is None:
+            g = groups[key] = GroupState(key)
+        g.add(dt, amt, t.get("transaction_id", ""))
+    if len(groups) > SCAN_MAX_GROUPS:
+        # one-off charges are the bulk of distinct keys and can't be recurring yet; drop them
+        for key in [k for k, g in groups.items() if g.count < 2]:
+            del groups[key]
+
+async def collect_groups(access_token: str, start: date, end: date) -> Dict[GroupKey, GroupState]:
+    # normalizing and bucketing a 500-row page is pure CPU; keep it off the event loop
+    groups: Dict[GroupKey, GroupState] = {}
+    async for page in iter_transaction_pages(access_token, start, end):
+        await asyncio.to_thread(bucket_page, groups, page)
+    return groups
+
+def detect(groups) -> List[dict]:
+    from .recurrence import detect_groups  # numpy: only loaded once a scan actually runs
+    return detect_groups(groups.values() if isinstance(groups, dict) else groups)
+
+async def save_detected(db: AsyncSession, user_id: int, detected: List[dict]) -> List[dict]:
+    """Upsert detected subscriptions in one statement; returns all of the user's subscriptions."""
+    rows = [{**d, "status": SubStatus.active} for d in detected]
+    return list((await upsert_subscriptions_async(db, user_id, rows)).values())
+
+async def run_scan(db: AsyncSession, conn: InstitutionConnection, days: int = SCAN_DEFAULT_DAYS) -> List[dict]:
+    """Stream the connection's transactions for the last `days`, detect recurring charges, upsert them."""
+    end = date.today()
+    start = end - timedelta(days=min(days, SCAN_MAX_DAYS))
+    groups = await collect_groups(conn.access_token_ref, start, end)
+    detected = await asyncio.to_thread(detect, groups)
+    subs = await save_detected(db, conn.user_id, detected)
+    await db.commit()
+    renewal_scheduler.poke(d.get("next_renewal_at") for d in detected)
+    return subs
+
+# --- incremental scan via /transactions/sync ---
+
+class _SyncRestart(Exception):
+    pass
+
+async def _load_states(db: AsyncSession, conn_id: int, keys: Optional[List[str]] = None) -> List[RecurrenceState]:
+    q = select(RecurrenceState).filter_by(connection_id=conn_id)
+    if keys is not None:
+        q = q.where(RecurrenceState.group_key.in_(keys))
+    return list((await db.execute(q)).scalars().all())
+
+async def _sync_once(db: AsyncSession, conn: InstitutionConnection):
+    """
+    Pull everything since conn.sync_cursor and fold it into the persisted group states.
+    Only groups touched by added/modified/removed transactions are loaded.
+    Returns (rows by group_key, group states by group_key, next cursor, transaction count).
+    """
+    rows: Dict[str, RecurrenceState] = {}
+    states: Dict[str, GroupState] = {}
+    by_txn: Optional[Dict[str, str]] = None  # transaction_id -> group_key, built only if needed
+    cursor = conn.sync_cursor
+    seen = 0
+
+    def remember(r: RecurrenceState):
+        rows[r.group_key] = r
+        states[r.group_key] = GroupState.loads(r.merchant, r.points)
+
+    async def locate(txn_ids: List[str]):
+        nonlocal by_txn
+        if by_txn is None:
+            for r in await _load_states(db, conn.id, None):
+                if r.group_key not in rows:
+                    remember(r)
+            by_txn = {p[2]: k for k, g in states.items() for p in g.points}
+        return [(tid, by_txn.get(tid)) for tid in txn_ids]
+
+    while True:
+        try:
+            data = await plaid_req("/transactions/sync", {
+                "access_token": conn.access_token_ref,
+                "cursor": cursor or "",
+                "count": SYNC_PAGE_SIZE,
+            })
+        except HTTPException as e:
+            if "TRANSACTIONS_SYNC_MUTATION_DURING_PAGINATION" in str(e.detail):
+                raise _SyncRestart()
+            raise
+        added = data.get("added", [])
+        modified = data.get("modified", [])
+        removed = [r.get("transaction_id") for r in data.get("removed", [])]
+        seen += len(added) + len(modified) + len(removed)
+
+        # a modified transaction may have moved groups: drop the old point, re-add below
+        gone = removed + [t.get("transaction_id") for t in modified]
+        if gone:
+            for tid, key in await locate(gone):
+                if key is not None:
+                    states[key].remove(tid)
+                    by_txn.pop(tid, None)
+
+        fresh = await asyncio.to_thread(lambda: [(t, *txn_key(t)) for t in added + modified])
+        missing = {k for _, k, _, _ in fresh} - states.keys()
+        if missing:
+            for r in await _load_states(db, conn.id, list(missing)):
+                remember(r)
+        for t, key, dt, amt in fresh:
+            g = states.get(key)
+            if g is None:
+                g = states[key] = GroupState(key)
+            g.add(dt, amt, t.get("transaction_id", ""))
+            if by_txn is not None:
+                by_txn[t.get("transaction_id", "")] = key
+
+        cursor = data.get("next_cursor") or cursor
+        if not data.get("has_more"):
+            return rows, states, cursor, seen
+
+async def run_sync(db: AsyncSession, conn: InstitutionConnection) -> List[dict]:
+    """
+    Incremental scan: apply only what changed since the stored cursor, re-evaluate the
+    groups it touched, and upsert just those subscriptions. The first run has no cursor,
+    so Plaid returns the item's full history.
+    """
+    for _ in range(3):
+        try:
+            rows, states, cursor, _seen = await _sync_once(db, conn)
+            break
+        except _SyncRestart:
+            continue  # Plaid data changed mid-pagination; restart from the stored cursor
+    else:
+        raise HTTPException(503, "Plaid data kept changing during sync; try again")
+
+    touched = {k: g for k, g in states.items() if g.dirty}
+    for k, g in touched.items():
+        r = rows.get(k)
+        if r is None:
+            db.add(RecurrenceState(connection_id=conn.id, group_key=k, merchant=g.merchant, points=g.dumps()))
+        else:
+            r.points = g.dumps()
+    detected = await asyncio.to_thread(detect, touched)
+    subs = await save_detected(db, conn.user_id, detected)
+    conn.sync_cursor = cursor
+    conn.last_synced_at = datetime.utcnow()
+    await db.commit()
+    renewal_scheduler.poke(d.get("next_renewal_at") for d in detected)
+    return subs
+
+async def latest_connection(db: AsyncSession, user_id: int) -> Optional[InstitutionConnection]:
+    return (await db.execute(
+        select(InstitutionConnection)
+        .filter_by(user_id=user_id, provider="plaid")
+        .order_by(InstitutionConnection.id.desc())
+        .limit(1)
+    )).scalars().first()
+
+@handler("scan")
+async def scan_job(user_id: int, params: dict) -> List[dict]:
+    """Job runner behind POST /subscriptions/scan_real; params: {"days": N} for a full rescan."""
+    async with get_async_sessionmaker()() as db:
+        conn = await latest_connection(db, user_id)
+        if not conn:
+            raise HTTPException(400, "No Plaid connection for user")
+        if params.get("days"):
+            return await run_scan(db, conn, params["days"])
+        return await run_sync(db, conn)
@@ -1,17 +1,80 @@
-from passlib.context import CryptContext
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from fastapi import HTTPException
 from datetime import datetime, timedelta
 from jose import jwt
-import os
+import asyncio, os, threading
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# pinning min/max to the default makes passlib flag hashes made with an older cost
+# as needing an update, so login can rehash them transparently
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+@lru_cache(maxsize=None)
+def pwd_context():
+    """Built on first signup/login: passlib is slow to import and token checks don't need it."""
+    from passlib.context import CryptContext
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=BCRYPT_ROUNDS,
+        bcrypt__min_rounds=BCRYPT_ROUNDS,
+        bcrypt__max_rounds=BCRYPT_ROUNDS,
+    )
 JWT_SECRET = os.getenv("JWT_SECRET", "dev_secret")
-JWT_ALG = os.getenv("JWT_ALG", "HS256")
+# JWT_ALGO is what token checks (utils/auth) used to read; still honored when JWT_ALG isn't set
+JWT_ALG = os.getenv("JWT_ALG") or os.getenv("JWT_ALGO") or "HS256"
+
+# bcrypt releases the GIL, so a plain thread pool gives real parallelism
+HASH_POOL_SIZE = int(os.getenv("HASH_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", "32"))
+
+class HashPool:
+    """
+    Dedicated executor for password hashing.
+    At most size + queue_limit jobs are admitted; anything beyond that is shed
+    immediately with a 503 instead of piling up behind bcrypt.
+    Routes await run_async(), so a queued login holds no thread at all; run() blocks
+    the calling thread and is for scripts and benches.
+    """
+    def __init__(self, size: int = HASH_POOL_SIZE, queue_limit: int = HASH_QUEUE_LIMIT):
+        self.size = size
+        self.queue_limit = queue_limit
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(size + queue_limit)
+        self.rejected = 0
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HTTPException(503, "Server busy, try again", headers={"Retry-After": "1"})
+        try:
+            fut = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        fut.add_done_callback(lambda _: self._slots.release())
+        return fut
+
+    def run(self, fn, *args):
+        return self._submit(fn, *args).result()
+
+    async def run_async(self, fn, *args):
+        return await asyncio.wrap_future(self._submit(fn, *args))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+hash_pool = HashPool()
+
+async def hash_password(p: str) -> str:
+    return await hash_pool.run_async(pwd_context().hash, p)
 
-def hash_password(p: str) -> str:
-    return pwd_context.hash(p)
+async def verify_password(p: str, h: str) -> bool:
+    return await hash_pool.run_async(pwd_context().verify, p, h)
 
-def verify_password(p: str, h: str) -> bool:
-    return pwd_context.verify(p, h)
+async def verify_and_update_password(p: str, h: str) -> tuple[bool, str | None]:
+    """Returns (ok, new_hash); new_hash is set when h was made with outdated cost params."""
+    return await hash_pool.run_async(pwd_context().verify_and_update, p, h)
 
 def create_token(sub: str, minutes: int = 60*24) -> str:
     now = datetime.utcnow()
@@ -0,0 +1,81 @@
+"""
+Bulk subscription writes.
+
+Scans produce a batch of rows for one user. Rather than a SELECT (and flush) per
+merchant, the user's current subscriptions are loaded in one query, unchanged rows are
+dropped, and the rest go out as a single
+INSERT .. ON CONFLICT (user_id, merchant) DO UPDATE .. RETURNING.
+"""
+from typing import Dict, List
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from ..models import Subscription
+from .versions import bump, bump_async
+
+# what SubscriptionOut needs; plain rows, no ORM objects to track
+SUB_COLUMNS = (
+    Subscription.id,
+    Subscription.merchant,
+    Subscription.plan,
+    Subscription.amount,
+    Subscription.interval,
+    Subscription.next_renewal_at,
+    Subscription.status,
+)
+
+def _insert(dialect: str):
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"bulk upsert not supported on {dialect}")
+    return insert
+
+def user_subs(user_id: int):
+    return select(*SUB_COLUMNS).where(Subscription.user_id == user_id).order_by(Subscription.id)
+
+def pending(user_id: int, current: Dict[str, dict], rows: List[dict]) -> List[dict]:
+    """Rows that would change something, one per merchant (last one wins)."""
+    out: Dict[str, dict] = {}
+    for r in rows:
+        row = {**r, "user_id": user_id}
+        cur = current.get(row["merchant"])
+        if cur is None or any(cur[k] != v for k, v in row.items() if k in cur):
+            out[row["merchant"]] = row
+    return list(out.values())
+
+def upsert_stmt(dialect: str, rows: List[dict]):
+    """
+    Every row must have the same keys; those other than the conflict key get overwritten.
+    Columns left out (e.g. status) keep their value on update and their default on insert.
+    """
+    ins = _insert(dialect)(Subscription).values(rows)
+    fields = [k for k in rows[0] if k not in ("user_id", "merchant")]
+    return ins.on_conflict_do_update(
+        index_elements=["user_id", "merchant"],
+        set_={k: ins.excluded[k] for k in fields},
+    ).returning(*SUB_COLUMNS)
+
+def upsert_subscriptions(db: Session, user_id: int, rows: List[dict]) -> Dict[str, dict]:
+    """
+    Upsert `rows` for the user; returns all of their subscriptions by merchant.
+    Bumps the user's data version if anything changed. Caller commits.
+    """
+    current = {r["merchant"]: dict(r) for r in db.execute(user_subs(user_id)).mappings()}
+    todo = pending(user_id, current, rows)
+    if todo:
+        stmt = upsert_stmt(db.get_bind().dialect.name, todo)
+        current.update({r["merchant"]: dict(r) for r in db.execute(stmt).mappings()})
+        bump(db, user_id)
+    return current
+
+async def upsert_subscriptions_async(db: AsyncSession, user_id: int, rows: List[dict]) -> Dict[str, dict]:
+    current = {r["merchant"]: dict(r) for r in (await db.execute(user_subs(user_id))).mappings()}
+    todo = pending(user_id, current, rows)
+    if todo:
+        stmt = upsert_stmt(db.get_bind().dialect.name, todo)
+        current.update({r["merchant"]: dict(r) for r in (await db.execute(stmt)).mappings()})
+        await bump_async(db, user_id)
+    return current
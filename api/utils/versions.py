@@ -0,0 +1,69 @@
+"""
+Per-user data version + conditional GETs for the subscription lists.
+
+users.data_version goes up by one in the same transaction as any write to the user's
+subscriptions, approvals or cancellations (bump / bump_async). Read endpoints key their
+ETag and a short-lived response cache on it:
+
+    v = current_version(db, me.id)            # one primary-key lookup on users
+    if (r := not_modified(request, etag)): return r
+    body = response_cache.get((me.id, key, v)) or <query + serialize, then cache>
+
+so a dashboard refetch with If-None-Match answers 304 without touching subscriptions,
+and a repeat fetch from a client without the ETag is served from memory. A bump
+changes the key, so stale entries are never served -- they just age out.
+"""
+import hashlib, os
+from typing import Callable, Optional
+from fastapi import Request, Response
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from ..models import User
+from .cache import TTLCache
+
+SUBS_CACHE_TTL = float(os.getenv("SUBS_CACHE_TTL", "30"))
+SUBS_CACHE_SIZE = int(os.getenv("SUBS_CACHE_SIZE", "2048"))
+
+response_cache = TTLCache(maxsize=SUBS_CACHE_SIZE, ttl=SUBS_CACHE_TTL)
+
+def _bump(user_id: int):
+    return update(User).where(User.id == user_id).values(data_version=User.data_version + 1)
+
+def bump(db: Session, user_id: int):
+    """Mark the user's data changed. Runs in the caller's transaction; caller commits."""
+    db.execute(_bump(user_id))
+
+async def bump_async(db: AsyncSession, user_id: int):
+    await db.execute(_bump(user_id))
+
+def current_version(db: Session, user_id: int) -> int:
+    return db.execute(select(User.data_version).where(User.id == user_id)).scalar() or 0
+
+def make_etag(user_id: int, key: str, version: int) -> str:
+    # user id is in there so a shared browser never revalidates one user's copy for another
+    h = hashlib.blake2b(f"{user_id}:{key}:{version}".encode(), digest_size=8).hexdigest()
+    return f'W/"{h}"'
+
+def _headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Authorization"}
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """A 304 if the client's If-None-Match already has this version, else None."""
+    inm = request.headers.get("if-none-match")
+    if inm and (inm.strip() == "*" or etag in [t.strip() for t in inm.split(",")]):
+        return Response(status_code=304, headers=_headers(etag))
+    return None
+
+def cached_json(request: Request, user_id: int, key: str, version: int,
+                build: Callable[[], bytes]) -> Response:
+    """304, cached body, or build() -- all under the ETag for (user, key, version)."""
+    etag = make_etag(user_id, key, version)
+    r = not_modified(request, etag)
+    if r is not None:
+        return r
+    body = response_cache.get((user_id, key, version))
+    if body is None:
+        body = build()
+        response_cache.set((user_id, key, version), body)
+    return Response(content=body, media_type="application/json", headers=_headers(etag))
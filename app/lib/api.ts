@@ -1,4 +1,4 @@
-const API_BASE =
+export const API_BASE =
   process.env.NEXT_PUBLIC_API_BASE || "https://approval-v2.onrender.com";
 
 function authHeaders(token?: string) {
@@ -21,3 +21,16 @@ export async function api(path: string, opts: RequestInit = {}, token?: string)
   }
   return res.json();
 }
+
+// Background jobs (e.g. POST /subscriptions/scan_real answers 202 with a job).
+// Polls GET /jobs/{id} until it finishes; resolves with the job result.
+export async function waitForJob(jobId: string, token?: string, intervalMs = 1000, timeoutMs = 5 * 60 * 1000) {
+  const deadline = Date.now() + timeoutMs;
+  while (Date.now() < deadline) {
+    const job = await api(`/jobs/${jobId}`, {}, token);
+    if (job.status === "done") return job.result;
+    if (job.status === "failed") throw new Error(job.error || "Job failed.");
+    await new Promise((r) => setTimeout(r, intervalMs));
+  }
+  throw new Error("Timed out waiting for job.");
+}
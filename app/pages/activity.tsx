@@ -1,14 +1,43 @@
 import { useEffect, useState } from "react";
-import { api } from "../lib/api";
+import { api, API_BASE } from "../lib/api";
+
+const PAGE = 50;
 
 export default function Activity() {
   const [items, setItems] = useState<any[]>([]);
   const [err, setErr] = useState<string | null>(null);
+  const [more, setMore] = useState<boolean>(false);
+  const [loading, setLoading] = useState<boolean>(false);
 
-  useEffect(() => {
+  async function load(beforeId?: number) {
     const t = localStorage.getItem("token");
     if (!t) { setErr("Please sign in first."); return; }
-    api("/events/", {}, t).then(setItems).catch(e => setErr(e.message));
+    setLoading(true);
+    try {
+      const qs = `?limit=${PAGE}` + (beforeId ? `&before_id=${beforeId}` : "");
+      const page = await api(`/events/${qs}`, {}, t);
+      setItems((prev) => (beforeId ? [...prev, ...page] : page));
+      setMore(page.length === PAGE);
+    } catch (e: any) {
+      setErr(e.message);
+    } finally {
+      setLoading(false);
+    }
+  }
+
+  useEffect(() => { load(); }, []);
+
+  // Live updates: the server pushes new events; on reconnect the browser sends
+  // Last-Event-ID and the server replays what was missed.
+  useEffect(() => {
+    const t = localStorage.getItem("token");
+    if (!t || typeof EventSource === "undefined") return;
+    const es = new EventSource(`${API_BASE}/events/stream?token=${encodeURIComponent(t)}`);
+    es.onmessage = (m) => {
+      const ev = JSON.parse(m.data);
+      setItems((prev) => (prev.some((x) => x.id === ev.id) ? prev : [ev, ...prev]));
+    };
+    return () => es.close();
   }, []);
 
   return (
@@ -24,6 +53,11 @@ export default function Activity() {
         ))}
         {items.length === 0 && !err && <p>No activity yet.</p>}
       </ul>
+      {more && (
+        <button type="button" onClick={() => load(items[items.length - 1]?.id)} disabled={loading}>
+          {loading ? "Loading…" : "Load older"}
+        </button>
+      )}
     </main>
   );
 }
@@ -1,6 +1,6 @@
 import Script from "next/script";
 import { useState } from "react";
-import { api } from "../lib/api";
+import { api, waitForJob } from "../lib/api";
 
 export default function Connect() {
   const [err, setErr] = useState<string>("");
@@ -23,8 +23,9 @@ export default function Connect() {
             body: JSON.stringify({ public_token }),
           }, t);
 
-          // 4) Trigger a real scan to pull subs
-          await api("/subscriptions/scan_real", { method: "POST" }, t);
+          // 4) Queue a real scan to pull subs and wait for it to finish
+          const job = await api("/subscriptions/scan_real", { method: "POST" }, t);
+          await waitForJob(job.id, t);
 
           // 5) Go back to dashboard
           window.location.href = "/dashboard";
@@ -1,7 +1,7 @@
 // app/pages/dashboard.tsx
 import Link from "next/link";
 import { useEffect, useState } from "react";
-import { api } from "../lib/api";
+import { api, waitForJob } from "../lib/api";
 
 // ----- types -----
 type Subscription = {
@@ -42,6 +42,7 @@ const prettyInterval = (x: any): string => {
   if (!v) return "";
   if (["mo", "mon", "month", "monthly"].includes(v)) return "month";
   if (["yr", "year", "yearly", "annual", "annually"].includes(v)) return "year";
+  if (v.startsWith("quarter")) return "quarter";
   if (v.startsWith("week")) return "week";
   if (v.startsWith("day")) return "day";
   return v;
@@ -84,7 +85,8 @@ export default function Dashboard() {
     setLoading(true);
     setError("");
     try {
-      await api("/subscriptions/scan_real", { method: "POST" }, token);
+      const job = await api("/subscriptions/scan_real", { method: "POST" }, token);
+      await waitForJob(job.id, token);
       await loadSubs();
     } catch (e: any) {
       setError(e?.message || "Rescan failed.");
@@ -0,0 +1,28 @@
+import asyncio, os, tempfile
+import pytest
+
+# set before anything imports api.db: a throwaway SQLite database and no background workers
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/test.db"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ.update(CANCEL_ENGINE="0", RENEWAL_SCHEDULER="0", BCRYPT_ROUNDS="4")
+
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    from api.migrations import migrate
+    migrate()
+    yield
+    from api.utils.log import event_sink
+    event_sink.stop()
+
+@pytest.fixture
+def run():
+    """asyncio.run for one test; the async engine is bound to that loop, so it's disposed after."""
+    from api.db import dispose_async_engine
+    def go(coro):
+        async def main():
+            try:
+                return await coro
+            finally:
+                await dispose_async_engine()
+        return asyncio.run(main())
+    return go
@@ -0,0 +1,136 @@
+import asyncio, itertools
+from datetime import datetime, timedelta
+from sqlalchemy import select, text
+from api.db import SessionLocal
+from api.models import CancellationRequest, EventLog, Subscription, User
+from api.utils.cancel_engine import (CANCEL_MAX_ATTEMPTS, FAILED, IN_PROGRESS, PENDING, SUCCEEDED,
+                                     Adapter, CancelEngine, adapter)
+from api.utils.log import event_sink
+
+_ids = itertools.count(1)
+PAST = datetime(2000, 1, 1)
+
+@adapter("test-lease", vendors=["Leaseco"])
+class LeaseAdapter(Adapter):
+    """Hangs while `hang` is set (a process dying mid-call), else answers straight away."""
+    hang = True
+    rate = 1000
+
+    async def submit(self, req):
+        while self.hang:
+            await asyncio.sleep(0.05)
+        return f"ref-{req['id']}"
+
+    async def verify(self, req):
+        return "waiting"
+
+def make_request(merchant="Leaseco", **cols) -> CancellationRequest:
+    n = next(_ids)
+    with SessionLocal() as db:
+        user = User(email=f"lease{n}@t.com", pw_hash="x")
+        db.add(user); db.flush()
+        sub = Subscription(user_id=user.id, merchant=merchant, amount=9.99, interval="monthly")
+        db.add(sub); db.flush()
+        # cancel_status / canceled_at are migration-added columns, not on the model
+        db.execute(text("UPDATE subscriptions SET cancel_status='in_progress' WHERE id=:id"), {"id": sub.id})
+        req = CancellationRequest(subscription_id=sub.id, user_id=user.id, vendor=merchant.lower(), method="auto",
+                                  **{"status": PENDING, "attempts": 0, "checks": 0, **cols})
+        db.add(req); db.commit()
+        db.refresh(req); db.expunge(req)
+        return req
+
+def load(req_id: int):
+    with SessionLocal() as db:
+        req = db.get(CancellationRequest, req_id)
+        sub = db.execute(text("SELECT cancel_status, canceled_at FROM subscriptions WHERE id=:id"),
+                         {"id": req.subscription_id}).one()
+        types = db.scalars(select(EventLog.type).where(EventLog.user_id == req.user_id)).all()
+        db.expunge_all()
+        return req, sub, types
+
+def as_dict(req: CancellationRequest) -> dict:
+    return {"id": req.id, "subscription_id": req.subscription_id, "user_id": req.user_id, "vendor": req.vendor,
+            "vendor_ref": req.vendor_ref, "attempts": req.attempts, "checks": req.checks, "started_at": req.started_at}
+
+def test_unexpired_lease_is_left_alone(run):
+    req = make_request(status=IN_PROGRESS, attempts=1, next_check_at=datetime.utcnow() + timedelta(minutes=5))
+    assert run(CancelEngine().verify_once()) == 0
+    assert load(req.id)[0].status == IN_PROGRESS
+
+def test_expired_lease_without_a_submit_is_handed_back(run):
+    req = make_request(status=IN_PROGRESS, attempts=1, next_check_at=PAST)
+    run(CancelEngine().verify_once())
+    after, _, _ = load(req.id)
+    assert after.status == PENDING and after.next_check_at is None and after.attempts == 1
+
+def test_expired_lease_out_of_attempts_fails(run):
+    req = make_request(status=IN_PROGRESS, attempts=CANCEL_MAX_ATTEMPTS, next_check_at=PAST)
+    run(CancelEngine().verify_once())
+    after, sub, types = load(req.id)
+    assert after.status == FAILED and after.error == "vendor call never completed"
+    assert sub.cancel_status == "failed"
+    assert types == ["cancel.failed"]
+
+def test_crash_mid_submit_is_retried_and_the_stale_submit_writes_nothing(run):
+    req = make_request()
+    LeaseAdapter.hang = True
+    async def crash():
+        e = CancelEngine()
+        await e.start()
+        await asyncio.sleep(0.3)  # claimed and stuck in submit
+        await e.stop()
+    run(crash())
+    claimed, _, _ = load(req.id)
+    assert claimed.status == IN_PROGRESS and claimed.attempts == 1 and claimed.vendor_ref is None
+    assert claimed.next_check_at > datetime.utcnow()  # leased: nobody else touches it yet
+    assert run(CancelEngine().verify_once()) == 0
+
+    with SessionLocal() as db:  # ...until the lease runs out
+        db.get(CancellationRequest, req.id).next_check_at = PAST
+        db.commit()
+    assert run(CancelEngine().verify_once()) == 1
+    assert load(req.id)[0].status == PENDING
+
+    LeaseAdapter.hang = False
+    async def retry():
+        e = CancelEngine()
+        await e.start()
+        for _ in range(100):
+            if load(req.id)[0].vendor_ref:
+                break
+            await asyncio.sleep(0.05)
+        await e.stop()
+        # the first worker's submit finally returns: its claim (attempt 1) is gone
+        await e._record_submit(as_dict(claimed), "stale-ref", None, True)
+    run(retry())
+    event_sink.flush()
+    after, sub, types = load(req.id)
+    assert after.status == IN_PROGRESS and after.attempts == 2
+    assert after.vendor_ref == f"ref-{req.id}"
+    assert types.count("cancel.queued") == 1
+
+def test_late_outcome_for_a_settled_request_writes_nothing(run):
+    req = make_request(status=FAILED, attempts=1, vendor_ref="r", completed_at=PAST)
+    e = CancelEngine()
+    async def late():
+        async with e._session() as db:
+            await e._succeed(db, [as_dict(req)], datetime.utcnow())
+            await db.commit()
+    run(late())
+    after, sub, types = load(req.id)
+    assert after.status == FAILED
+    assert sub.cancel_status == "in_progress" and sub.canceled_at is None
+    assert types == [] and e.counts["succeeded"] == 0
+
+def test_confirmed_request_cancels_the_subscription(run):
+    req = make_request(status=IN_PROGRESS, attempts=1, vendor_ref="r", next_check_at=PAST)
+    e = CancelEngine()
+    async def confirm():
+        async with e._session() as db:
+            await e._succeed(db, [as_dict(req)], datetime.utcnow())
+            await db.commit()
+    run(confirm())
+    after, sub, types = load(req.id)
+    assert after.status == SUCCEEDED
+    assert sub.cancel_status == "canceled" and sub.canceled_at is not None
+    assert types == ["cancel.succeeded"]
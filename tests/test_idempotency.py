@@ -0,0 +1,118 @@
+import asyncio, json
+import httpx
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import func, select
+from api.db import SessionLocal
+from api.models import Approval
+from api.utils import idempotency
+from api.utils.idempotency import idempotent
+
+def handler(result=None, exc=None):
+    calls = []
+    async def run():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        if exc is not None:
+            raise exc
+        return result
+    return run, calls
+
+def replayed(resp) -> dict:
+    assert resp.headers["Idempotent-Replayed"] == "true"
+    return json.loads(resp.body)
+
+def test_replay_returns_the_first_response_without_rerunning(run):
+    h, calls = handler({"ok": 1})
+    async def go():
+        first = await idempotent("replay", 1, "POST /t", {"a": 1}, h)
+        again = await idempotent("replay", 1, "POST /t", {"a": 1}, h)
+        return first, again
+    first, again = run(go())
+    assert first == {"ok": 1}
+    assert again.status_code == 200 and replayed(again) == {"ok": 1}
+    assert len(calls) == 1
+
+def test_replay_survives_a_cold_cache(run):
+    # another process (or a restart) only has the idempotency_keys row to go on
+    h, calls = handler({"ok": 2})
+    run(idempotent("cold", 1, "POST /t", {"a": 1}, h))
+    idempotency._cache.clear()
+    again = run(idempotent("cold", 1, "POST /t", {"a": 1}, h))
+    assert replayed(again) == {"ok": 2}
+    assert len(calls) == 1
+
+@pytest.mark.parametrize("cold", [False, True])
+def test_same_key_different_body_is_422(run, cold):
+    h, calls = handler({"ok": 3})
+    key = f"mismatch-{cold}"
+    run(idempotent(key, 1, "POST /t", {"a": 1}, h))
+    if cold:
+        idempotency._cache.clear()
+    with pytest.raises(HTTPException) as e:
+        run(idempotent(key, 1, "POST /t", {"a": 2}, h))
+    assert e.value.status_code == 422
+    assert len(calls) == 1
+
+def test_same_key_other_route_is_422(run):
+    h, _ = handler({"ok": 4})
+    run(idempotent("route", 1, "POST /t", {"a": 1}, h))
+    with pytest.raises(HTTPException) as e:
+        run(idempotent("route", 1, "POST /u", {"a": 1}, h))
+    assert e.value.status_code == 422
+
+def test_keys_are_per_user(run):
+    h, calls = handler({"ok": 5})
+    run(idempotent("shared", 1, "POST /t", {"a": 1}, h))
+    assert run(idempotent("shared", 2, "POST /t", {"a": 2}, h)) == {"ok": 5}
+    assert len(calls) == 2
+
+def test_concurrent_duplicates_run_once(run):
+    h, calls = handler({"ok": 6})
+    async def go():
+        return await asyncio.gather(*(idempotent("burst", 1, "POST /t", {"a": 1}, h) for _ in range(5)))
+    out = run(go())
+    assert len(calls) == 1
+    assert sum(isinstance(r, dict) for r in out) == 1
+    assert all(replayed(r) == {"ok": 6} for r in out if not isinstance(r, dict))
+
+def test_4xx_is_stored_and_replayed(run):
+    h, calls = handler(exc=HTTPException(404, "subscription not found"))
+    with pytest.raises(HTTPException) as e:  # the first caller sees the error as usual
+        run(idempotent("notfound", 1, "POST /t", {"a": 1}, h))
+    assert e.value.status_code == 404
+    for cold in (False, True):
+        if cold:
+            idempotency._cache.clear()
+        again = run(idempotent("notfound", 1, "POST /t", {"a": 1}, h))
+        assert again.status_code == 404 and replayed(again) == {"detail": "subscription not found"}
+    assert len(calls) == 1
+
+def test_5xx_releases_the_key(run):
+    h, calls = handler(exc=HTTPException(503, "try later"))
+    with pytest.raises(HTTPException):
+        run(idempotent("flaky", 1, "POST /t", {"a": 1}, h))
+    ok, _ = handler({"ok": 7})
+    assert run(idempotent("flaky", 1, "POST /t", {"a": 1}, ok)) == {"ok": 7}
+    assert len(calls) == 1
+
+def test_approvals_endpoint_replays(run):
+    from api.main import app
+    async def go():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://t") as c:
+            tok = (await c.post("/auth/signup", json={"email": "idem@t.com", "password": "pw"})).json()["access_token"]
+            h = {"Authorization": f"Bearer {tok}"}
+            sub = (await c.post("/subscriptions/scan", headers=h)).json()[0]["id"]
+            hk = {**h, "Idempotency-Key": "approve-1"}
+            body = {"subscription_id": sub, "decision": "approve"}
+            first = await c.post("/approvals", json=body, headers=hk)
+            again = await c.post("/approvals", json=body, headers=hk)
+            other = await c.post("/approvals", json={**body, "decision": "deny"}, headers=hk)
+            return first, again, other, sub
+    first, again, other, sub = run(go())
+    assert first.status_code == 200 and "Idempotent-Replayed" not in first.headers
+    assert again.status_code == 200 and again.headers["Idempotent-Replayed"] == "true"
+    assert again.json() == first.json()
+    assert other.status_code == 422
+    with SessionLocal() as db:
+        assert db.scalar(select(func.count()).where(Approval.subscription_id == sub)) == 1
@@ -0,0 +1,83 @@
+import json
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import IntegrityError
+from api.migrations import MIGRATIONS, _unique_user_merchant, current_version, migrate
+
+LEGACY = [
+    "CREATE TABLE subscriptions (id INTEGER PRIMARY KEY, user_id INT, merchant TEXT)",
+    "CREATE TABLE approvals (id INTEGER PRIMARY KEY, user_id INT, subscription_id INT)",
+    "CREATE TABLE cancellation_requests (id INTEGER PRIMARY KEY, subscription_id INT)",
+]
+
+def legacy(event_column: bool):
+    """Pre-migration-3 tables (event_logs with or without migration 5's subscription_id column)."""
+    eng = create_engine("sqlite://")
+    with eng.begin() as c:
+        for ddl in LEGACY:
+            c.exec_driver_sql(ddl)
+        c.exec_driver_sql("CREATE TABLE event_logs (id INTEGER PRIMARY KEY, user_id INT, payload TEXT"
+                          + (", subscription_id INT)" if event_column else ")"))
+        # user 1 has Netflix three times (1, 2, 4); user 2's Netflix is a different subscription
+        c.exec_driver_sql("INSERT INTO subscriptions VALUES (1,1,'Netflix'),(2,1,'Netflix'),(3,1,'Hulu'),"
+                          "(4,1,'Netflix'),(5,2,'Netflix')")
+        c.exec_driver_sql("INSERT INTO approvals VALUES (1,1,2),(2,1,3),(3,2,5)")
+        c.exec_driver_sql("INSERT INTO cancellation_requests VALUES (1,4),(2,5)")
+    return eng
+
+def add_events(eng, event_column: bool, payloads):
+    with eng.begin() as c:
+        for i, p in enumerate(payloads, 1):
+            raw = p if isinstance(p, str) else json.dumps(p)
+            sid = p.get("subscription_id") if isinstance(p, dict) else None
+            if event_column:
+                c.exec_driver_sql("INSERT INTO event_logs VALUES (?,1,?,?)", (i, raw, sid))
+            else:
+                c.exec_driver_sql("INSERT INTO event_logs VALUES (?,1,?)", (i, raw))
+
+def rows(eng, sql):
+    with eng.connect() as c:
+        return c.exec_driver_sql(sql).all()
+
+@pytest.mark.parametrize("event_column", [False, True])
+def test_fold_keeps_the_oldest_and_repoints(event_column):
+    eng = legacy(event_column)
+    add_events(eng, event_column, [{"subscription_id": 2, "x": 1}, {"subscription_id": 4}, {"subscription_id": 3},
+                                   {"subscription_id": 5}, {}, ""])
+    with eng.begin() as c:
+        _unique_user_merchant(c)
+
+    assert rows(eng, "SELECT * FROM subscriptions ORDER BY id") == [(1, 1, "Netflix"), (3, 1, "Hulu"), (5, 2, "Netflix")]
+    assert rows(eng, "SELECT id, subscription_id FROM approvals ORDER BY id") == [(1, 1), (2, 3), (3, 5)]
+    assert rows(eng, "SELECT id, subscription_id FROM cancellation_requests ORDER BY id") == [(1, 1), (2, 5)]
+
+    events = dict(rows(eng, "SELECT id, payload FROM event_logs"))
+    assert json.loads(events[1]) == {"subscription_id": 1, "x": 1}  # the rest of the payload survives
+    assert json.loads(events[2]) == {"subscription_id": 1}
+    assert json.loads(events[3]) == {"subscription_id": 3}
+    assert json.loads(events[4]) == {"subscription_id": 5}  # another user's Netflix isn't touched
+    assert events[5] == "{}" and events[6] == ""            # nothing to repoint, and not valid JSON
+    if event_column:
+        assert dict(rows(eng, "SELECT id, subscription_id FROM event_logs")) == {1: 1, 2: 1, 3: 3, 4: 5, 5: None, 6: None}
+
+def test_fold_adds_the_unique_index_and_reruns_cleanly():
+    eng = legacy(True)
+    for _ in range(2):
+        with eng.begin() as c:
+            _unique_user_merchant(c)
+    assert any(i["unique"] and i["column_names"] == ["user_id", "merchant"]
+               for i in inspect(eng).get_indexes("subscriptions"))
+    with pytest.raises(IntegrityError), eng.begin() as c:
+        c.exec_driver_sql("INSERT INTO subscriptions VALUES (6,1,'Hulu')")
+
+def test_migrate_fresh_database(tmp_path):
+    eng = create_engine(f"sqlite:///{tmp_path}/fresh.db")
+    latest = MIGRATIONS[-1][0]
+    assert current_version(eng) is None
+    assert migrate(eng) == latest
+    assert current_version(eng) == latest
+    with eng.connect() as c:
+        assert c.execute(text("SELECT version FROM schema_version ORDER BY version")).scalars().all() == \
+            list(range(1, latest + 1))
+    assert migrate(eng) == latest  # already there: nothing re-runs
+    assert len(rows(eng, "SELECT * FROM schema_version")) == latest